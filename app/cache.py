@@ -0,0 +1,343 @@
+"""
+In-process caches for the search pipeline.
+
+Caches are bounded by size and entry age, are safe to share between the event
+loop and threadpool workers, and keep hit/miss counters for the /search/stats
+endpoint.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import numpy as np
+
+from .settings import settings
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalize a query string for use in cache keys.
+    
+    Case, surrounding whitespace, repeated whitespace and trailing punctuation do
+    not change the answer, so "How do I deploy?" and "how do i  deploy" share a key.
+    
+    Args:
+        text: The raw query string
+    
+    Returns:
+        The normalized query string
+    """
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!.").strip().casefold()
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with a per-entry time to live.
+    
+    The least recently used entry is evicted once max_size entries are stored, and
+    entries older than ttl_seconds are treated as misses and dropped on access.
+    A max_size of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Look up a key, refreshing its recency on a hit.
+        
+        Args:
+            key: The cache key
+        
+        Returns:
+            The cached value, or None on a miss or if the entry expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Store a value, evicting the least recently used entries if the cache is full.
+        
+        Args:
+            key: The cache key
+            value: The value to cache (must not be None)
+        """
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all entries; counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get cache counters.
+        
+        Returns:
+            Dict with size, max_size, ttl_seconds, hits, misses, hit_rate,
+            evictions and expirations
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class EmbeddingCache(LRUCache):
+    """
+    LRU cache of embedding vectors stored as compact float32 arrays.
+    
+    Embeddings for a given model and text never change, so entries do not expire.
+    Besides hits and misses, the cache tracks how long the embedding calls it could
+    not serve took, to show the latency the hits avoided.
+    """
+
+    def __init__(self, max_size: int):
+        super().__init__(max_size=max_size, ttl_seconds=float("inf"))
+        self.embed_calls = 0
+        self.embed_seconds = 0.0
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """
+        Look up a cached embedding.
+        
+        Args:
+            key: The cache key, e.g. (model id, normalized text)
+        
+        Returns:
+            The embedding as a float32 array, or None on a miss
+        """
+        return super().get(key)
+
+    def set(self, key: Hashable, value):
+        """
+        Store an embedding as a float32 array.
+        
+        Args:
+            key: The cache key
+            value: The embedding vector (list or array)
+        """
+        super().set(key, np.asarray(value, dtype=np.float32))
+
+    def record_embed(self, seconds: float, count: int = 1):
+        """
+        Record the latency of an embedding call made for cache misses.
+        
+        Args:
+            seconds: Wall-clock duration of the call
+            count: Number of texts embedded by the call
+        """
+        with self._lock:
+            self.embed_calls += count
+            self.embed_seconds += seconds
+
+    def stats(self) -> dict:
+        """
+        Get cache counters.
+        
+        Returns:
+            Dict with the LRUCache counters plus the memory used by cached vectors,
+            the average latency per embedded text and the latency saved by hits
+        """
+        stats = super().stats()
+        with self._lock:
+            avg_seconds = self.embed_seconds / self.embed_calls if self.embed_calls else 0.0
+            stats.update({
+                "bytes": sum(vector.nbytes for _, vector in self._entries.values()),
+                "avg_embed_latency_ms": avg_seconds * 1000,
+                "saved_latency_ms": avg_seconds * self.hits * 1000,
+            })
+        return stats
+
+
+class SemanticCache:
+    """
+    Thread-safe answer cache matched by query embedding similarity.
+    
+    Each entry stores the unit-normalized query embedding in one row of a
+    preallocated float32 matrix. A lookup scores every stored embedding with a
+    single matrix-vector product and returns the best entry in the same partition
+    (e.g. same top_k, response_mode and index generation) whose cosine similarity
+    reaches the threshold. Entries expire after ttl_seconds; when the cache is full
+    the least recently used entry is replaced. A max_size of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int, threshold: float, ttl_seconds: float):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._partitions = np.full(max_size, -1, dtype=np.int64)
+        self._stored_at = np.zeros(max_size, dtype=np.float64)
+        self._used_at = np.zeros(max_size, dtype=np.float64)
+        self._values = [None] * max_size
+        self._partition_ids = {}
+        self._next_partition_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _live_mask(self, partition_id: int, now: float) -> np.ndarray:
+        return (self._partitions == partition_id) & (now - self._stored_at <= self.ttl_seconds)
+
+    def get(self, partition: Hashable, embedding) -> Optional[Any]:
+        """
+        Find the cached value whose query embedding is most similar to this one.
+        
+        Args:
+            partition: Only entries stored under an equal partition can match
+            embedding: The query embedding
+        
+        Returns:
+            The best matching cached value, or None if none reaches the threshold
+        """
+        with self._lock:
+            partition_id = self._partition_ids.get(partition)
+            if self._embeddings is None or partition_id is None:
+                self.misses += 1
+                return None
+
+            now = time.monotonic()
+            scores = self._embeddings @ self._unit(embedding)
+            scores[~self._live_mask(partition_id, now)] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._used_at[best] = now
+            self.hits += 1
+            return self._values[best]
+
+    def set(self, partition: Hashable, embedding, value: Any):
+        """
+        Store a value under its query embedding.
+        
+        Args:
+            partition: Partition the entry belongs to
+            embedding: The query embedding
+            value: The value to cache
+        """
+        if self.max_size <= 0:
+            return
+
+        vector = self._unit(embedding)
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+
+            partition_id = self._partition_ids.get(partition)
+            if partition_id is None:
+                partition_id = self._partition_ids[partition] = self._next_partition_id
+                self._next_partition_id += 1
+            now = time.monotonic()
+
+            # Reuse an empty or expired slot first, otherwise the least recently used one
+            free = np.flatnonzero(
+                (self._partitions == -1) | (now - self._stored_at > self.ttl_seconds)
+            )
+            slot = int(free[0]) if free.size else int(np.argmin(self._used_at))
+
+            self._embeddings[slot] = vector
+            self._partitions[slot] = partition_id
+            self._stored_at[slot] = now
+            self._used_at[slot] = now
+            self._values[slot] = value
+
+            # Forget partitions that no longer have entries (e.g. old index generations)
+            live = set(self._partitions[self._partitions >= 0].tolist())
+            self._partition_ids = {
+                key: pid for key, pid in self._partition_ids.items() if pid in live
+            }
+
+    def clear(self):
+        """Remove all entries; counters are kept."""
+        with self._lock:
+            self._partitions[:] = -1
+            self._values = [None] * self.max_size
+            self._partition_ids = {}
+
+    def stats(self) -> dict:
+        """
+        Get cache counters.
+        
+        Returns:
+            Dict with size, max_size, threshold, hits, misses and hit_rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": int(np.count_nonzero(self._partitions >= 0)),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Query embeddings keyed by (embedding model id, normalized query)
+query_embedding_cache = EmbeddingCache(max_size=settings.rag_query_embedding_cache_size)
+
+# Answers for /search keyed by (normalized query, top_k, response_mode, index generation).
+# A corpus change bumps the index generation, so stale answers are never matched again
+# and age out of the LRU order.
+answer_cache = LRUCache(
+    max_size=settings.rag_answer_cache_size,
+    ttl_seconds=settings.rag_answer_cache_ttl_seconds,
+)
+
+# Answers for /search matched by query embedding similarity, partitioned by
+# (top_k, response_mode, index generation), so paraphrased questions reuse an answer
+semantic_answer_cache = SemanticCache(
+    max_size=settings.rag_semantic_cache_size,
+    threshold=settings.rag_semantic_cache_threshold,
+    ttl_seconds=settings.rag_answer_cache_ttl_seconds,
+)
@@ -0,0 +1,117 @@
+"""
+Single-flight request coalescing.
+
+Concurrent callers asking for the same key share one in-flight computation
+instead of each running their own, and all receive its result (or exception).
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key.
+    
+    Results are handed over through concurrent.futures.Future objects, which can be
+    awaited from any event loop and waited on from any thread, so async handlers
+    and threadpool workers can coalesce on the same key. The key is released as
+    soon as the computation finishes; later calls start a new one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def _join(self, key: Hashable) -> tuple[concurrent.futures.Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.followers += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key: Hashable, future: concurrent.futures.Future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn() unless a call with the same key is in flight, then share its result.
+        
+        The leader's computation runs as its own task, so if the leader's request is
+        cancelled (e.g. the client disconnects) the followers still get a result.
+        
+        Args:
+            key: Identifies identical requests
+            fn: Coroutine function producing the result
+        
+        Returns:
+            The result of the shared computation
+        """
+        future, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(fn())
+
+            def on_done(task: asyncio.Task):
+                if task.cancelled():
+                    self._finish(key, future, error=asyncio.CancelledError())
+                elif task.exception() is not None:
+                    self._finish(key, future, error=task.exception())
+                else:
+                    self._finish(key, future, result=task.result())
+
+            task.add_done_callback(on_done)
+        # Each caller waits on its own wrapper; shielding it keeps a cancelled
+        # caller from cancelling the shared future the others are waiting on
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def do_sync(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Blocking variant of do() for threadpool callers.
+        
+        Args:
+            key: Identifies identical requests
+            fn: Function producing the result
+        
+        Returns:
+            The result of the shared computation
+        """
+        future, leader = self._join(key)
+        if leader:
+            try:
+                result = fn()
+            except BaseException as e:
+                self._finish(key, future, error=e)
+                raise
+            self._finish(key, future, result=result)
+            return result
+        return future.result()
+
+    def stats(self) -> dict:
+        """
+        Get coalescing counters.
+        
+        Returns:
+            Dict with the number of in-flight keys, computations started (leaders)
+            and calls that joined one already in flight (followers)
+        """
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "followers": self.followers,
+            }
@@ -0,0 +1,119 @@
+"""
+In-memory corpus statistics.
+
+Keeps the number of indexed chunks, in total and per repository, so the search
+endpoints can report and check them without querying the documents table on
+every request.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+from .db import add_index_change_listener, get_corpus_stats
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CorpusStats:
+    """
+    Chunk counts read from the database and served from memory.
+
+    The first read loads the counts; after that, readers get the in-memory
+    snapshot and a refresh runs in a background thread once the snapshot is
+    invalidated (the documents table changed) or older than
+    settings.rag_corpus_stats_refresh_seconds. An empty snapshot is re-read
+    before it is returned, so documents indexed into an empty table are
+    searchable straight away instead of 404ing until the next refresh.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._total = None
+        self._by_repo = {}
+        self._loaded_at = 0.0
+        self._stale = True
+        self._refreshing = False
+        self.refreshes = 0
+        self.errors = 0
+
+    def invalidate(self):
+        """Mark the snapshot stale so the next read refreshes it"""
+        with self._lock:
+            self._stale = True
+
+    def refresh(self) -> bool:
+        """
+        Re-read the counts from the database (blocking).
+
+        Returns:
+            True if the snapshot was updated
+        """
+        # Clear the flag first so an invalidation during the read is not lost
+        with self._lock:
+            self._stale = False
+
+        stats, message = get_corpus_stats()
+        if stats is None:
+            logger.warning(message)
+            with self._lock:
+                self._stale = True
+                self.errors += 1
+            return False
+
+        total, by_repo = stats
+        with self._lock:
+            self._total = total
+            self._by_repo = by_repo
+            self._loaded_at = time.monotonic()
+            self.refreshes += 1
+        return True
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _maybe_start_refresh(self):
+        with self._lock:
+            expired = time.monotonic() - self._loaded_at >= settings.rag_corpus_stats_refresh_seconds
+            if self._refreshing or not (self._stale or expired):
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    async def document_count(self) -> Optional[int]:
+        """
+        Get the number of indexed chunks.
+
+        Only the first call, and calls while the count is 0, wait for the
+        database; later calls return the in-memory count immediately.
+
+        Returns:
+            The chunk count, or None if it has never been read successfully
+        """
+        if not self._total:
+            await asyncio.to_thread(self.refresh)
+        else:
+            self._maybe_start_refresh()
+        return self._total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "documents_count": self._total,
+                "documents_by_repo": dict(self._by_repo),
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._total is not None else None,
+                "stale": self._stale,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+            }
+
+
+corpus_stats = CorpusStats()
+add_index_change_listener(corpus_stats.invalidate)
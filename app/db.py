@@ -3,23 +3,261 @@ Database operations for the LlamaIndex RAG application.
 Handles PostgreSQL operations for document storage and retrieval.
 """
 
-from sqlalchemy import create_engine, text
+import logging
+import threading
+import time
+
+from sqlalchemy import create_engine, event, make_url, text
+from sqlalchemy.ext.asyncio import create_async_engine
 from .settings import settings
 
+logger = logging.getLogger(__name__)
 
-def get_db_engine():
-    """Get database engine for PostgreSQL operations"""
+HNSW_ITERATIVE_SCAN_MODES = ("off", "relaxed_order", "strict_order")
+
+# Table PGVectorStore keeps the chunks in (it prefixes table_name="documents" with "data_")
+DOCUMENTS_TABLE = "data_documents"
+
+# Chunk metadata keys searches can be restricted to. Each gets an expression
+# index on metadata_->>'key' (see ensure_metadata_indexes())
+METADATA_FILTER_KEYS = ("repo_name", "source", "org")
+
+# A chunk stored once for several repositories (identical README boilerplate)
+# lists all of them under this key; a repo_name filter matches it as well
+SHARED_REPOS_KEY = "repo_names"
+
+# Single-row table holding a counter that is bumped whenever the documents
+# table changes, so other processes can tell their cached answers are stale
+INDEX_STATE_TABLE = "documents_index_state"
+
+_generation_lock = threading.Lock()
+_generation = {"value": None, "read_at": 0.0}
+
+# Per-repository chunk counts, rebuilt by every code path that changes the
+# documents table so readers never have to count the table themselves
+CORPUS_STATS_TABLE = "documents_corpus_stats"
+
+# Callbacks run after the documents table changed, in this or another process
+_index_change_listeners = []
+
+# Process-wide pooled engines, created on first use and shared by the db helpers
+# and the PGVectorStore in app/rag.py
+_engine_lock = threading.Lock()
+_engines = {"sync": None, "async": None}
+
+
+def _pool_kwargs() -> dict:
+    """Connection pool options shared by the sync and async engines"""
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+def _configure_connection(dbapi_connection, connection_record):
+    """
+    Apply session settings to every new pooled connection.
+
+    With pgvector's iterative index scans on, an HNSW search that loses rows to
+    a filter keeps scanning the index until it has enough, instead of returning
+    fewer than the requested top_k. Older pgvector versions reject the setting;
+    the connection is then used without it.
+    """
+    mode = settings.db_hnsw_iterative_scan
+    if mode not in HNSW_ITERATIVE_SCAN_MODES or mode == "off":
+        return
+
+    cursor = dbapi_connection.cursor()
     try:
-        # Get normalized database URL from settings
-        database_url = settings.database_url_normalized
+        cursor.execute(f"SET hnsw.iterative_scan = {mode}")
+        dbapi_connection.commit()
+    except Exception as e:
+        dbapi_connection.rollback()
+        logger.warning(f"Could not enable pgvector iterative index scans: {str(e)}")
+    finally:
+        cursor.close()
+
+
+def get_db_engine():
+    """Get the shared, pooled database engine for PostgreSQL operations"""
+    engine = _engines["sync"]
+    if engine is not None:
+        return engine
 
-        # Create and return engine
-        return create_engine(database_url)
+    try:
+        with _engine_lock:
+            if _engines["sync"] is None:
+                # Get normalized database URL from settings
+                database_url = settings.database_url_normalized
+                _engines["sync"] = create_engine(database_url, **_pool_kwargs())
+                event.listen(_engines["sync"], "connect", _configure_connection)
+            return _engines["sync"]
 
     except Exception as e:
         raise Exception(f"Failed to create database engine: {str(e)}")
 
 
+def get_async_db_engine():
+    """Get the shared, pooled asyncpg database engine for async PostgreSQL operations"""
+    engine = _engines["async"]
+    if engine is not None:
+        return engine
+
+    try:
+        with _engine_lock:
+            if _engines["async"] is None:
+                database_url = make_url(settings.database_url_normalized).set(
+                    drivername="postgresql+asyncpg")
+                _engines["async"] = create_async_engine(database_url, **_pool_kwargs())
+                event.listen(_engines["async"].sync_engine, "connect", _configure_connection)
+            return _engines["async"]
+
+    except Exception as e:
+        raise Exception(f"Failed to create async database engine: {str(e)}")
+
+
+async def dispose_db_engines():
+    """Close all pooled connections; the engines are re-created on next use"""
+    with _engine_lock:
+        engine, async_engine = _engines["sync"], _engines["async"]
+        _engines["sync"] = _engines["async"] = None
+
+    if engine is not None:
+        engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+def bump_index_generation(connection):
+    """
+    Increment the index generation inside the caller's transaction.
+
+    Call this from any code path that adds, changes or deletes rows in the
+    documents table, before committing.
+
+    Returns:
+        The new generation
+    """
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {INDEX_STATE_TABLE} "
+        "(id INTEGER PRIMARY KEY, generation BIGINT NOT NULL)"
+    ))
+    result = connection.execute(text(
+        f"INSERT INTO {INDEX_STATE_TABLE} (id, generation) VALUES (1, 1) "
+        f"ON CONFLICT (id) DO UPDATE SET generation = {INDEX_STATE_TABLE}.generation + 1 "
+        "RETURNING generation"
+    ))
+    generation = result.scalar()
+
+    # This process sees its own change immediately, without waiting for a poll
+    with _generation_lock:
+        _generation["value"] = generation
+        _generation["read_at"] = time.monotonic()
+
+    return generation
+
+
+def rebuild_corpus_stats(connection):
+    """
+    Recount the chunks per repository inside the caller's transaction.
+
+    Like bump_index_generation(), call this from any code path that changes the
+    documents table, before committing.
+    """
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {CORPUS_STATS_TABLE} "
+        "(repo_name TEXT PRIMARY KEY, chunk_count BIGINT NOT NULL)"
+    ))
+    connection.execute(text(f"DELETE FROM {CORPUS_STATS_TABLE}"))
+    connection.execute(text(
+        f"INSERT INTO {CORPUS_STATS_TABLE} (repo_name, chunk_count) "
+        f"SELECT COALESCE(metadata_->>'repo_name', ''), COUNT(*) FROM {DOCUMENTS_TABLE} "
+        "GROUP BY 1"
+    ))
+
+
+def add_index_change_listener(callback):
+    """
+    Call callback() whenever the documents table changes.
+
+    Listeners run right after this process commits a change, and when
+    current_index_generation() notices a change made by another process.
+    """
+    _index_change_listeners.append(callback)
+
+
+def _notify_index_changed():
+    for callback in _index_change_listeners:
+        callback()
+
+
+def mark_index_changed():
+    """Record that the documents table changed, e.g. after the indexer added nodes"""
+    try:
+        engine = get_db_engine()
+
+        with engine.connect() as connection:
+            rebuild_corpus_stats(connection)
+            generation = bump_index_generation(connection)
+            connection.commit()
+        _notify_index_changed()
+
+        return True, f"Index generation is now {generation}"
+
+    except Exception as e:
+        return False, f"Error updating index generation: {str(e)}"
+
+
+def get_index_generation():
+    """Get the current index generation from the database (0 if never bumped)"""
+    try:
+        engine = get_db_engine()
+
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text("SELECT to_regclass(:table) IS NOT NULL"),
+                {"table": INDEX_STATE_TABLE}
+            ).scalar()
+            if not exists:
+                return 0, "Success"
+
+            result = connection.execute(
+                text(f"SELECT generation FROM {INDEX_STATE_TABLE} WHERE id = 1"))
+            generation = result.scalar()
+
+        return generation or 0, "Success"
+
+    except Exception as e:
+        return None, f"Error querying index generation: {str(e)}"
+
+
+def current_index_generation():
+    """
+    Get the index generation, reading it from the database at most once every
+    settings.rag_index_generation_poll_seconds.
+
+    Returns:
+        The index generation, or None if it could not be read
+    """
+    with _generation_lock:
+        value, read_at = _generation["value"], _generation["read_at"]
+    if value is not None and time.monotonic() - read_at < settings.rag_index_generation_poll_seconds:
+        return value
+
+    generation, _ = get_index_generation()
+    if generation is not None:
+        with _generation_lock:
+            changed = _generation["value"] is not None and _generation["value"] != generation
+            _generation["value"] = generation
+            _generation["read_at"] = time.monotonic()
+        if changed:
+            _notify_index_changed()
+    return generation
+
+
 def clear_vector_database():
     """Clear all documents from the PostgreSQL vector database table"""
     try:
@@ -27,8 +265,11 @@ def clear_vector_database():
 
         with engine.connect() as connection:
             # Clear the documents table (this is the table name used in PGVectorStore)
-            connection.execute(text("DELETE FROM documents"))
+            connection.execute(text(f"DELETE FROM {DOCUMENTS_TABLE}"))
+            rebuild_corpus_stats(connection)
+            bump_index_generation(connection)
             connection.commit()
+        _notify_index_changed()
 
         return True, "Successfully cleared vector database"
 
@@ -36,15 +277,119 @@ def clear_vector_database():
         return False, f"Error clearing vector database: {str(e)}"
 
 
+def ensure_text_search_index():
+    """
+    Add the full-text search column and GIN index used by hybrid retrieval.
+
+    Tables created by PGVectorStore with hybrid_search=True already have them;
+    this upgrades a documents table created before hybrid retrieval existed.
+    Adding the generated column rewrites the table, so run it from the indexer
+    rather than on the request path.
+    """
+    config = settings.rag_text_search_config
+    if not config.isidentifier():
+        return False, f"Invalid text search configuration: {config}"
+
+    try:
+        engine = get_db_engine()
+
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text("SELECT to_regclass(:table) IS NOT NULL"),
+                {"table": DOCUMENTS_TABLE}
+            ).scalar()
+            if not exists:
+                return True, "Documents table does not exist yet"
+
+            connection.execute(text(
+                f"ALTER TABLE {DOCUMENTS_TABLE} ADD COLUMN IF NOT EXISTS text_search_tsv tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('{config}', text)) STORED"
+            ))
+            # Same index name PGVectorStore uses when it creates the table itself
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS documents_idx ON {DOCUMENTS_TABLE} "
+                "USING gin (text_search_tsv)"
+            ))
+            connection.commit()
+
+        return True, "Full-text search index is ready"
+
+    except Exception as e:
+        return False, f"Error creating full-text search index: {str(e)}"
+
+
+def ensure_metadata_indexes():
+    """
+    Create the expression indexes behind metadata-filtered searches.
+
+    PGVectorStore turns a metadata filter into a metadata_->>'key' = 'value'
+    condition, so each key in METADATA_FILTER_KEYS gets a btree index on exactly
+    that expression. Selective filters (one repository) are then answered from
+    the btree index; broad ones keep using the HNSW index, with iterative scans
+    (settings.db_hnsw_iterative_scan) topping the results up to the full limit.
+    The repo_name filter also tests metadata_::jsonb->'repo_names' @> '["name"]'
+    for shared chunks, which gets a GIN index on that expression.
+    """
+    try:
+        engine = get_db_engine()
+
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text("SELECT to_regclass(:table) IS NOT NULL"),
+                {"table": DOCUMENTS_TABLE}
+            ).scalar()
+            if not exists:
+                return True, "Documents table does not exist yet"
+
+            for key in METADATA_FILTER_KEYS:
+                connection.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS documents_metadata_{key}_idx "
+                    f"ON {DOCUMENTS_TABLE} ((metadata_->>'{key}'))"
+                ))
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS documents_metadata_{SHARED_REPOS_KEY}_idx "
+                f"ON {DOCUMENTS_TABLE} USING gin ((metadata_::jsonb->'{SHARED_REPOS_KEY}'))"
+            ))
+            connection.commit()
+
+        return True, "Metadata filter indexes are ready"
+
+    except Exception as e:
+        return False, f"Error creating metadata filter indexes: {str(e)}"
+
+
+def shared_repo_rows(metadata: list) -> dict:
+    """
+    Map each repository to the rows it shares without being their repo_name.
+
+    Args:
+        metadata: Chunk metadata dicts, one per row
+
+    Returns:
+        {repository: [row, ...]} from the SHARED_REPOS_KEY lists
+    """
+    rows = {}
+    for row, values in enumerate(metadata):
+        for repo_name in (values or {}).get(SHARED_REPOS_KEY) or ():
+            if repo_name != values.get("repo_name"):
+                rows.setdefault(repo_name, []).append(row)
+    return rows
+
+
 def get_database_document_count():
-    """Get the number of documents stored in the PostgreSQL vector database"""
+    """
+    Get the exact number of documents stored in the PostgreSQL vector database.
+
+    This scans the whole table; the search endpoints use the cached counts from
+    app/corpus.py instead.
+    """
     try:
         engine = get_db_engine()
 
         with engine.connect() as connection:
             # Count documents in the documents table
             result = connection.execute(
-                text("SELECT COUNT(*) FROM documents"))
+                text(f"SELECT COUNT(*) FROM {DOCUMENTS_TABLE}"))
             count = result.scalar()
 
         return count, "Success"
@@ -53,6 +398,51 @@ def get_database_document_count():
         return None, f"Error querying database: {str(e)}"
 
 
+def get_corpus_stats():
+    """
+    Get the number of indexed chunks, in total and per repository.
+
+    Reads the small table maintained by rebuild_corpus_stats(). If the corpus was
+    indexed before that table existed, falls back to the planner's row estimate
+    (pg_class.reltuples) for the total, without per-repository counts.
+
+    Returns:
+        Tuple of ((total, {repo_name: count}), message), or (None, message) on error
+    """
+    try:
+        engine = get_db_engine()
+
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text("SELECT to_regclass(:table) IS NOT NULL"),
+                {"table": CORPUS_STATS_TABLE}
+            ).scalar()
+            if exists:
+                rows = connection.execute(text(
+                    f"SELECT repo_name, chunk_count FROM {CORPUS_STATS_TABLE}"
+                )).all()
+                by_repo = {repo_name: count for repo_name, count in rows}
+                return (sum(by_repo.values()), by_repo), "Success"
+
+            estimate = connection.execute(
+                text("SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass(:table)"),
+                {"table": DOCUMENTS_TABLE}
+            ).scalar()
+            if estimate is None:
+                return (0, {}), "Documents table does not exist"
+            if estimate >= 0:
+                return (estimate, {}), "Estimated from pg_class.reltuples"
+
+            # reltuples is -1 until the table has been vacuumed or analyzed
+            count = connection.execute(
+                text(f"SELECT COUNT(*) FROM {DOCUMENTS_TABLE}")).scalar()
+
+        return (count, {}), "Success"
+
+    except Exception as e:
+        return None, f"Error querying corpus stats: {str(e)}"
+
+
 def delete_document_from_index(filename):
     """Delete all document chunks from the vector database for a specific filename"""
     try:
@@ -62,14 +452,65 @@ def delete_document_from_index(filename):
             # Delete all rows where the metadata contains the specific filename
             result = connection.execute(
                 text(
-                    "DELETE FROM documents WHERE metadata_->>'file_name' = :filename"),
+                    f"DELETE FROM {DOCUMENTS_TABLE} WHERE metadata_->>'file_name' = :filename"),
                 {"filename": filename}
             )
             deleted_count = result.rowcount
+            rebuild_corpus_stats(connection)
+            bump_index_generation(connection)
             connection.commit()
+        _notify_index_changed()
 
         return True, f"Successfully deleted {deleted_count} chunk(s) for {filename} from vector database"
 
     except Exception as e:
         return False, f"Error deleting {filename} from vector database: {str(e)}"
 
+
+
+def get_document_rows(known_ids=()):
+    """
+    Read the chunks of the documents table that the caller does not have yet.
+
+    Used by the in-memory vector replica (app/replica.py) to sync incrementally:
+    it passes the row ids it holds and gets back every current row id plus the
+    full rows (text, metadata and embedding) of the ids it is missing.
+
+    Args:
+        known_ids: Row ids (the table's id column) already held by the caller
+
+    Returns:
+        ((current row ids, rows), message), where each row is a tuple of
+        (id, node_id, text, metadata dict, embedding as a list of floats)
+    """
+    try:
+        engine = get_db_engine()
+
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text("SELECT to_regclass(:table) IS NOT NULL"),
+                {"table": DOCUMENTS_TABLE}
+            ).scalar()
+            if not exists:
+                return ([], []), "Documents table does not exist yet"
+
+            current_ids = connection.execute(
+                text(f"SELECT id FROM {DOCUMENTS_TABLE}")).scalars().all()
+            known = set(known_ids)
+            missing = [row_id for row_id in current_ids if row_id not in known]
+
+            rows = []
+            if missing:
+                result = connection.execute(
+                    text(
+                        f"SELECT id, node_id, text, metadata_, embedding::real[] "
+                        f"FROM {DOCUMENTS_TABLE} WHERE id = ANY(:ids) ORDER BY id"
+                    ),
+                    {"ids": missing}
+                )
+                rows = [tuple(row) for row in result]
+
+        return (current_ids, rows), "Success"
+
+    except Exception as e:
+        return None, f"Error reading documents: {str(e)}"
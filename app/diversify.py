@@ -0,0 +1,155 @@
+"""
+Post-retrieval diversification of document chunks.
+
+The indexer splits each README into chunks that overlap their neighbours (see
+chunk_text_simple() in app/embeddings.py), so a plain top_k search often returns
+several near-identical neighbouring chunks. The helpers here collapse such runs
+into one chunk and pick a diverse subset with Maximal Marginal Relevance.
+"""
+
+from typing import Optional
+
+import numpy as np
+from llama_index.core.schema import NodeWithScore, TextNode
+
+# Longest overlap looked for between neighbouring chunks, in characters. The
+# indexer overlaps chunks by 100 bytes, so this leaves room for multi-byte text.
+MAX_OVERLAP_CHARS = 512
+
+
+def strip_overlap(previous: str, text: str, max_overlap: int = MAX_OVERLAP_CHARS) -> str:
+    """
+    Remove the prefix of text that repeats the end of previous.
+
+    Args:
+        previous: Text of the preceding chunk
+        text: Text of the following chunk
+        max_overlap: Longest overlap to look for, in characters
+
+    Returns:
+        text without the overlapping prefix
+    """
+    for size in range(min(len(previous), len(text), max_overlap), 0, -1):
+        if previous.endswith(text[:size]):
+            return text[size:]
+    return text
+
+
+def _document_key(node) -> Optional[tuple]:
+    """Identify the source document of a chunk, or None if it has no chunk position"""
+    metadata = node.metadata or {}
+    if metadata.get("chunk_index") is None:
+        return None
+    return (metadata.get("repo_name"), metadata.get("file_path"))
+
+
+def collapse_adjacent_chunks(nodes: list[NodeWithScore]) -> list[tuple[NodeWithScore, list[int]]]:
+    """
+    Merge retrieved chunks that are neighbours in the same document.
+
+    Chunks sharing repo_name and file_path whose chunk_index values are
+    consecutive are joined into a single chunk, with the overlap between them
+    removed. The merged chunk keeps the metadata, id and score of its best-scoring
+    member. Chunks without chunk_index metadata are kept as they are.
+
+    Args:
+        nodes: Retrieved chunks, best first
+
+    Returns:
+        (chunk, positions) pairs in the order of each group's best member, where
+        positions are the indexes in nodes the chunk was built from
+    """
+    groups = {}
+    for position, node in enumerate(nodes):
+        key = _document_key(node.node)
+        groups.setdefault(key if key is not None else ("", position), []).append(position)
+
+    collapsed = []
+    for key, positions in groups.items():
+        if len(positions) == 1:
+            collapsed.append((nodes[positions[0]], positions))
+            continue
+
+        positions.sort(key=lambda p: nodes[p].node.metadata["chunk_index"])
+        run = [positions[0]]
+        for position in positions[1:] + [None]:
+            if position is not None and (
+                nodes[position].node.metadata["chunk_index"]
+                == nodes[run[-1]].node.metadata["chunk_index"] + 1
+            ):
+                run.append(position)
+                continue
+            collapsed.append((_merge_run(nodes, run), run))
+            if position is not None:
+                run = [position]
+
+    collapsed.sort(key=lambda item: min(item[1]))
+    return collapsed
+
+
+def _merge_run(nodes: list[NodeWithScore], run: list[int]) -> NodeWithScore:
+    """Join a run of consecutive chunks (in chunk_index order) into one chunk"""
+    if len(run) == 1:
+        return nodes[run[0]]
+
+    text = nodes[run[0]].node.get_content()
+    for position in run[1:]:
+        next_text = nodes[position].node.get_content()
+        text += strip_overlap(text, next_text)
+
+    best = min(run)  # nodes are ordered best first
+    scores = [nodes[p].score for p in run if nodes[p].score is not None]
+    metadata = {
+        **nodes[best].node.metadata,
+        "chunk_index": nodes[run[0]].node.metadata["chunk_index"],
+        "merged_chunk_indexes": [nodes[p].node.metadata["chunk_index"] for p in run],
+    }
+    merged = TextNode(id_=nodes[best].node.node_id, text=text, metadata=metadata)
+    return NodeWithScore(node=merged, score=max(scores) if scores else None)
+
+
+def mmr_select(
+    query_embedding,
+    embeddings,
+    top_k: int,
+    lambda_mult: float = 0.7,
+) -> list[int]:
+    """
+    Pick top_k items by Maximal Marginal Relevance.
+
+    Each step takes the candidate maximising
+    lambda_mult * sim(query, d) - (1 - lambda_mult) * max(sim(d, selected)),
+    using cosine similarity. Similarities are computed once as matrix products;
+    each step only updates a vector of max similarities to the selection.
+
+    Args:
+        query_embedding: Query vector
+        embeddings: Candidate vectors, one row per candidate
+        top_k: Number of candidates to select
+        lambda_mult: 1.0 ranks by relevance only, 0.0 by diversity only
+
+    Returns:
+        Indexes of the selected candidates, in selection order
+    """
+    candidates = np.asarray(embeddings, dtype=np.float32)
+    if candidates.ndim != 2 or len(candidates) == 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    selected = []
+    max_similarity = np.zeros(len(candidates), dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+    for _ in range(min(top_k, len(candidates))):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return selected
@@ -0,0 +1,178 @@
+"""
+Persistent, content-addressed cache of chunk embeddings for the indexer.
+
+Embeddings are stored in a SQLite file keyed by (embedding model id, SHA-256 of
+the chunk text), so re-running bin/index_ref_app_readmes.py over an unchanged
+corpus makes no embeddings API calls. The cache is bounded by entry count and
+evicts the least recently used entries first.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .settings import settings
+
+# SQLite's default limit on host parameters per statement is 999 on old builds
+_MAX_PARAMS = 900
+
+
+def chunk_digest(text: str) -> bytes:
+    """Content address of a chunk: SHA-256 of its UTF-8 text"""
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class DiskEmbeddingCache:
+    """
+    SQLite-backed embedding cache shared by the indexer's worker threads.
+
+    Vectors are stored as float32 bytes (4 KB per 1024-dimension embedding).
+    Every lookup refreshes the entries' last-used time; after each write the
+    oldest entries beyond max_entries are deleted.
+    """
+
+    def __init__(self, path, max_entries: int):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " digest BLOB NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, digest)"
+            ") WITHOUT ROWID"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def get_many(self, model: str, texts: list[str]) -> list[Optional[np.ndarray]]:
+        """
+        Look up the embeddings of texts.
+
+        Args:
+            model: Embedding model id the vectors were produced by
+            texts: Chunk texts
+
+        Returns:
+            One float32 embedding per text (a view of the stored bytes), None
+            where the cache has none
+        """
+        digests = [chunk_digest(text) for text in texts]
+        found = {}
+        now = time.time()
+        with self._lock:
+            unique = list(dict.fromkeys(digests))
+            for start in range(0, len(unique), _MAX_PARAMS):
+                part = unique[start:start + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(part))
+                rows = self._connection.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({placeholders})",
+                    [model, *part],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._connection.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND digest = ?",
+                    [(now, model, digest) for digest in found],
+                )
+                self._connection.commit()
+
+            embeddings = []
+            for digest in digests:
+                vector = found.get(digest)
+                embeddings.append(np.frombuffer(vector, dtype=np.float32) if vector else None)
+            hits = sum(embedding is not None for embedding in embeddings)
+            self.hits += hits
+            self.misses += len(embeddings) - hits
+        return embeddings
+
+    def set_many(self, model: str, texts: list[str], embeddings: list):
+        """
+        Store embeddings for texts, evicting the least recently used entries
+        if the cache grows beyond max_entries.
+        """
+        now = time.time()
+        rows = [
+            (model, chunk_digest(text), np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            for text, embedding in zip(texts, embeddings)
+            if embedding is not None
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, digest, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.writes += len(rows)
+            excess = self._count() - self.max_entries
+            if excess > 0:
+                self._connection.execute(
+                    "DELETE FROM embeddings WHERE (model, digest) IN ("
+                    " SELECT model, digest FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self.evictions += excess
+            self._connection.commit()
+
+    def _count(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._count()
+            lookups = self.hits + self.misses
+            return {
+                "path": str(self.path),
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "bytes": self.path.stat().st_size if self.path.exists() else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+
+_cache_lock = threading.Lock()
+_cache = {"instance": None}
+
+
+def get_disk_embedding_cache() -> Optional[DiskEmbeddingCache]:
+    """
+    Return the process-wide indexing embedding cache, opening it on first use.
+
+    Returns:
+        The cache at settings.rag_embed_cache_path, or None if that setting is
+        empty or max entries is 0
+    """
+    if not settings.rag_embed_cache_path or settings.rag_embed_cache_max_entries <= 0:
+        return None
+    with _cache_lock:
+        if _cache["instance"] is None:
+            _cache["instance"] = DiskEmbeddingCache(
+                settings.rag_embed_cache_path, settings.rag_embed_cache_max_entries)
+        return _cache["instance"]
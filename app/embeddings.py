@@ -2,89 +2,394 @@
 Text chunking and embedding generation module.
 """
 
+import base64
+import logging
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterator, Optional
+
+import numpy as np
 import requests
 from llama_index.core.schema import TextNode
+from llama_index.core.utils import get_tokenizer
 
+from app.db import SHARED_REPOS_KEY
+from app.embedding_cache import DiskEmbeddingCache, chunk_digest, get_disk_embedding_cache
+from app.ratelimit import TokenBucket
 from app.settings import settings
 
+logger = logging.getLogger(__name__)
 
-def chunk_text_simple(text: str, max_bytes: int = 1024, overlap_bytes: int = 100) -> list[str]:
+# Every embeddings API request of the process goes through this limiter and
+# executor, so concurrent callers (e.g. the indexer's per-repository threads)
+# share one quota and one cap on requests in flight
+embedding_rate_limiter = TokenBucket(
+    settings.rag_embed_requests_per_minute / 60,
+    capacity=settings.rag_embed_max_concurrency,
+)
+_executor_lock = threading.Lock()
+_executor = {"pool": None}
+
+
+def _get_embedding_executor() -> ThreadPoolExecutor:
+    with _executor_lock:
+        if _executor["pool"] is None:
+            _executor["pool"] = ThreadPoolExecutor(
+                max_workers=max(1, settings.rag_embed_max_concurrency),
+                thread_name_prefix="embed",
+            )
+        return _executor["pool"]
+
+
+def _is_char_boundary(data, i: int) -> bool:
+    """Whether byte offset i of the UTF-8 buffer data (0 <= i <= len) starts a character"""
+    # UTF-8 continuation bytes look like 0b10xxxxxx
+    return i == len(data) or data[i] & 0xC0 != 0x80
+
+
+def iter_chunks_simple(text: str, max_bytes: int = 1024, overlap_bytes: int = 100) -> Iterator[str]:
     """
-    Byte-based chunking with overlap to handle Unicode properly.
+    Byte-based chunking with overlap, yielding chunks one at a time.
     
-    Conservative chunking to stay under token/byte limits:
-    - 1024 bytes is a safe middle ground
-    - Balances chunk size with processing speed
+    Same chunks as chunk_text_simple(), produced lazily so a large document can
+    be fed to the embedding API while it is still being chunked. A chunk ending
+    inside a multi-byte character is shortened to the character's first byte,
+    found by looking at continuation bytes, and every chunk is decoded once.
+    Empty chunks are never yielded, and a step back that would revisit a start
+    moves forward instead, so every input terminates.
     
     Args:
         text: Text to chunk
         max_bytes: Maximum bytes per chunk (default 1024)
-        overlap_bytes: Number of overlapping bytes between chunks
+        overlap_bytes: Number of overlapping bytes between chunks; must be
+            smaller than max_bytes
     
-    Returns:
-        List of text chunks
+    Yields:
+        Text chunks
     """
-    chunks = []
-    text_bytes = text.encode('utf-8')
+    if overlap_bytes >= max_bytes:
+        raise ValueError("overlap_bytes must be smaller than max_bytes")
+
+    data = memoryview(text.encode('utf-8'))
+    size = len(data)
     start = 0
+    # The overlap step-back can return to a start already chunked, which made
+    # chunk_text_simple() loop forever. Starts are recorded until a new
+    # furthest start is reached, so a revisit is caught within one cycle
+    furthest = 0
+    seen = {0}
     
-    while start < len(text_bytes):
-        # Take a chunk of bytes
+    while start < size:
         end = start + max_bytes
-        chunk_bytes = text_bytes[start:end]
+        # Offsets of the slice data[start:end] as Python resolves them
+        first, last, _ = slice(start, end).indices(size)
         
-        # Decode, handling potential incomplete UTF-8 sequences at the end
-        try:
-            chunk = chunk_bytes.decode('utf-8')
-        except UnicodeDecodeError:
-            # If we split in the middle of a multi-byte char, back up
-            while end > start:
+        if first < last and not (_is_char_boundary(data, first) and _is_char_boundary(data, last)):
+            if _is_char_boundary(data, first):
+                # Split in the middle of a multi-byte char: back up to its first byte
                 end -= 1
-                try:
-                    chunk = text_bytes[start:end].decode('utf-8')
-                    break
-                except UnicodeDecodeError:
-                    continue
+                while True:
+                    first, last, _ = slice(start, end).indices(size)
+                    if first >= last or _is_char_boundary(data, last):
+                        break
+                    end -= 1
             else:
-                # Shouldn't happen, but skip this chunk if we can't decode
-                start = end + 1
-                continue
+                # The overlap put start inside a character, so no non-empty
+                # slice from it decodes; chunk_text_simple() has always stepped
+                # back another overlap here (it used to emit an empty chunk)
+                end = first if end > 0 else start
         
-        chunks.append(chunk)
+        chunk = str(data[start:end], 'utf-8')
+        if chunk:
+            yield chunk
         start = end - overlap_bytes
+        if start > furthest:
+            furthest = start
+            seen.clear()
+        elif start in seen:
+            # Would repeat the same chunks forever: move past the furthest start
+            start = furthest = furthest + 1
+            seen.clear()
+        seen.add(start)
+
+
+def chunk_text_simple(text: str, max_bytes: int = 1024, overlap_bytes: int = 100) -> list[str]:
+    """
+    Byte-based chunking with overlap to handle Unicode properly.
+    
+    Conservative chunking to stay under token/byte limits:
+    - 1024 bytes is a safe middle ground
+    - Balances chunk size with processing speed
+    
+    Args:
+        text: Text to chunk
+        max_bytes: Maximum bytes per chunk (default 1024)
+        overlap_bytes: Number of overlapping bytes between chunks
+    
+    Returns:
+        List of text chunks (see iter_chunks_simple())
+    """
+    return list(iter_chunks_simple(text, max_bytes=max_bytes, overlap_bytes=overlap_bytes))
+
+
+# Runs of whitespace with the word after them, the unit token chunks are packed
+# from (BPE tokenizers attach leading whitespace to the following word)
+_SEGMENT_PATTERN = re.compile(r"\s*\S+|\s+")
+
+
+def _default_count_tokens() -> Callable[[str], int]:
+    tokenizer = get_tokenizer()
+    return lambda text: len(tokenizer(text))
+
+
+def _fit_segment(segment: str, max_tokens: int, count_tokens: Callable[[str], int]) -> Iterator[tuple[str, int]]:
+    """Yield (piece, tokens) for segment, halving pieces that exceed max_tokens"""
+    tokens = count_tokens(segment)
+    if tokens <= max_tokens or len(segment) == 1:
+        yield segment, tokens
+        return
+    middle = len(segment) // 2
+    yield from _fit_segment(segment[:middle], max_tokens, count_tokens)
+    yield from _fit_segment(segment[middle:], max_tokens, count_tokens)
+
+
+def iter_chunks_by_tokens(
+    text: str,
+    max_tokens: int = 400,
+    overlap_tokens: int = 40,
+    count_tokens: Optional[Callable[[str], int]] = None
+) -> Iterator[str]:
+    """
+    Token-based chunking with overlap, yielding chunks one at a time.
+    
+    The text is split into words with their leading whitespace, which are
+    packed into chunks of up to max_tokens; each chunk starts with the last
+    words of the previous one, up to overlap_tokens. A word longer than
+    max_tokens on its own (e.g. a long URL) is split. Chunk sizes are the sum
+    of the words' token counts, which matches the count of the joined text
+    closely enough for a limit with some headroom.
+    
+    Args:
+        text: Text to chunk
+        max_tokens: Maximum tokens per chunk (default 400)
+        overlap_tokens: Tokens repeated from the end of the previous chunk;
+            must be smaller than max_tokens
+        count_tokens: Returns the token count of a text (default: the
+            LlamaIndex global tokenizer)
+    
+    Yields:
+        Text chunks
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+    if count_tokens is None:
+        count_tokens = _default_count_tokens()
+    
+    window = deque()  # (segment, tokens) of the chunk being filled
+    used = 0
+    fresh = False     # whether the window holds more than the overlap
+    
+    for match in _SEGMENT_PATTERN.finditer(text):
+        for segment, tokens in _fit_segment(match.group(), max_tokens, count_tokens):
+            if fresh and used + tokens > max_tokens:
+                yield "".join(part for part, _ in window)
+                
+                # Carry the trailing segments over as the overlap, leaving room for this one
+                overlap = deque()
+                used = 0
+                while window and used + window[-1][1] <= min(overlap_tokens, max_tokens - tokens):
+                    overlap.appendleft(window.pop())
+                    used += overlap[0][1]
+                window = overlap
+            
+            window.append((segment, tokens))
+            used += tokens
+            fresh = True
+    
+    if fresh:
+        yield "".join(part for part, _ in window)
+
+
+def chunk_text_by_tokens(
+    text: str,
+    max_tokens: int = 400,
+    overlap_tokens: int = 40,
+    count_tokens: Optional[Callable[[str], int]] = None
+) -> list[str]:
+    """
+    Token-based chunking with overlap, filling chunks up to the embedding
+    model's input limit.
+    
+    Returns:
+        List of text chunks (see iter_chunks_by_tokens())
+    """
+    return list(iter_chunks_by_tokens(text, max_tokens, overlap_tokens, count_tokens))
+
+
+CHUNKERS = ("bytes", "tokens")
+
+
+def iter_chunks(text: str, chunker: str = "bytes", max_bytes: int = 1024, overlap_bytes: int = 100) -> Iterator[str]:
+    """
+    Chunk text with the named chunker.
     
-    return chunks
+    Args:
+        text: Text to chunk
+        chunker: "bytes" (iter_chunks_simple() with max_bytes and
+            overlap_bytes) or "tokens" (iter_chunks_by_tokens() with
+            settings.rag_chunk_tokens and settings.rag_chunk_overlap_tokens)
+    
+    Raises:
+        ValueError: If chunker is not one of CHUNKERS
+    """
+    if chunker == "bytes":
+        return iter_chunks_simple(text, max_bytes=max_bytes, overlap_bytes=overlap_bytes)
+    if chunker == "tokens":
+        return iter_chunks_by_tokens(
+            text, max_tokens=settings.rag_chunk_tokens, overlap_tokens=settings.rag_chunk_overlap_tokens)
+    raise ValueError(f"Unknown chunker {chunker!r}, expected one of {', '.join(CHUNKERS)}")
+
+
+def _decode_embeddings(items: list) -> np.ndarray:
+    """
+    Stack embeddings from an API response into one float32 matrix.
+    
+    Base64 items are little-endian float32 bytes: they are decoded into one
+    buffer the matrix is a view of, without parsing any numbers. Items the API
+    returned as JSON numbers are converted.
+    """
+    if not items:
+        return np.zeros((0, settings.rag_embed_dim), dtype=np.float32)
+    if all(isinstance(item, str) for item in items):
+        buffer = b"".join(base64.b64decode(item) for item in items)
+        return np.frombuffer(buffer, dtype="<f4").reshape(len(items), -1)
+    return np.asarray(items, dtype=np.float32)
+
+
+def _post_embeddings(url: str, headers: dict, texts: list[str]) -> np.ndarray:
+    """Embed texts with one API request, returning a float32 matrix with one row per text"""
+    payload = {
+        "model": settings.embedding_model_id,
+        "input": texts
+    }
+    if settings.rag_embed_encoding_format:
+        payload["encoding_format"] = settings.rag_embed_encoding_format
+
+    embedding_rate_limiter.acquire()
+    response = requests.post(url, headers=headers, json=payload)
+    response.raise_for_status()
+
+    data = response.json()["data"]
+    if len(data) != len(texts):
+        raise ValueError(f"Expected {len(texts)} embeddings, got {len(data)}")
+    return _decode_embeddings([item["embedding"] for item in sorted(data, key=lambda item: item.get("index", 0))])
+
+
+# HTTP statuses meaning the API rejected (part of) a batch's input
+_BATCH_ERROR_STATUSES = (400, 413, 422)
 
 
-def get_embeddings_direct(texts: list[str]) -> list[list[float]]:
+def _is_batch_error(error: Exception) -> bool:
+    """
+    Whether a failed request may succeed when its batch is split.
+
+    Rejected inputs (400, 422 for one bad input, 413 for the request body)
+    and malformed responses qualify. Other errors do not, as splitting would
+    only multiply the failing requests: auth and configuration errors (401,
+    403, 404) must fail the run, and rate limiting (429), server and network
+    errors are not about the batch's contents.
+    """
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status in _BATCH_ERROR_STATUSES
+    return isinstance(error, (ValueError, KeyError, TypeError))
+
+
+def _embed_batch(url: str, headers: dict, texts: list[str]) -> list[Optional[np.ndarray]]:
+    """
+    Embed one batch, bisecting it on batch errors.
+
+    Halves are retried independently, so a single bad input costs about
+    log2(batch size) extra requests and only its own embedding (None).
+    """
+    try:
+        return list(_post_embeddings(url, headers, texts))
+    except Exception as e:
+        if not _is_batch_error(e):
+            raise
+        if len(texts) == 1:
+            logger.warning(f"Could not embed text ({len(texts[0])} chars): {str(e)}")
+            return [None]
+
+        logger.warning(f"Embedding batch of {len(texts)} failed, splitting it: {str(e)}")
+        middle = len(texts) // 2
+        return _embed_batch(url, headers, texts[:middle]) + _embed_batch(url, headers, texts[middle:])
+
+
+def get_embeddings_direct(texts: list[str], batch_size: Optional[int] = None) -> list[Optional[np.ndarray]]:
     """
     Call the embedding API directly to get embeddings.
-    Sends one text at a time to avoid batch issues.
+    
+    Texts are sent in batches of up to batch_size per request. Batches run on
+    a shared thread pool, with at most settings.rag_embed_max_concurrency
+    requests in flight and settings.rag_embed_requests_per_minute enforced by a
+    token bucket across all callers. A batch the API rejects is bisected and
+    retried (see _embed_batch()), so one bad input neither fails the call nor
+    forces one request per text.
     
     Args:
         texts: List of text strings to embed
+        batch_size: Max texts per request (default: settings.rag_embed_batch_size)
     
     Returns:
-        List of embedding vectors
+        List of float32 embedding vectors in input order (rows of one matrix
+        per batch); None for a text the API rejected on its own
     """
     url = f"{settings.embedding_url}/v1/embeddings"
     headers = {
         "Authorization": f"Bearer {settings.embedding_key}",
         "Content-Type": "application/json"
     }
+    batch_size = max(1, batch_size or settings.rag_embed_batch_size)
     
-    embeddings = []
-    for text in texts:
-        payload = {
-            "model": settings.embedding_model_id,
-            "input": [text]
-        }
-        
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        data = response.json()
-        embeddings.append(data["data"][0]["embedding"])
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    # map() yields results in submission order, whatever order batches finish in
+    results = _get_embedding_executor().map(lambda batch: _embed_batch(url, headers, batch), batches)
+    
+    return [embedding for batch_embeddings in results for embedding in batch_embeddings]
+
+
+def get_embeddings_cached(
+    texts: list[str],
+    cache: Optional[DiskEmbeddingCache] = None
+) -> list[Optional[np.ndarray]]:
+    """
+    Get embeddings, calling the embedding API only for texts not in the disk cache.
+    
+    Args:
+        texts: List of text strings to embed
+        cache: Cache to consult (default: get_disk_embedding_cache(); when that
+            is disabled every text is sent to the API)
+    
+    Returns:
+        List of embedding vectors in input order, as for get_embeddings_direct()
+    """
+    if cache is None:
+        cache = get_disk_embedding_cache()
+    if cache is None:
+        return get_embeddings_direct(texts)
+
+    model = settings.embedding_model_id
+    embeddings = cache.get_many(model, texts)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        fresh = get_embeddings_direct([texts[i] for i in missing])
+        for i, embedding in zip(missing, fresh):
+            embeddings[i] = embedding
+        cache.set_many(model, [texts[i] for i in missing], fresh)
     
     return embeddings
 
@@ -93,7 +398,8 @@ def create_text_nodes_with_embeddings(
     content: str,
     metadata: dict,
     max_bytes: int = 1024,
-    overlap_bytes: int = 100
+    overlap_bytes: int = 100,
+    chunker: str = "bytes"
 ) -> list[TextNode]:
     """
     Chunk text and create TextNodes with embeddings.
@@ -103,31 +409,113 @@ def create_text_nodes_with_embeddings(
         metadata: Metadata to attach to each node
         max_bytes: Maximum bytes per chunk
         overlap_bytes: Number of overlapping bytes between chunks
+        chunker: "bytes" or "tokens", see iter_chunks()
     
     Returns:
-        List of TextNode objects with embeddings
+        List of TextNode objects with embeddings; chunks the embedding API
+        rejected are left out
     """
-    # Chunk the text
-    chunks = chunk_text_simple(content, max_bytes=max_bytes, overlap_bytes=overlap_bytes)
+    # Embed the chunks as they are produced, a window of requests at a time,
+    # reusing the embeddings of chunks embedded by earlier runs
+    chunks = iter_chunks(content, chunker, max_bytes=max_bytes, overlap_bytes=overlap_bytes)
+    window = max(1, settings.rag_embed_batch_size) * max(1, settings.rag_embed_max_concurrency)
     
-    # Get embeddings
-    embeddings = get_embeddings_direct(chunks)
-    
-    # Create nodes with embeddings and metadata
     nodes = []
-    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-        node_metadata = {
-            **metadata,
-            "chunk_index": i,
-            "total_chunks": len(chunks),
-        }
+    chunk_index = 0
+    while True:
+        texts = list(islice(chunks, window))
+        if not texts:
+            break
+        embeddings = get_embeddings_cached(texts)
         
-        node = TextNode(
-            text=chunk,
-            embedding=embedding,
-            metadata=node_metadata
-        )
-        nodes.append(node)
+        # Create nodes with embeddings and metadata
+        for chunk, embedding in zip(texts, embeddings):
+            if embedding is not None:
+                nodes.append(TextNode(
+                    text=chunk,
+                    # TextNode.embedding is typed list[float]
+                    embedding=embedding.tolist(),
+                    metadata={**metadata, "chunk_index": chunk_index},
+                ))
+            chunk_index += 1
+    
+    for node in nodes:
+        node.metadata["total_chunks"] = chunk_index
     
     return nodes
 
+
+def normalize_chunk(text: str) -> str:
+    """Collapse whitespace, so copies that differ only in line breaks or indentation match"""
+    return " ".join(text.split())
+
+
+def create_deduplicated_text_nodes(
+    documents: list[tuple[str, dict]],
+    max_bytes: int = 1024,
+    overlap_bytes: int = 100,
+    chunker: str = "bytes"
+) -> tuple[Iterator[TextNode], dict]:
+    """
+    Chunk several documents and create one TextNode per distinct chunk.
+    
+    READMEs share boilerplate (the Deploy to Heroku button, license and
+    contributing sections, common setup steps). Chunks are keyed by a hash of
+    their normalized text, and each distinct chunk is embedded and stored
+    once. A chunk keeps the metadata of its first occurrence and lists every
+    repository it occurs in under SHARED_REPOS_KEY, which repo_name filters
+    match (see build_metadata_filters() in app/rag.py). Chunks with no text
+    are dropped.
+    
+    Embeddings are held as float32 arrays until a node is created; nodes are
+    created as the caller iterates, so only the nodes being inserted hold
+    their embedding as a list of Python floats.
+    
+    Args:
+        documents: (content, metadata) per document; metadata must include repo_name
+        max_bytes: Maximum bytes per chunk
+        overlap_bytes: Number of overlapping bytes between chunks
+        chunker: "bytes" or "tokens", see iter_chunks()
+    
+    Returns:
+        (nodes, stats): iterator of TextNode objects with embeddings, leaving
+        out chunks the embedding API rejected, and counts of the chunks,
+        distinct chunks, chunks shared by several repositories and
+        repositories with an embedded chunk
+    """
+    distinct = {}  # digest of the normalized text -> (text, node metadata)
+    chunk_count = 0
+    
+    for content, metadata in documents:
+        chunks = list(iter_chunks(content, chunker, max_bytes=max_bytes, overlap_bytes=overlap_bytes))
+        for i, chunk in enumerate(chunks):
+            normalized = normalize_chunk(chunk)
+            if not normalized:
+                continue
+            chunk_count += 1
+            digest = chunk_digest(normalized)
+            if digest not in distinct:
+                distinct[digest] = (chunk, {
+                    **metadata,
+                    "chunk_index": i,
+                    "total_chunks": len(chunks),
+                    SHARED_REPOS_KEY: [metadata["repo_name"]],
+                })
+            elif metadata["repo_name"] not in distinct[digest][1][SHARED_REPOS_KEY]:
+                distinct[digest][1][SHARED_REPOS_KEY].append(metadata["repo_name"])
+    
+    entries = list(distinct.values())
+    embeddings = get_embeddings_cached([text for text, _ in entries])
+    embedded = [(entry, embedding) for entry, embedding in zip(entries, embeddings) if embedding is not None]
+    
+    nodes = (
+        TextNode(text=text, embedding=embedding.tolist(), metadata=node_metadata)
+        for (text, node_metadata), embedding in embedded
+    )
+    stats = {
+        "chunks": chunk_count,
+        "distinct_chunks": len(entries),
+        "shared_chunks": sum(len(m[SHARED_REPOS_KEY]) > 1 for _, m in entries),
+        "repositories": len({repo for (_, m), _ in embedded for repo in m[SHARED_REPOS_KEY]}),
+    }
+    return nodes, stats
@@ -5,12 +5,44 @@ It initializes a main FastAPI application for public endpoints and mounts a
 sub-application for all endpoints that require Salesforce context.
 """
 import heroku_applink as sdk
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from typing import Dict
+import logging
 import yaml
 
+from .corpus import corpus_stats
+from .db import dispose_db_engines
+from .rag import engine_registry
+from .replica import vector_replica
+from .settings import settings
 from .routers import accounts, unitofwork, datacloud, search
 
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Build the shared RAG query engines and load the corpus stats (and, for the
+    memory retrieval backend, the vector replica) once at startup, and close the
+    database connection pools on shutdown.
+
+    A failure at startup is not fatal: the registry builds the engines lazily on
+    the first search request instead.
+    """
+    try:
+        engine_registry.warm()
+    except Exception as e:
+        logger.warning(f"Could not warm query engines at startup: {str(e)}")
+    await asyncio.to_thread(corpus_stats.refresh)
+    if settings.rag_retrieval_backend == "memory":
+        await asyncio.to_thread(vector_replica.refresh)
+    yield
+    await dispose_db_engines()
+
+
 # --- Protected Salesforce App ---
 # All routers and middleware that require Salesforce context are attached here.
 sf_app = FastAPI()
@@ -25,7 +57,8 @@ sf_app.include_router(unitofwork.router, prefix="/unitofwork")
 app = FastAPI(
     title="AppLink Python Starter",
     description="A starter project for building Salesforce-integrated applications with Heroku AppLink.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Mount the protected Salesforce app at the /api prefix
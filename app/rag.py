@@ -5,16 +5,73 @@ This module provides functionality to query documents stored in a PostgreSQL vec
 database using LlamaIndex and Heroku AI models.
 """
 
-from typing import Optional
+import asyncio
+import logging
+import math
+import re
+import threading
+import time
+from contextvars import ContextVar
+from typing import AsyncGenerator, Callable, List, Optional
+
+import numpy as np
 from llama_index.llms.heroku import Heroku
 from llama_index.embeddings.openai_like import OpenAILikeEmbedding
 from llama_index.core import VectorStoreIndex, Settings, StorageContext
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
 from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.indices.prompt_helper import PromptHelper
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.prompts.default_prompt_selectors import (
+    DEFAULT_TEXT_QA_PROMPT_SEL,
+    DEFAULT_TREE_SUMMARIZE_PROMPT_SEL,
+)
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.utils import get_tokenizer
+from llama_index.core.vector_stores import FilterCondition, FilterOperator, MetadataFilter, MetadataFilters
 from llama_index.vector_stores.postgres import PGVectorStore
-from sqlalchemy import make_url
 
+from .cache import EmbeddingCache, normalize_query, query_embedding_cache
+from .db import METADATA_FILTER_KEYS, SHARED_REPOS_KEY, get_db_engine, get_async_db_engine
+from .diversify import collapse_adjacent_chunks, mmr_select
+from .replica import vector_replica
 from .settings import settings
 
+logger = logging.getLogger(__name__)
+
+# "vector": pgvector cosine similarity only. "hybrid": cosine similarity and
+# Postgres full-text search, fused with reciprocal rank fusion.
+RETRIEVAL_MODES = ["vector", "hybrid"]
+
+# Recall/latency trade-off of the HNSW search, mapped to hnsw.ef_search by
+# resolve_ef_search(): "fast" for interactive callers, "high" for evaluation
+QUALITY_LEVELS = ["fast", "balanced", "high"]
+
+# Report dict filled by ContextPacker for the query currently being answered;
+# see the context_report argument of aquery()
+_context_report: ContextVar[Optional[dict]] = ContextVar("context_report", default=None)
+
+# Metadata filters of the query currently being answered; see the filters
+# argument of aquery() and MetadataFilteredRetriever
+_metadata_filters: ContextVar[Optional[MetadataFilters]] = ContextVar("metadata_filters", default=None)
+
+# PGVectorStore writes filter values into the SQL text unescaped, so only
+# GitHub-style names are accepted as values
+_FILTER_VALUE_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]{0,99}")
+
+
+def create_llm() -> Heroku:
+    """
+    Create the Heroku AI LLM used for response synthesis.
+    
+    Returns:
+        Configured Heroku LLM instance
+    """
+    return Heroku()
+
 
 def create_embedding_model() -> OpenAILikeEmbedding:
     """
@@ -31,6 +88,89 @@ def create_embedding_model() -> OpenAILikeEmbedding:
     )
 
 
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embedding model wrapper that serves repeated texts from an EmbeddingCache.
+    
+    Cache keys are (embedding model id, normalized text), so the cache can be
+    shared between wrappers of different models. Batch calls only send the texts
+    that miss the cache to the wrapped model, in a single batch.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache: EmbeddingCache, **kwargs):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _key(self, text: str) -> tuple[str, str]:
+        return (self.model_name, normalize_query(text))
+
+    def _lookup(self, texts: list[str]) -> tuple[list, list[int]]:
+        vectors = [self._cache.get(self._key(text)) for text in texts]
+        return vectors, [i for i, vector in enumerate(vectors) if vector is None]
+
+    def _store(self, texts: list[str], vectors: list, missing: list[int], embeddings, seconds: float):
+        if missing:
+            self._cache.record_embed(seconds, count=len(missing))
+        for i, embedding in zip(missing, embeddings):
+            self._cache.set(self._key(texts[i]), embedding)
+            vectors[i] = embedding
+        return [vector.tolist() if hasattr(vector, "tolist") else vector for vector in vectors]
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        vectors, missing = self._lookup([query])
+        start = time.perf_counter()
+        embeddings = [self._embed_model.get_query_embedding(query)] if missing else []
+        return self._store([query], vectors, missing, embeddings, time.perf_counter() - start)[0]
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        vectors, missing = self._lookup([query])
+        start = time.perf_counter()
+        embeddings = [await self._embed_model.aget_query_embedding(query)] if missing else []
+        return self._store([query], vectors, missing, embeddings, time.perf_counter() - start)[0]
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> list[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = self._lookup(texts)
+        start = time.perf_counter()
+        embeddings = self._embed_model.get_text_embedding_batch(
+            [texts[i] for i in missing]) if missing else []
+        return self._store(texts, vectors, missing, embeddings, time.perf_counter() - start)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = self._lookup(texts)
+        start = time.perf_counter()
+        embeddings = await self._embed_model.aget_text_embedding_batch(
+            [texts[i] for i in missing]) if missing else []
+        return self._store(texts, vectors, missing, embeddings, time.perf_counter() - start)
+
+
+def create_cached_embedding_model() -> CachedEmbedding:
+    """
+    Create the embedding model wrapped in the process-wide query embedding cache.
+    
+    Returns:
+        CachedEmbedding around create_embedding_model()
+    """
+    return CachedEmbedding(create_embedding_model(), query_embedding_cache)
+
+
 def create_text_splitter() -> SentenceSplitter:
     """
     Create and configure the text splitter for document chunking.
@@ -49,23 +189,30 @@ def create_vector_store() -> PGVectorStore:
     """
     Create and configure the PostgreSQL vector store.
     
+    The store uses the process-wide pooled engines from app/db.py instead of
+    opening its own connection pools.
+    
     Returns:
         Configured PGVectorStore instance connected to the database
     """
-    url = make_url(settings.database_url_normalized)
+    # from_params() cannot take pre-built engines, so use the constructor directly
+    engine = get_db_engine()
+    async_engine = get_async_db_engine()
     
-    return PGVectorStore.from_params(
-        database=url.database,
-        host=url.host,
-        port=url.port,
-        user=url.username,
-        password=url.password,
+    return PGVectorStore(
+        connection_string=engine.url,
+        async_connection_string=async_engine.url,
         table_name="documents",
+        schema_name="public",
         embed_dim=settings.rag_embed_dim,
+        hybrid_search=True,
+        text_search_config=settings.rag_text_search_config,
+        engine=engine,
+        async_engine=async_engine,
         hnsw_kwargs={
             "hnsw_m": 16,
             "hnsw_ef_construction": 64,
-            "hnsw_ef_search": 40,
+            "hnsw_ef_search": settings.rag_ef_search_balanced,
             "hnsw_dist_method": "vector_cosine_ops",
         },
     )
@@ -75,27 +222,591 @@ def configure_llama_index():
     """
     Configure global LlamaIndex settings with the application's LLM and embedding models.
     
-    This should be called once during application startup or before creating a query engine.
+    This should be called once during application startup. Query engines built by
+    create_query_engine() receive their models explicitly and do not rely on it.
     """
-    Settings.llm = Heroku()
+    Settings.llm = create_llm()
     Settings.embed_model = create_embedding_model()
     Settings.text_splitter = create_text_splitter()
 
 
+def create_index(
+    vector_store: Optional[PGVectorStore] = None,
+    embed_model: Optional[BaseEmbedding] = None,
+) -> VectorStoreIndex:
+    """
+    Load the existing vector index from PostgreSQL.
+    
+    Args:
+        vector_store: Vector store to load from (default: a new one from create_vector_store())
+        embed_model: Embedding model used for query embedding (default: a new one
+            from create_embedding_model())
+    
+    Returns:
+        VectorStoreIndex backed by the documents table
+    """
+    if vector_store is None:
+        vector_store = create_vector_store()
+    if embed_model is None:
+        embed_model = create_embedding_model()
+
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    return VectorStoreIndex.from_vector_store(
+        vector_store=vector_store,
+        embed_model=embed_model,
+        storage_context=storage_context,
+    )
+
+
+def resolve_ef_search(quality: str, limit: int) -> int:
+    """
+    Map a quality level to the hnsw.ef_search used for one query.
+    
+    ef_search is kept at least as large as the number of rows requested, since
+    HNSW returns at most ef_search candidates, and at most settings.rag_ef_search_max.
+    
+    Args:
+        quality: One of QUALITY_LEVELS
+        limit: Number of rows the query asks for
+    
+    Returns:
+        The hnsw.ef_search value
+    """
+    if quality not in QUALITY_LEVELS:
+        raise ValueError(f"Invalid quality: {quality}")
+    ef_search = {
+        "fast": settings.rag_ef_search_fast,
+        "balanced": settings.rag_ef_search_balanced,
+        "high": settings.rag_ef_search_high,
+    }[quality]
+    return min(max(ef_search, limit), settings.rag_ef_search_max)
+
+
+def build_metadata_filters(filters: Optional[dict]) -> Optional[MetadataFilters]:
+    """
+    Turn {key: value} restrictions into exact-match metadata filters.
+    
+    A repo_name restriction also matches chunks shared with that repository
+    (its name is in their SHARED_REPOS_KEY list), so it becomes an OR group.
+    
+    Args:
+        filters: Values for keys in METADATA_FILTER_KEYS; None values are ignored
+    
+    Returns:
+        MetadataFilters combining the restrictions with AND, or None if there are none
+    
+    Raises:
+        ValueError: For an unknown key or a value that is not a plain name
+    """
+    conditions = []
+    for key, value in (filters or {}).items():
+        if value is None:
+            continue
+        if key not in METADATA_FILTER_KEYS:
+            raise ValueError(f"Invalid metadata filter: {key}")
+        # Values that parse as numbers would be compared as floats by PGVectorStore
+        if not _FILTER_VALUE_PATTERN.fullmatch(value) or _is_number(value):
+            raise ValueError(f"Invalid {key}: {value}")
+        condition = MetadataFilter(key=key, value=value, operator=FilterOperator.EQ)
+        if key == "repo_name":
+            condition = MetadataFilters(
+                filters=[
+                    condition,
+                    MetadataFilter(key=SHARED_REPOS_KEY, value=value, operator=FilterOperator.CONTAINS),
+                ],
+                condition=FilterCondition.OR,
+            )
+        conditions.append(condition)
+
+    if not conditions:
+        return None
+    return MetadataFilters(filters=conditions)
+
+
+def metadata_filter_conditions(filters: Optional[MetadataFilters]) -> Optional[dict]:
+    """
+    Recover the {key: value} restrictions build_metadata_filters() was given.
+    
+    Returns:
+        The restrictions, or None if filters is None
+    """
+    if filters is None:
+        return None
+    conditions = {}
+    for condition in filters.filters:
+        # An OR group stands for its first, exact-match filter
+        if isinstance(condition, MetadataFilters):
+            condition = condition.filters[0]
+        conditions[condition.key] = condition.value
+    return conditions
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+class MetadataFilteredRetriever(BaseRetriever):
+    """
+    Index retriever that applies the metadata filters of the current query.
+    
+    Filters are per query (see the filters argument of aquery()), so shared
+    engines serve every repository. A filtered query gets a short-lived
+    retriever carrying the filters, which PGVectorStore pushes down into the
+    search SQL as metadata_->>'key' = 'value' conditions; the LIMIT then applies
+    to matching chunks only, so a filtered search still returns a full top_k.
+    """
+
+    def __init__(self, index: VectorStoreIndex, **retriever_kwargs):
+        self._index = index
+        self._retriever_kwargs = retriever_kwargs
+        self._retriever = index.as_retriever(**retriever_kwargs)
+        super().__init__()
+
+    def _current(self) -> BaseRetriever:
+        filters = _metadata_filters.get()
+        if filters is None:
+            return self._retriever
+        return self._index.as_retriever(filters=filters, **self._retriever_kwargs)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._current().retrieve(query_bundle)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return await self._current().aretrieve(query_bundle)
+
+
+class LocalVectorRetriever(BaseRetriever):
+    """
+    Exact vector search over the in-memory replica of the documents table (see
+    app/replica.py), used when settings.rag_retrieval_backend is "memory".
+    
+    Queries are answered without a database round trip and apply the current
+    query's metadata filters in memory. Until the replica has been loaded, the
+    fallback retriever (the pgvector search) answers instead.
+    """
+
+    def __init__(self, top_k: int, fallback: BaseRetriever, replica=None):
+        self._top_k = top_k
+        self._fallback = fallback
+        self._replica = vector_replica if replica is None else replica
+        super().__init__()
+
+    def _search(self, query_bundle: QueryBundle) -> Optional[List[NodeWithScore]]:
+        if query_bundle.embedding is None:
+            return None
+        conditions = metadata_filter_conditions(_metadata_filters.get())
+        return self._replica.search(query_bundle.embedding, self._top_k, filters=conditions)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        nodes = self._search(query_bundle)
+        return self._fallback.retrieve(query_bundle) if nodes is None else nodes
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        nodes = self._search(query_bundle)
+        return await self._fallback.aretrieve(query_bundle) if nodes is None else nodes
+
+
+def create_vector_retriever(
+    index: VectorStoreIndex,
+    top_k: int,
+    vector_store_kwargs: Optional[dict] = None,
+) -> BaseRetriever:
+    """
+    Create the vector-similarity retriever for settings.rag_retrieval_backend.
+    
+    Args:
+        index: Vector index to query
+        top_k: Number of chunks to retrieve
+        vector_store_kwargs: Query arguments for PGVectorStore, e.g. hnsw_ef_search
+    
+    Returns:
+        A MetadataFilteredRetriever over pgvector, wrapped in a LocalVectorRetriever
+        for the "memory" backend
+    """
+    retriever = MetadataFilteredRetriever(
+        index, similarity_top_k=top_k, vector_store_kwargs=vector_store_kwargs or {})
+    if settings.rag_retrieval_backend == "memory":
+        return LocalVectorRetriever(top_k, fallback=retriever)
+    return retriever
+
+
+def reciprocal_rank_fusion(
+    result_lists: List[List[NodeWithScore]],
+    top_k: int,
+    k: int = 60,
+) -> List[NodeWithScore]:
+    """
+    Merge ranked result lists with reciprocal rank fusion (RRF).
+    
+    Each node scores sum(1 / (k + rank)) over the lists it appears in, so nodes
+    ranked well by several retrievers rise to the top. Only ranks are used,
+    which makes cosine similarities and full-text ranks comparable.
+    
+    Args:
+        result_lists: Results of each retriever, best first
+        top_k: Number of fused results to return
+        k: Damping constant; larger values flatten the gap between ranks
+    
+    Returns:
+        Up to top_k nodes, best first, scored by their fused RRF score
+    """
+    scores = {}
+    nodes = {}
+    for results in result_lists:
+        for rank, node in enumerate(results, start=1):
+            node_id = node.node.node_id
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+            nodes.setdefault(node_id, node.node)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [NodeWithScore(node=nodes[node_id], score=scores[node_id]) for node_id in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Runs a pgvector similarity search and a Postgres full-text search over the
+    documents table and fuses the two rankings with reciprocal rank fusion.
+    
+    Full-text search catches exact identifiers (buildpack names, env vars, repo
+    names) that embeddings rank poorly, so fewer chunks are needed for a good answer.
+    """
+
+    def __init__(
+        self,
+        index: VectorStoreIndex,
+        top_k: int,
+        candidate_k: Optional[int] = None,
+        vector_store_kwargs: Optional[dict] = None,
+    ):
+        candidate_k = max(top_k, candidate_k or settings.rag_hybrid_candidate_k)
+        self._top_k = top_k
+        self._vector_retriever = create_vector_retriever(index, candidate_k, vector_store_kwargs)
+        self._text_retriever = MetadataFilteredRetriever(
+            index,
+            similarity_top_k=candidate_k,
+            vector_store_query_mode="text_search",
+        )
+        super().__init__()
+
+    def _fuse(self, vector_nodes, text_nodes) -> List[NodeWithScore]:
+        return reciprocal_rank_fusion(
+            [vector_nodes, text_nodes], top_k=self._top_k, k=settings.rag_rrf_k)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._fuse(
+            self._vector_retriever.retrieve(query_bundle),
+            self._text_retriever.retrieve(query_bundle),
+        )
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        vector_nodes, text_nodes = await asyncio.gather(
+            self._vector_retriever.aretrieve(query_bundle),
+            self._text_retriever.aretrieve(query_bundle),
+        )
+        return self._fuse(vector_nodes, text_nodes)
+
+
+class DiversifyingRetriever(BaseRetriever):
+    """
+    Over-fetches candidates from another retriever, collapses neighbouring chunks
+    of the same document into one, and picks a diverse top_k from the rest with
+    Maximal Marginal Relevance over the candidates' stored embeddings.
+    
+    Neighbouring chunks overlap, so without this the top_k often holds several
+    near-copies of the same passage, wasting LLM context.
+    """
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        vector_store: PGVectorStore,
+        top_k: int,
+        lambda_mult: Optional[float] = None,
+    ):
+        self._retriever = retriever
+        self._vector_store = vector_store
+        self._top_k = top_k
+        self._lambda_mult = settings.rag_mmr_lambda if lambda_mult is None else lambda_mult
+        super().__init__()
+
+    def _select(self, query_bundle, nodes, collapsed, stored_nodes) -> List[NodeWithScore]:
+        """Run MMR over the collapsed candidates, falling back to rank order"""
+        embeddings_by_id = {node.node_id: node.embedding for node in stored_nodes}
+        embeddings = []
+        for _, positions in collapsed:
+            member_embeddings = [embeddings_by_id.get(nodes[p].node.node_id) for p in positions]
+            if any(embedding is None for embedding in member_embeddings):
+                return [node for node, _ in collapsed[:self._top_k]]
+            embeddings.append(np.mean(np.asarray(member_embeddings, dtype=np.float32), axis=0))
+
+        selected = mmr_select(query_bundle.embedding, embeddings, self._top_k, self._lambda_mult)
+        return [collapsed[i][0] for i in selected]
+
+    def _needs_mmr(self, query_bundle, collapsed) -> bool:
+        return len(collapsed) > self._top_k and query_bundle.embedding is not None
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        nodes = self._retriever.retrieve(query_bundle)
+        collapsed = collapse_adjacent_chunks(nodes)
+        if not self._needs_mmr(query_bundle, collapsed):
+            return [node for node, _ in collapsed[:self._top_k]]
+
+        stored_nodes = self._vector_store.get_nodes(node_ids=[n.node.node_id for n in nodes])
+        return self._select(query_bundle, nodes, collapsed, stored_nodes)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        nodes = await self._retriever.aretrieve(query_bundle)
+        collapsed = collapse_adjacent_chunks(nodes)
+        if not self._needs_mmr(query_bundle, collapsed):
+            return [node for node, _ in collapsed[:self._top_k]]
+
+        stored_nodes = await self._vector_store.aget_nodes(node_ids=[n.node.node_id for n in nodes])
+        return self._select(query_bundle, nodes, collapsed, stored_nodes)
+
+
+def create_retriever(
+    top_k: int = 10,
+    retrieval_mode: str = "vector",
+    index: Optional[VectorStoreIndex] = None,
+    diversify: Optional[bool] = None,
+    quality: str = "balanced",
+) -> BaseRetriever:
+    """
+    Create a retriever over the vector index.
+    
+    The HNSW search quality is applied per query through PGVectorStore's
+    hnsw_ef_search query argument, so retrievers of every quality share the one
+    vector store and its connection pool. Metadata filters are applied per query
+    too, see MetadataFilteredRetriever. With settings.rag_retrieval_backend set to
+    "memory", the vector search runs over the in-memory replica instead (see
+    LocalVectorRetriever) and quality has no effect on it, as that search is exact.
+    
+    Args:
+        top_k: Number of most relevant document chunks to retrieve (default: 10)
+        retrieval_mode: "vector" (default) or "hybrid", see RETRIEVAL_MODES
+        index: Vector index to query (default: a new one from create_index())
+        diversify: Collapse neighbouring chunks and apply MMR, see
+            DiversifyingRetriever (default: settings.rag_mmr_enabled)
+        quality: "fast", "balanced" (default) or "high", see resolve_ef_search()
+    
+    Returns:
+        A retriever returning up to top_k chunks, best first
+    """
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Invalid retrieval_mode: {retrieval_mode}")
+    if index is None:
+        index = create_index()
+    if diversify is None:
+        diversify = settings.rag_mmr_enabled
+
+    candidate_k = max(top_k, settings.rag_mmr_candidate_k) if diversify else top_k
+    # Rows the vector search itself asks for; HybridRetriever fetches extra candidates
+    vector_limit = candidate_k
+    if retrieval_mode == "hybrid":
+        vector_limit = max(candidate_k, settings.rag_hybrid_candidate_k)
+    vector_store_kwargs = {"hnsw_ef_search": resolve_ef_search(quality, vector_limit)}
+
+    if retrieval_mode == "hybrid":
+        retriever = HybridRetriever(
+            index, top_k=candidate_k, vector_store_kwargs=vector_store_kwargs)
+    else:
+        retriever = create_vector_retriever(index, candidate_k, vector_store_kwargs)
+
+    if diversify:
+        # The memory backend reads MMR embeddings from the replica as well; until
+        # it is loaded, candidates keep their rank order
+        vector_store = index.vector_store
+        if settings.rag_retrieval_backend == "memory":
+            vector_store = vector_replica
+        return DiversifyingRetriever(retriever, vector_store, top_k=top_k)
+    return retriever
+
+
+def synthesis_call_tokens(llm, response_mode: str) -> int:
+    """
+    Tokens of chunk text one synthesis LLM call can hold.
+    
+    The LLM's context window less its reserved output and the response mode's
+    default prompt template, as computed by LlamaIndex's PromptHelper when it
+    packs chunks for synthesis. The query is not included.
+    
+    Args:
+        llm: LLM used for synthesis
+        response_mode: Synthesis mode
+    
+    Returns:
+        Tokens of context available per LLM call
+    """
+    if response_mode == "tree_summarize":
+        prompt = DEFAULT_TREE_SUMMARIZE_PROMPT_SEL
+    else:
+        prompt = DEFAULT_TEXT_QA_PROMPT_SEL
+    prompt_helper = PromptHelper.from_llm_metadata(llm.metadata)
+    return prompt_helper.get_text_splitter_given_prompt(prompt, num_chunks=1).chunk_size
+
+
+def estimate_llm_calls(chunk_tokens: List[int], call_tokens: int, response_mode: str) -> int:
+    """
+    Estimate how many LLM calls synthesis makes over the given chunks.
+    
+    "refine" makes one call per chunk, "compact" one per batch of call_tokens,
+    "tree_summarize" one per batch plus a final summary when there is more than
+    one, and "simple_summarize" always one (it truncates instead).
+    
+    Args:
+        chunk_tokens: Token count of each chunk
+        call_tokens: Tokens of context that fit in one LLM call, see
+            synthesis_call_tokens()
+        response_mode: Synthesis mode
+    
+    Returns:
+        Estimated number of LLM calls
+    """
+    if not chunk_tokens or response_mode == "simple_summarize":
+        return 1
+    if response_mode == "refine":
+        return len(chunk_tokens)
+
+    batches = max(1, math.ceil(sum(chunk_tokens) / call_tokens))
+    if response_mode == "tree_summarize" and batches > 1:
+        return batches + 1
+    return batches
+
+
+def pack_context(
+    nodes: List[NodeWithScore],
+    token_budget: int,
+    count_tokens: Callable[[str], int],
+    call_tokens: int,
+    response_mode: str = "tree_summarize",
+) -> tuple[List[NodeWithScore], dict]:
+    """
+    Pick the best-scoring chunks that fit in token_budget and merge neighbours.
+    
+    Chunks are taken by descending score, skipping any that would overflow the
+    budget (the best chunk is always kept). The picked chunks keep their
+    retrieval order, and consecutive chunks of the same document are merged with
+    their overlap removed, as in collapse_adjacent_chunks().
+    
+    Args:
+        nodes: Retrieved chunks, best first
+        token_budget: Max tokens of chunk text to keep
+        count_tokens: Returns the token count of a text
+        call_tokens: Tokens of context one LLM call holds, used to estimate
+            the LLM calls saved
+        response_mode: Synthesis mode, used to estimate the LLM calls saved
+    
+    Returns:
+        Tuple of (packed chunks, report dict with chunk and token counts and the
+        estimated LLM calls before and after packing)
+    """
+    tokens = [count_tokens(node.node.get_content()) for node in nodes]
+    by_score = sorted(
+        range(len(nodes)),
+        key=lambda i: nodes[i].score if nodes[i].score is not None else float("-inf"),
+        reverse=True,
+    )
+
+    picked = []
+    used = 0
+    for i in by_score:
+        if picked and used + tokens[i] > token_budget:
+            continue
+        picked.append(i)
+        used += tokens[i]
+    picked.sort()
+
+    packed = [node for node, _ in collapse_adjacent_chunks([nodes[i] for i in picked])]
+    packed_tokens = [count_tokens(node.node.get_content()) for node in packed]
+
+    calls_before = estimate_llm_calls(tokens, call_tokens, response_mode)
+    calls_after = estimate_llm_calls(packed_tokens, call_tokens, response_mode)
+    report = {
+        "retrieved_chunks": len(nodes),
+        "packed_chunks": len(packed),
+        "retrieved_tokens": sum(tokens),
+        "packed_tokens": sum(packed_tokens),
+        "tokens_saved": sum(tokens) - sum(packed_tokens),
+        "estimated_llm_calls": calls_after,
+        "llm_calls_avoided": max(calls_before - calls_after, 0),
+    }
+    return packed, report
+
+
+class ContextPacker(BaseNodePostprocessor):
+    """
+    Node postprocessor that packs retrieved chunks into a token budget before
+    synthesis (see pack_context()), so the answer usually takes one LLM call.
+    
+    The packing report is written to the dict passed to aquery() or
+    astream_query() as context_report.
+    """
+
+    token_budget: int = Field(description="Max tokens of chunk text passed to synthesis")
+    call_tokens: int = Field(description="Tokens of context one LLM call holds, before the query")
+    response_mode: str = Field(default="tree_summarize", description="Synthesis mode of the engine")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPacker"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        tokenizer = get_tokenizer()
+        call_tokens = self.call_tokens
+        if query_bundle is not None:
+            call_tokens = max(call_tokens - len(tokenizer(query_bundle.query_str)), 1)
+        packed, report = pack_context(
+            nodes,
+            self.token_budget,
+            lambda text: len(tokenizer(text)),
+            call_tokens,
+            response_mode=self.response_mode,
+        )
+        holder = _context_report.get()
+        if holder is not None:
+            holder.update(report)
+        return packed
+
+
 def create_query_engine(
     response_mode: str = "tree_summarize",
-    top_k: int = 10
+    top_k: int = 10,
+    index: Optional[VectorStoreIndex] = None,
+    llm: Optional[Heroku] = None,
+    streaming: bool = False,
+    retrieval_mode: str = "vector",
+    quality: str = "balanced",
 ):
     """
     Create a query engine for searching and answering questions from documents.
     
-    This function loads the existing vector index from PostgreSQL and creates
-    a query engine configured for the specified retrieval parameters.
+    This function creates a query engine over the vector index configured for the
+    specified retrieval parameters. The LLM and embedding model are passed to the
+    engine explicitly, so the global LlamaIndex Settings are never touched.
+    Retrieved chunks are packed into settings.rag_context_token_budget tokens
+    (see ContextPacker) before synthesis, unless the budget is 0.
+    
+    Prefer get_query_engine() in request handlers: it returns a shared engine from
+    the process-wide registry instead of building a new one.
     
     Args:
         response_mode: How to combine retrieved chunks into a response.
             Options: "tree_summarize" (default), "refine", "compact", "simple_summarize"
         top_k: Number of most relevant document chunks to retrieve (default: 10)
+        index: Vector index to query (default: a new one from create_index())
+        llm: LLM used for synthesis (default: a new one from create_llm())
+        streaming: If True, synthesis returns a streaming response that yields
+            tokens as the LLM generates them
+        retrieval_mode: "vector" (default) or "hybrid", see RETRIEVAL_MODES
+        quality: "fast", "balanced" (default) or "high", see resolve_ef_search()
     
     Returns:
         A configured query engine ready to answer questions
@@ -104,28 +815,250 @@ def create_query_engine(
         >>> engine = create_query_engine(response_mode="tree_summarize", top_k=10)
         >>> response = query(engine, "What is machine learning?")
     """
-    # Configure global settings
-    configure_llama_index()
+    if index is None:
+        index = create_index()
+    if llm is None:
+        llm = create_llm()
+
+    node_postprocessors = []
+    if settings.rag_context_token_budget > 0:
+        node_postprocessors.append(ContextPacker(
+            token_budget=settings.rag_context_token_budget,
+            call_tokens=synthesis_call_tokens(llm, response_mode),
+            response_mode=response_mode,
+        ))
+
+    return RetrieverQueryEngine.from_args(
+        retriever=create_retriever(
+            top_k=top_k, retrieval_mode=retrieval_mode, index=index, quality=quality),
+        llm=llm,
+        node_postprocessors=node_postprocessors,
+        response_mode=response_mode,
+        streaming=streaming,
+    )
+
+
+class QueryEngineRegistry:
+    """
+    Process-wide registry of query engines keyed by (response_mode, top_k, streaming,
+    retrieval_mode, quality).
     
-    # Create vector store connection
-    vector_store = create_vector_store()
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    The LLM, embedding model (behind the query embedding cache), vector store (and
+    its connection pool) and index are built once and shared by every engine. Engines are created lazily on first use
+    and reused by all subsequent requests; they hold no per-query state, so a
+    single engine can serve concurrent requests.
     
-    # Load the existing index from the database
-    index = VectorStoreIndex.from_vector_store(
-        vector_store=vector_store,
-        embed_model=Settings.embed_model,
-        storage_context=storage_context,
-    )
+    Document changes need no rebuild: engines query the live documents table, and
+    the per-document state around them (answer caches, corpus stats, replica) is
+    invalidated by the index generation check. Call refresh() when the index
+    configuration changes (e.g. after re-creating the documents table) to drop
+    every cached component; the next lookup rebuilds them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines = {}
+        self._retrievers = {}
+        self._llm = None
+        self._embed_model = None
+        self._index = None
+
+    def warm(self, response_mode: str = "tree_summarize", top_k: int = 20):
+        """
+        Build the shared components and the default engine ahead of the first request.
+        
+        Args:
+            response_mode: Response mode of the engine to pre-build
+            top_k: top_k of the engine to pre-build
+        """
+        with self._lock:
+            configure_llama_index()
+        self.get(response_mode=response_mode, top_k=top_k)
+
+    def _ensure_components(self):
+        """Build the shared LLM, embedding model and index. Caller must hold the lock."""
+        if self._index is None:
+            logger.info("Building shared vector index and LLM")
+            self._llm = create_llm()
+            self._embed_model = create_cached_embedding_model()
+            self._index = create_index(embed_model=self._embed_model)
+
+    def get_embed_model(self) -> BaseEmbedding:
+        """
+        Return the shared embedding model used by every engine in the registry.
+        
+        Returns:
+            The cached embedding model shared by all engines
+        """
+        embed_model = self._embed_model
+        if embed_model is not None:
+            return embed_model
+
+        with self._lock:
+            self._ensure_components()
+            return self._embed_model
+
+    def get(
+        self,
+        response_mode: str = "tree_summarize",
+        top_k: int = 10,
+        streaming: bool = False,
+        retrieval_mode: str = "vector",
+        quality: str = "balanced"
+    ):
+        """
+        Return the shared query engine for the given parameters, building it if needed.
+        
+        Args:
+            response_mode: How to combine retrieved chunks into a response
+            top_k: Number of most relevant document chunks to retrieve
+            streaming: Whether the engine streams synthesized tokens
+            retrieval_mode: "vector" or "hybrid", see RETRIEVAL_MODES
+            quality: HNSW search quality, see QUALITY_LEVELS
+        
+        Returns:
+            A query engine shared by all callers using the same parameters
+        """
+        key = (response_mode, top_k, streaming, retrieval_mode, quality)
+        engine = self._engines.get(key)
+        if engine is not None:
+            return engine
+
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                self._ensure_components()
+                logger.info(
+                    f"Creating query engine with top_k={top_k}, response_mode={response_mode}, "
+                    f"streaming={streaming}, retrieval_mode={retrieval_mode}, quality={quality}"
+                )
+                engine = create_query_engine(
+                    response_mode=response_mode,
+                    top_k=top_k,
+                    index=self._index,
+                    llm=self._llm,
+                    streaming=streaming,
+                    retrieval_mode=retrieval_mode,
+                    quality=quality,
+                )
+                self._engines[key] = engine
+        return engine
+
+    def get_retriever(self, top_k: int = 10, retrieval_mode: str = "vector", quality: str = "balanced"):
+        """
+        Return the shared retriever for the given parameters, building it if needed.
+        
+        Retrievers share the index (and its connection pool) with the query engines
+        but never call the LLM.
+        
+        Args:
+            top_k: Number of most relevant document chunks to retrieve
+            retrieval_mode: "vector" or "hybrid", see RETRIEVAL_MODES
+            quality: HNSW search quality, see QUALITY_LEVELS
+        
+        Returns:
+            A retriever shared by all callers using the same parameters
+        """
+        key = (top_k, retrieval_mode, quality)
+        retriever = self._retrievers.get(key)
+        if retriever is not None:
+            return retriever
+
+        with self._lock:
+            retriever = self._retrievers.get(key)
+            if retriever is None:
+                self._ensure_components()
+                logger.info(
+                    f"Creating retriever with top_k={top_k}, retrieval_mode={retrieval_mode}, "
+                    f"quality={quality}"
+                )
+                retriever = create_retriever(
+                    top_k=top_k, retrieval_mode=retrieval_mode, index=self._index, quality=quality)
+                self._retrievers[key] = retriever
+        return retriever
+
+    def refresh(self):
+        """Drop all cached engines and shared components so they are rebuilt on next use."""
+        with self._lock:
+            self._engines = {}
+            self._retrievers = {}
+            self._llm = None
+            self._embed_model = None
+            self._index = None
+        logger.info("Query engine registry refreshed")
+
+
+engine_registry = QueryEngineRegistry()
+
+
+def get_query_engine(
+    response_mode: str = "tree_summarize",
+    top_k: int = 10,
+    streaming: bool = False,
+    retrieval_mode: str = "vector",
+    quality: str = "balanced"
+):
+    """
+    Get a shared query engine from the process-wide registry.
     
-    # Create and configure the query engine
-    query_engine = index.as_query_engine(
-        llm=Settings.llm,
+    Args:
+        response_mode: How to combine retrieved chunks into a response
+        top_k: Number of most relevant document chunks to retrieve
+        streaming: Whether the engine streams synthesized tokens (see astream_query())
+        retrieval_mode: "vector" or "hybrid", see RETRIEVAL_MODES
+        quality: HNSW search quality, "fast", "balanced" or "high"
+    
+    Returns:
+        A query engine that is safe to share across concurrent requests
+    
+    Example:
+        >>> engine = get_query_engine(response_mode="tree_summarize", top_k=10)
+        >>> answer, sources = query(engine, "How do I deploy the Java app?")
+    """
+    return engine_registry.get(
         response_mode=response_mode,
-        similarity_top_k=top_k,
+        top_k=top_k,
+        streaming=streaming,
+        retrieval_mode=retrieval_mode,
+        quality=quality,
     )
+
+
+def get_retriever(top_k: int = 10, retrieval_mode: str = "vector", quality: str = "balanced"):
+    """
+    Get a shared retriever from the process-wide registry.
+    
+    Args:
+        top_k: Number of most relevant document chunks to retrieve
+        retrieval_mode: "vector" or "hybrid", see RETRIEVAL_MODES
+        quality: HNSW search quality, "fast", "balanced" or "high"
     
-    return query_engine
+    Returns:
+        A retriever that is safe to share across concurrent requests
+    """
+    return engine_registry.get_retriever(top_k=top_k, retrieval_mode=retrieval_mode, quality=quality)
+
+
+def _format_sources(source_nodes, preview: bool = True) -> list[dict]:
+    """
+    Convert retrieved source nodes into the source metadata dicts returned to callers.
+    
+    Args:
+        source_nodes: NodeWithScore objects from a query response or retriever
+        preview: If True, truncate each text to a 200 character preview
+    
+    Returns:
+        List of source metadata dicts with the text, score and metadata
+    """
+    sources = []
+    for node in source_nodes:
+        source_info = {
+            "text": node.text[:200] + "..." if preview and len(node.text) > 200 else node.text,
+            "score": float(node.score) if getattr(node, 'score', None) is not None else None,
+            "metadata": node.metadata if hasattr(node, 'metadata') else {}
+        }
+        sources.append(source_info)
+    return sources
 
 
 def query(query_engine, prompt: str) -> tuple[str, list[dict]]:
@@ -146,17 +1079,155 @@ def query(query_engine, prompt: str) -> tuple[str, list[dict]]:
         >>> print(sources)
     """
     response = query_engine.query(prompt)
+    return str(response), _format_sources(getattr(response, 'source_nodes', []))
+
+
+async def aembed_query(prompt: str) -> list[float]:
+    """
+    Embed a query string with the shared embedding model without blocking the event loop.
     
-    # Extract metadata from source nodes
-    sources = []
-    if hasattr(response, 'source_nodes'):
-        for node in response.source_nodes:
-            source_info = {
-                "text": node.text[:200] + "..." if len(node.text) > 200 else node.text,
-                "score": float(node.score) if hasattr(node, 'score') else None,
-                "metadata": node.metadata if hasattr(node, 'metadata') else {}
-            }
-            sources.append(source_info)
+    Args:
+        prompt: The question or query to embed
+    
+    Returns:
+        The query embedding vector
+    """
+    embed_model = engine_registry.get_embed_model()
+    return await embed_model.aget_query_embedding(prompt)
+
+
+async def aembed_queries(prompts: list[str]) -> list[list[float]]:
+    """
+    Embed many query strings with as few embedding API calls as possible.
+    
+    Prompts are sent in batches of settings.rag_embed_batch_size, the batch size
+    the shared embedding model is configured with.
     
-    return str(response), sources
+    Args:
+        prompts: The questions or queries to embed
+    
+    Returns:
+        One embedding vector per prompt, in input order
+    """
+    embed_model = engine_registry.get_embed_model()
+    return await embed_model.aget_text_embedding_batch(prompts)
 
+
+async def aquery(
+    query_engine,
+    prompt: str,
+    embedding: Optional[list[float]] = None,
+    context_report: Optional[dict] = None,
+    filters: Optional[MetadataFilters] = None
+) -> tuple[str, list[dict]]:
+    """
+    Execute a query against the document index asynchronously.
+    
+    Retrieval runs over the vector store's asyncpg connection and synthesis uses the
+    LLM's async client, so the event loop stays free while waiting on either.
+    
+    Args:
+        query_engine: A query engine from get_query_engine() or create_query_engine()
+        prompt: The question or query to answer
+        embedding: Precomputed query embedding from aembed_query(); when omitted the
+            engine embeds the prompt itself
+        context_report: Optional dict that receives the ContextPacker report (chunk
+            and token counts, estimated LLM calls); left empty if nothing was packed
+        filters: Metadata filters from build_metadata_filters() restricting the
+            chunks retrieved for this query
+    
+    Returns:
+        Tuple of (generated answer, list of source metadata dicts)
+    
+    Example:
+        >>> engine = get_query_engine()
+        >>> answer, sources = await aquery(engine, "How do I deploy the Java app?")
+    """
+    token = _context_report.set(context_report)
+    filters_token = _metadata_filters.set(filters)
+    try:
+        response = await query_engine.aquery(QueryBundle(query_str=prompt, embedding=embedding))
+    finally:
+        _metadata_filters.reset(filters_token)
+        _context_report.reset(token)
+    return str(response), _format_sources(getattr(response, 'source_nodes', []))
+
+
+async def astream_query(
+    query_engine,
+    prompt: str,
+    embedding: Optional[list[float]] = None,
+    context_report: Optional[dict] = None,
+    filters: Optional[MetadataFilters] = None
+) -> tuple[list[dict], AsyncGenerator[str, None]]:
+    """
+    Execute a query and stream the synthesized answer token by token.
+    
+    Retrieval completes before this function returns, so callers can send the
+    sources to the client immediately and then relay tokens from the generator
+    as the LLM produces them.
+    
+    Args:
+        query_engine: A streaming query engine from get_query_engine(streaming=True)
+        prompt: The question or query to answer
+        embedding: Precomputed query embedding from aembed_query()
+        context_report: Optional dict that receives the ContextPacker report, as for aquery()
+        filters: Metadata filters restricting the chunks retrieved, as for aquery()
+    
+    Returns:
+        Tuple of (list of source metadata dicts, async generator of answer tokens)
+    
+    Example:
+        >>> engine = get_query_engine(streaming=True)
+        >>> sources, tokens = await astream_query(engine, "How do I deploy the Java app?")
+        >>> async for token in tokens:
+        ...     print(token, end="")
+    """
+    query_bundle = QueryBundle(query_str=prompt, embedding=embedding)
+    token = _context_report.set(context_report)
+    filters_token = _metadata_filters.set(filters)
+    try:
+        nodes = await query_engine.aretrieve(query_bundle)
+    finally:
+        _metadata_filters.reset(filters_token)
+        _context_report.reset(token)
+
+    async def token_gen() -> AsyncGenerator[str, None]:
+        response = await query_engine.asynthesize(query_bundle, nodes)
+        if not hasattr(response, "async_response_gen"):
+            # Synthesizers fall back to a plain Response, e.g. when nothing was retrieved
+            yield str(response)
+            return
+        async for token in response.async_response_gen():
+            yield token
+
+    return _format_sources(nodes), token_gen()
+
+
+async def aretrieve(
+    retriever,
+    prompt: str,
+    embedding: Optional[list[float]] = None,
+    filters: Optional[MetadataFilters] = None
+) -> list[dict]:
+    """
+    Retrieve the most similar chunks for a query without any LLM synthesis.
+    
+    Args:
+        retriever: A retriever from get_retriever()
+        prompt: The question or query to match
+        embedding: Precomputed query embedding from aembed_query()
+        filters: Metadata filters restricting the chunks retrieved, as for aquery()
+    
+    Returns:
+        List of source metadata dicts with the full chunk text, ordered by score
+    
+    Example:
+        >>> chunks = await aretrieve(get_retriever(top_k=5), "Java org actions")
+    """
+    token = _metadata_filters.set(filters)
+    try:
+        nodes = await retriever.aretrieve(QueryBundle(query_str=prompt, embedding=embedding))
+    finally:
+        _metadata_filters.reset(token)
+    return _format_sources(nodes, preview=False)
@@ -0,0 +1,58 @@
+"""
+Token-bucket rate limiting for outbound API requests.
+
+Used to keep the indexer's concurrent embedding requests within the Heroku AI
+embeddings quota.
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Tokens are added at rate per second up to capacity; acquire() takes one,
+    sleeping until it is available. A full bucket allows a burst of capacity
+    requests, after which requests are spaced 1 / rate seconds apart. A rate of
+    0 disables limiting.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.waited_seconds = 0.0
+
+    def _reserve(self) -> float:
+        """Take a token, possibly going into debt, and return how long to wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            self.acquired += 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited_seconds += wait
+            return wait
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        if self.rate <= 0:
+            return
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "capacity": self.capacity,
+                "acquired": self.acquired,
+                "waited_seconds": round(self.waited_seconds, 3),
+            }
@@ -0,0 +1,336 @@
+"""
+In-memory replica of the documents table for local vector search.
+
+The indexed corpus (READMEs of one GitHub organization) fits comfortably in
+RAM, so with settings.rag_retrieval_backend = "memory" the vector search runs
+in process: all chunk embeddings live in one contiguous float32 matrix and an
+exact top_k is a single matrix-vector product. Postgres stays the source of
+truth; the replica re-syncs the rows that changed whenever the index
+generation moves.
+
+When settings.rag_snapshot_dir is set, the replica maps the current on-disk
+snapshot written by the indexer (see app/snapshot.py) instead, so all worker
+processes share one copy of the embeddings. A snapshot older than the index
+generation (rows changed since it was written) is ignored in favour of the
+table until the indexer writes a new one.
+"""
+
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from .db import (
+    METADATA_FILTER_KEYS,
+    add_index_change_listener,
+    get_document_rows,
+    get_index_generation,
+    shared_repo_rows,
+)
+from .settings import settings
+from .snapshot import MappedSnapshot, read_current_version, read_snapshot_generation
+
+logger = logging.getLogger(__name__)
+
+
+class _Snapshot(NamedTuple):
+    """Immutable view of the replicated rows; swapped as a whole on refresh"""
+    generation: int
+    row_ids: np.ndarray      # int64, the documents table id of each row
+    node_ids: list
+    texts: list
+    metadata: list
+    matrix: np.ndarray       # float32 (rows, dim), L2-normalized
+    columns: dict            # metadata key -> object array, for filtering
+    positions: dict          # node_id -> row
+    shared_rows: dict        # repo_name -> int64 rows shared with it (see shared_repo_rows())
+
+    def record(self, row: int) -> dict:
+        """Text and metadata of a row, as MappedSnapshot.record() returns them"""
+        return {"text": self.texts[row], "metadata": self.metadata[row]}
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def _build_snapshot(generation, row_ids, node_ids, texts, metadata, matrix) -> _Snapshot:
+    columns = {
+        key: np.array([m.get(key) for m in metadata], dtype=object)
+        for key in METADATA_FILTER_KEYS
+    }
+    return _Snapshot(
+        generation=generation,
+        row_ids=np.asarray(row_ids, dtype=np.int64),
+        node_ids=node_ids,
+        texts=texts,
+        metadata=metadata,
+        matrix=np.ascontiguousarray(matrix, dtype=np.float32),
+        columns=columns,
+        positions={node_id: row for row, node_id in enumerate(node_ids)},
+        shared_rows={
+            repo_name: np.asarray(rows, dtype=np.int64)
+            for repo_name, rows in shared_repo_rows(metadata).items()
+        },
+    )
+
+
+class VectorReplica:
+    """
+    Chunk embeddings, text and metadata copied from the documents table.
+
+    refresh() loads the table the first time and afterwards only fetches rows
+    added since the last sync and drops deleted ones. Searches never wait for
+    the database: they use the current snapshot and start a background refresh
+    once the snapshot is invalidated (the documents table changed) or was last
+    checked more than settings.rag_index_generation_poll_seconds ago.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._checked_at = 0.0
+        self._stale = True
+        self._refreshing = False
+        self.refreshes = 0
+        self.rows_added = 0
+        self.rows_removed = 0
+        self.errors = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def invalidate(self):
+        """Mark the snapshot stale so the next search re-syncs it"""
+        with self._lock:
+            self._stale = True
+
+    def refresh(self) -> bool:
+        """
+        Sync the snapshot with the documents table (blocking).
+
+        Returns:
+            True if the snapshot is up to date with the index generation read
+        """
+        # Clear the flag first so an invalidation during the sync is not lost
+        with self._lock:
+            self._stale = False
+            snapshot = self._snapshot
+
+        generation, message = get_index_generation()
+        if generation is None:
+            return self._refresh_failed(message)
+
+        # The documents table stays the source of truth: a snapshot older than
+        # its generation (e.g. chunks were deleted since the indexer wrote it)
+        # is not mapped, and the table is synced instead
+        if settings.rag_snapshot_dir:
+            version = read_current_version(settings.rag_snapshot_dir)
+            snapshot_generation = (
+                read_snapshot_generation(settings.rag_snapshot_dir, version) if version is not None else None)
+            if version is None:
+                logger.warning(f"No snapshot in {settings.rag_snapshot_dir}, copying the documents table")
+            elif snapshot_generation is not None and snapshot_generation >= generation:
+                return self._map_snapshot(snapshot, version)
+            else:
+                logger.info(f"Snapshot {version} is older than index generation {generation}, "
+                            "syncing the documents table")
+
+        if snapshot is not None and snapshot.generation == generation:
+            with self._lock:
+                self._checked_at = time.monotonic()
+            return True
+
+        known_ids = snapshot.row_ids.tolist() if snapshot is not None else []
+        result, message = get_document_rows(known_ids)
+        if result is None:
+            return self._refresh_failed(message)
+
+        current_ids, rows = result
+        updated, removed = self._apply(snapshot, generation, current_ids, rows)
+        with self._lock:
+            self._snapshot = updated
+            self._checked_at = time.monotonic()
+            self.refreshes += 1
+            self.rows_added += len(rows)
+            self.rows_removed += removed
+        logger.info(
+            f"Vector replica synced to generation {generation}: "
+            f"{len(updated.node_ids)} chunks, +{len(rows)} -{removed}"
+        )
+        return True
+
+    def _map_snapshot(self, snapshot, version: str) -> bool:
+        """Swap in the given on-disk snapshot version unless it is already mapped"""
+        if getattr(snapshot, "version", None) == version:
+            with self._lock:
+                self._checked_at = time.monotonic()
+            return True
+
+        try:
+            mapped = MappedSnapshot(Path(settings.rag_snapshot_dir) / version)
+        except Exception as e:
+            return self._refresh_failed(f"Error opening snapshot {version}: {str(e)}")
+
+        # Searches holding the previous snapshot finish on it; its maps are
+        # released once the last reference goes away
+        with self._lock:
+            self._snapshot = mapped
+            self._checked_at = time.monotonic()
+            self.refreshes += 1
+        logger.info(f"Vector replica mapped snapshot {version}: {len(mapped.node_ids)} chunks")
+        return True
+
+    def _refresh_failed(self, message: str) -> bool:
+        logger.warning(message)
+        with self._lock:
+            self._stale = True
+            self.errors += 1
+        return False
+
+    @staticmethod
+    def _apply(snapshot, generation, current_ids, rows) -> tuple[_Snapshot, int]:
+        """Build the next snapshot from the current one, the live row ids and the new rows"""
+        if snapshot is None:
+            keep = np.zeros(0, dtype=np.int64)
+            empty = np.zeros((0, settings.rag_embed_dim), dtype=np.float32)
+            base = _build_snapshot(generation, [], [], [], [], empty)
+        else:
+            keep = np.flatnonzero(np.isin(snapshot.row_ids, np.asarray(current_ids, dtype=np.int64)))
+            base = snapshot
+        removed = len(base.row_ids) - len(keep)
+
+        if rows:
+            new_matrix = _normalize(np.asarray([row[4] for row in rows], dtype=np.float32))
+        else:
+            new_matrix = np.zeros((0, base.matrix.shape[1]), dtype=np.float32)
+        kept_matrix = base.matrix[keep]
+        matrix = np.concatenate([kept_matrix, new_matrix]) if len(kept_matrix) else new_matrix
+
+        kept = [base.record(i) for i in keep]
+        return _build_snapshot(
+            generation,
+            np.concatenate([base.row_ids[keep], np.asarray([row[0] for row in rows], dtype=np.int64)]),
+            [base.node_ids[i] for i in keep] + [row[1] for row in rows],
+            [record["text"] for record in kept] + [row[2] for row in rows],
+            [record["metadata"] for record in kept] + [row[3] or {} for row in rows],
+            matrix,
+        ), removed
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _maybe_start_refresh(self):
+        with self._lock:
+            expired = time.monotonic() - self._checked_at >= settings.rag_index_generation_poll_seconds
+            if self._refreshing or not (self._stale or expired):
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def search(
+        self,
+        query_embedding,
+        top_k: int,
+        filters: Optional[dict] = None,
+    ) -> Optional[list[NodeWithScore]]:
+        """
+        Exact cosine-similarity search over the replicated chunks.
+
+        Args:
+            query_embedding: Query vector
+            top_k: Number of chunks to return
+            filters: {metadata key: value} exact-match restrictions, keys from
+                METADATA_FILTER_KEYS
+
+        Returns:
+            Up to top_k chunks, best first, scored by cosine similarity as
+            PGVectorStore scores them; None if the replica has not been loaded
+        """
+        self._maybe_start_refresh()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        if not snapshot.node_ids:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = snapshot.matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        if filters:
+            mask = np.ones(len(scores), dtype=bool)
+            for key, value in filters.items():
+                matches = snapshot.columns[key] == value
+                if key == "repo_name" and value in snapshot.shared_rows:
+                    matches[snapshot.shared_rows[value]] = True
+                mask &= matches
+            scores = np.where(mask, scores, -np.inf)
+            top_k = min(top_k, int(mask.sum()))
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return []
+
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        results = []
+        for row in best:
+            record = snapshot.record(row)
+            results.append(NodeWithScore(
+                node=TextNode(id_=snapshot.node_ids[row], text=record["text"], metadata=record["metadata"]),
+                score=float(scores[row]),
+            ))
+        return results
+
+    def get_nodes(self, node_ids: list) -> list[TextNode]:
+        """
+        Return replicated chunks with their (normalized) embeddings.
+
+        Mirrors PGVectorStore.get_nodes() so DiversifyingRetriever can read MMR
+        embeddings from memory; unknown ids are skipped.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        nodes = []
+        for node_id in node_ids:
+            row = snapshot.positions.get(node_id)
+            if row is not None:
+                record = snapshot.record(row)
+                nodes.append(TextNode(
+                    id_=node_id,
+                    text=record["text"],
+                    metadata=record["metadata"],
+                    embedding=snapshot.matrix[row].tolist(),
+                ))
+        return nodes
+
+    async def aget_nodes(self, node_ids: list) -> list[TextNode]:
+        return self.get_nodes(node_ids)
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = self._snapshot
+            return {
+                "loaded": snapshot is not None,
+                "generation": snapshot.generation if snapshot is not None else None,
+                "snapshot_version": getattr(snapshot, "version", None),
+                "chunks": len(snapshot.node_ids) if snapshot is not None else 0,
+                "bytes": int(snapshot.matrix.nbytes) if snapshot is not None else 0,
+                "stale": self._stale,
+                "refreshes": self.refreshes,
+                "rows_added": self.rows_added,
+                "rows_removed": self.rows_removed,
+                "errors": self.errors,
+            }
+
+
+vector_replica = VectorReplica()
+add_index_change_listener(vector_replica.invalidate)
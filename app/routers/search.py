@@ -3,16 +3,40 @@ Search endpoint using RAG for document retrieval.
 """
 
 from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+import asyncio
+import json
 import logging
 
-from ..rag import create_query_engine, query
-from ..db import get_database_document_count
+from ..rag import (
+    QUALITY_LEVELS,
+    RETRIEVAL_MODES,
+    get_query_engine,
+    get_retriever,
+    aembed_query,
+    aembed_queries,
+    aquery,
+    astream_query,
+    aretrieve,
+    build_metadata_filters,
+)
+from ..cache import answer_cache, semantic_answer_cache, query_embedding_cache, normalize_query
+from ..coalesce import SingleFlight
+from ..corpus import corpus_stats
+from ..db import current_index_generation
+from ..replica import vector_replica
+from ..settings import settings
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["search"])
 
+VALID_RESPONSE_MODES = ["tree_summarize", "refine", "compact", "simple_summarize"]
+
+# Concurrent identical /search requests share one embedding, retrieval and synthesis
+search_flight = SingleFlight()
+
 
 class SourceMetadata(BaseModel):
     """Metadata for a source document chunk"""
@@ -21,12 +45,206 @@ class SourceMetadata(BaseModel):
     metadata: dict
 
 
+class ContextReport(BaseModel):
+    """How the retrieved chunks were packed into the synthesis context"""
+    retrieved_chunks: int
+    packed_chunks: int
+    retrieved_tokens: int
+    packed_tokens: int
+    tokens_saved: int
+    estimated_llm_calls: int
+    llm_calls_avoided: int
+
+
 class SearchResponse(BaseModel):
     """Response model for search endpoint"""
     query: str
     response: str
     documents_count: int
     sources: list[SourceMetadata]
+    context: ContextReport | None = None
+
+
+class BatchSearchRequest(BaseModel):
+    """Request model for batch search endpoint"""
+    queries: list[str] = Field(
+        ..., min_length=1, max_length=settings.rag_batch_max_queries,
+        description="The search queries to answer"
+    )
+    top_k: int = Field(
+        20, ge=1, le=50, description="Number of relevant document chunks to retrieve per query")
+    response_mode: str = Field(
+        "tree_summarize",
+        description="Response mode: tree_summarize, refine, compact, or simple_summarize"
+    )
+    retrieval_mode: str = Field(
+        "vector",
+        description="Retrieval mode: vector, or hybrid (vector + full-text search)"
+    )
+    quality: str = Field(
+        "high",
+        description="Vector search recall/latency trade-off: fast, balanced or high"
+    )
+    repo_name: str | None = Field(None, description="Only search chunks of this repository")
+    source: str | None = Field(None, description="Only search chunks with this source metadata")
+    org: str | None = Field(None, description="Only search chunks of this GitHub organization")
+
+
+class BatchSearchResult(BaseModel):
+    """Result for one query of a batch search; exactly one of response or error is set"""
+    query: str
+    response: str | None = None
+    sources: list[SourceMetadata] = []
+    context: ContextReport | None = None
+    error: str | None = None
+
+
+class BatchSearchResponse(BaseModel):
+    """Response model for batch search endpoint"""
+    documents_count: int
+    results: list[BatchSearchResult]
+
+
+class RetrieveResponse(BaseModel):
+    """Response model for retrieve endpoint"""
+    query: str
+    documents_count: int
+    sources: list[SourceMetadata]
+
+
+def _validate_response_mode(response_mode: str):
+    """Raise a 400 error if response_mode is not a supported synthesis mode"""
+    if response_mode not in VALID_RESPONSE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid response_mode. Must be one of: {', '.join(VALID_RESPONSE_MODES)}"
+        )
+
+
+def _validate_retrieval_mode(retrieval_mode: str):
+    """Raise a 400 error if retrieval_mode is not a supported retrieval mode"""
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid retrieval_mode. Must be one of: {', '.join(RETRIEVAL_MODES)}"
+        )
+
+
+def _validate_quality(quality: str):
+    """Raise a 400 error if quality is not a supported search quality level"""
+    if quality not in QUALITY_LEVELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid quality. Must be one of: {', '.join(QUALITY_LEVELS)}"
+        )
+
+
+def _build_filters(repo_name: str | None, source: str | None, org: str | None):
+    """Build the metadata filters of a search, raising a 400 error for invalid values"""
+    try:
+        return build_metadata_filters({"repo_name": repo_name, "source": source, "org": org})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _prepare_search(embed):
+    """
+    Look up the indexed document count while the query embedding request is awaited.
+
+    The count comes from the in-memory corpus stats, which only wait for the
+    database the first time they are read.
+
+    Args:
+        embed: Awaitable producing the query embedding(s), e.g. aembed_query(text)
+
+    Returns:
+        Tuple of (document count, result of embed)
+
+    Raises:
+        HTTPException: 404 if there are no documents to search
+    """
+    doc_count, embedding = await asyncio.gather(
+        corpus_stats.document_count(),
+        embed,
+    )
+
+    # Check if we have documents to search
+    if doc_count == 0:
+        raise HTTPException(
+            status_code=404,
+            detail="No documents found in the index. Please load documents into the vector database first."
+        )
+
+    return doc_count if doc_count else 0, embedding
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format a single Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _answer_query(
+    query_text: str,
+    top_k: int,
+    response_mode: str,
+    retrieval_mode: str,
+    quality: str,
+    scope: tuple,
+    generation: int | None
+) -> SearchResponse:
+    """
+    Embed, retrieve and synthesize an answer for /search, filling the answer caches.
+
+    Args:
+        query_text: The search query
+        top_k: Number of chunks to retrieve
+        response_mode: Synthesis mode
+        retrieval_mode: Retrieval mode, vector or hybrid
+        quality: Vector search quality level
+        scope: (repo_name, source, org) metadata filters, None where unset
+        generation: Current index generation, or None to bypass the answer caches
+
+    Returns:
+        The search response
+    """
+    doc_count, query_embedding = await _prepare_search(aembed_query(query_text))
+
+    # Paraphrases of an answered question reuse its answer without an LLM call
+    cache_key = (normalize_query(query_text), top_k, response_mode, retrieval_mode, quality, scope, generation)
+    semantic_key = (top_k, response_mode, retrieval_mode, quality, scope, generation)
+    if generation is not None:
+        cached = semantic_answer_cache.get(semantic_key, query_embedding)
+        if cached is not None:
+            logger.info(f"Semantic cache hit for: '{query_text}' (matched '{cached.query}')")
+            answer_cache.set(cache_key, cached)
+            return cached
+
+    # Get the shared query engine for these parameters
+    engine = get_query_engine(
+        response_mode=response_mode,
+        top_k=top_k,
+        retrieval_mode=retrieval_mode,
+        quality=quality
+    )
+
+    # Perform the search using RAG without blocking the event loop
+    logger.info(f"Querying documents with: '{query_text}'")
+    context = {}
+    answer, sources = await aquery(
+        engine, query_text, embedding=query_embedding, context_report=context,
+        filters=_build_filters(*scope))
+
+    result = SearchResponse(
+        query=query_text,
+        response=answer,
+        documents_count=doc_count,
+        sources=[SourceMetadata(**s) for s in sources],
+        context=ContextReport(**context) if context else None
+    )
+    if generation is not None:
+        answer_cache.set(cache_key, result)
+        semantic_answer_cache.set(semantic_key, query_embedding, result)
+    return result
 
 
 @router.get("/search", response_model=SearchResponse, summary="Search documents using RAG")
@@ -37,7 +255,19 @@ async def search_documents(
     response_mode: str = Query(
         "tree_summarize",
         description="Response mode: tree_summarize, refine, compact, or simple_summarize"
-    )
+    ),
+    retrieval_mode: str = Query(
+        "vector",
+        description="Retrieval mode: vector, or hybrid (vector + full-text search)"
+    ),
+    quality: str = Query(
+        "balanced",
+        description="Vector search recall/latency trade-off: fast, balanced or high"
+    ),
+    repo_name: str | None = Query(
+        None, description="Only search chunks of this repository"),
+    source: str | None = Query(None, description="Only search chunks with this source metadata"),
+    org: str | None = Query(None, description="Only search chunks of this GitHub organization")
 ):
     """
     Search indexed documents using RAG (Retrieval-Augmented Generation).
@@ -53,60 +283,324 @@ async def search_documents(
         - `refine`: Iteratively refine the answer
         - `compact`: Combine chunks into larger context
         - `simple_summarize`: Simple concatenation
+    - **retrieval_mode**: How to find relevant chunks:
+        - `vector`: Embedding similarity search (default)
+        - `hybrid`: Embedding similarity and Postgres full-text search, fused with
+          reciprocal rank fusion. Better for exact identifiers such as buildpack,
+          env var or repo names, so a lower top_k is usually enough.
+    - **quality**: Recall/latency trade-off of the vector search, via pgvector's
+      `hnsw.ef_search` (bounded server-side):
+        - `fast`: Lowest latency, for interactive callers such as Agentforce actions
+        - `balanced`: Default
+        - `high`: Best recall, for evaluation and batch jobs
+    - **repo_name**, **source**, **org**: Optional exact-match filters on the chunk
+      metadata, e.g. `repo_name=heroku-applink-java` to search one reference app.
+      They are applied inside the database search, so top_k chunks are still
+      returned when enough chunks match.
 
     **Returns:**
     - Search query
     - Generated response based on retrieved documents
     - Number of documents in the index
+    - `context`: chunks and tokens retrieved vs. packed into the synthesis prompt,
+      and the estimated LLM calls made and avoided
     
-    **Note:** Query engine is created fresh for each request, ensuring
-    the latest documents are always searched.
+    **Note:** Query engines are shared across requests through the process-wide
+    registry in app/rag.py. They query the live documents table, so newly
+    indexed documents are searched without a restart. Embedding, retrieval and
+    synthesis are all awaited, so a slow LLM call does not block other requests.
+
+    Answers are cached in process by normalized query, the search parameters and
+    index generation; re-indexing or deleting documents invalidates them. A query
+    whose embedding is close enough to an answered one reuses that answer too.
+    Identical requests that arrive while one is being answered wait for and share
+    its result instead of starting their own.
     """
     try:
-        # Validate response_mode
-        valid_modes = ["tree_summarize", "refine", "compact", "simple_summarize"]
-        if response_mode not in valid_modes:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid response_mode. Must be one of: {', '.join(valid_modes)}"
-            )
-
-        # Get database stats
-        doc_count, _ = get_database_document_count()
-
-        # Check if we have documents to search
-        if doc_count == 0:
-            raise HTTPException(
-                status_code=404,
-                detail="No documents found in the index. Please load documents into the vector database first."
-            )
-
-        # Create query engine for this request (stateless, always up-to-date)
-        logger.info(f"Creating query engine with top_k={top_k}, response_mode={response_mode}")
-        engine = create_query_engine(
+        _validate_response_mode(response_mode)
+        _validate_retrieval_mode(retrieval_mode)
+        _validate_quality(quality)
+        _build_filters(repo_name, source, org)
+        scope = (repo_name, source, org)
+
+        # Serve repeated questions from the answer cache. The key includes the
+        # index generation, so any change to the corpus invalidates old answers.
+        generation = await asyncio.to_thread(current_index_generation)
+        cache_key = (normalize_query(query_text), top_k, response_mode, retrieval_mode, quality, scope, generation)
+        if generation is not None:
+            cached = answer_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Answer cache hit for: '{query_text}'")
+                return cached.model_copy(update={"query": query_text})
+
+        # Identical requests already in flight share one computation
+        result = await search_flight.do(
+            cache_key,
+            lambda: _answer_query(
+                query_text, top_k, response_mode, retrieval_mode, quality, scope, generation)
+        )
+        return result.model_copy(update={"query": query_text})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during search: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Search failed: {str(e)}"
+        )
+
+
+@router.get("/search/stream", summary="Stream a RAG answer as Server-Sent Events")
+async def stream_search_documents(
+    query_text: str = Query(..., description="The search query string", alias="query"),
+    top_k: int = Query(
+        20, description="Number of relevant document chunks to retrieve", ge=1, le=50),
+    response_mode: str = Query(
+        "tree_summarize",
+        description="Response mode: tree_summarize, refine, compact, or simple_summarize"
+    ),
+    retrieval_mode: str = Query(
+        "vector",
+        description="Retrieval mode: vector, or hybrid (vector + full-text search)"
+    ),
+    quality: str = Query(
+        "balanced",
+        description="Vector search recall/latency trade-off: fast, balanced or high"
+    ),
+    repo_name: str | None = Query(
+        None, description="Only search chunks of this repository"),
+    source: str | None = Query(None, description="Only search chunks with this source metadata"),
+    org: str | None = Query(None, description="Only search chunks of this GitHub organization")
+):
+    """
+    Search indexed documents and stream the answer as Server-Sent Events.
+
+    Accepts the same parameters as `/search`. Retrieval happens before the stream
+    opens, so the first event carries the sources; the answer then follows token
+    by token as the LLM generates it.
+
+    **Events:**
+    - `sources`: `{"query", "documents_count", "sources", "context"}`, sent first
+    - `token`: `{"delta"}`, one per generated chunk of the answer
+    - `done`: `{"response"}`, the complete answer
+    - `error`: `{"detail"}`, if synthesis fails after the stream has started
+
+    Errors before the stream opens (invalid parameters, empty index, retrieval
+    failure) are returned as regular JSON error responses.
+    """
+    try:
+        _validate_response_mode(response_mode)
+        _validate_retrieval_mode(retrieval_mode)
+        _validate_quality(quality)
+        filters = _build_filters(repo_name, source, org)
+        # Poll the index generation as /search does, so a corpus change
+        # invalidates the corpus stats before they are checked
+        await asyncio.to_thread(current_index_generation)
+        doc_count, query_embedding = await _prepare_search(aembed_query(query_text))
+
+        engine = get_query_engine(
             response_mode=response_mode,
-            top_k=top_k
+            top_k=top_k,
+            streaming=True,
+            retrieval_mode=retrieval_mode,
+            quality=quality
         )
 
-        # Perform the search using RAG
-        logger.info(f"Querying documents with: '{query_text}'")
-        answer, sources = query(engine, query_text)
+        logger.info(f"Streaming answer for: '{query_text}'")
+        context = {}
+        sources, tokens = await astream_query(
+            engine, query_text, embedding=query_embedding, context_report=context, filters=filters)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during search: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Search failed: {str(e)}"
+        )
+
+    async def event_stream():
+        yield _sse_event("sources", {
+            "query": query_text,
+            "documents_count": doc_count,
+            "sources": [SourceMetadata(**s).model_dump() for s in sources],
+            "context": context or None,
+        })
+        answer = []
+        try:
+            async for token in tokens:
+                answer.append(token)
+                yield _sse_event("token", {"delta": token})
+        except Exception as e:
+            logger.error(f"Error while streaming search answer: {str(e)}")
+            yield _sse_event("error", {"detail": f"Search failed: {str(e)}"})
+            return
+        yield _sse_event("done", {"response": "".join(answer)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/search/retrieve", response_model=RetrieveResponse, summary="Retrieve relevant document chunks")
+async def retrieve_documents(
+    query_text: str = Query(..., description="The search query string", alias="query"),
+    top_k: int = Query(
+        20, description="Number of relevant document chunks to retrieve", ge=1, le=50),
+    retrieval_mode: str = Query(
+        "vector",
+        description="Retrieval mode: vector, or hybrid (vector + full-text search)"
+    ),
+    quality: str = Query(
+        "balanced",
+        description="Vector search recall/latency trade-off: fast, balanced or high"
+    ),
+    repo_name: str | None = Query(
+        None, description="Only search chunks of this repository"),
+    source: str | None = Query(None, description="Only search chunks with this source metadata"),
+    org: str | None = Query(None, description="Only search chunks of this GitHub organization")
+):
+    """
+    Retrieve the most relevant document chunks without generating an answer.
+
+    Embeds the query and runs the retrieval only, skipping LLM synthesis
+    entirely. Use this when the caller summarizes the chunks itself.
+
+    **Parameters:**
+    - **query**: The search query or question
+    - **top_k**: Number of relevant document chunks to retrieve (1-50, default: 20)
+    - **retrieval_mode**: `vector` (default) or `hybrid`, as for `/search`
+    - **quality**: `fast`, `balanced` (default) or `high`, as for `/search`
+    - **repo_name**, **source**, **org**: Optional metadata filters, as for `/search`
+
+    **Returns:**
+    - Search query
+    - Number of documents in the index
+    - Retrieved chunks with full text, similarity score and metadata, best first
+    """
+    try:
+        _validate_retrieval_mode(retrieval_mode)
+        _validate_quality(quality)
+        filters = _build_filters(repo_name, source, org)
+        # Poll the index generation as /search does, so a corpus change
+        # invalidates the corpus stats before they are checked
+        await asyncio.to_thread(current_index_generation)
+        doc_count, query_embedding = await _prepare_search(aembed_query(query_text))
+
+        retriever = get_retriever(top_k=top_k, retrieval_mode=retrieval_mode, quality=quality)
 
-        return SearchResponse(
+        logger.info(f"Retrieving documents for: '{query_text}'")
+        sources = await aretrieve(retriever, query_text, embedding=query_embedding, filters=filters)
+
+        return RetrieveResponse(
             query=query_text,
-            response=answer,
-            documents_count=doc_count if doc_count else 0,
+            documents_count=doc_count,
             sources=[SourceMetadata(**s) for s in sources]
         )
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error during search: {str(e)}")
+        logger.error(f"Error during retrieval: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Retrieval failed: {str(e)}"
+        )
+
+
+@router.post("/search/batch", response_model=BatchSearchResponse, summary="Search documents for many queries")
+async def batch_search_documents(request: BatchSearchRequest):
+    """
+    Answer many search queries in one request.
+
+    All queries are embedded together in as few embedding API calls as
+    `rag_embed_batch_size` allows. Retrieval for every query goes through the
+    shared engine's connection pool, and synthesis runs with at most
+    `rag_batch_max_concurrency` LLM calls in flight.
+
+    A failure on one query does not fail the batch: each result carries either a
+    response with its sources or an error message. The optional repo_name,
+    source and org filters apply to every query of the batch.
+
+    **Returns:**
+    - Number of documents in the index
+    - One result per query, in request order
+    """
+    try:
+        _validate_response_mode(request.response_mode)
+        _validate_retrieval_mode(request.retrieval_mode)
+        _validate_quality(request.quality)
+        filters = _build_filters(request.repo_name, request.source, request.org)
+        await asyncio.to_thread(current_index_generation)
+        doc_count, embeddings = await _prepare_search(aembed_queries(request.queries))
+
+        engine = get_query_engine(
+            response_mode=request.response_mode,
+            top_k=request.top_k,
+            retrieval_mode=request.retrieval_mode,
+            quality=request.quality
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during batch search: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Search failed: {str(e)}"
         )
 
+    semaphore = asyncio.Semaphore(settings.rag_batch_max_concurrency)
+
+    async def search_one(query_text: str, query_embedding: list[float]) -> BatchSearchResult:
+        async with semaphore:
+            try:
+                context = {}
+                answer, sources = await aquery(
+                    engine, query_text, embedding=query_embedding, context_report=context,
+                    filters=filters)
+            except Exception as e:
+                logger.error(f"Error during batch search for '{query_text}': {str(e)}")
+                return BatchSearchResult(query=query_text, error=f"Search failed: {str(e)}")
+        return BatchSearchResult(
+            query=query_text,
+            response=answer,
+            sources=[SourceMetadata(**s) for s in sources],
+            context=ContextReport(**context) if context else None
+        )
+
+    logger.info(f"Batch searching {len(request.queries)} queries")
+    results = await asyncio.gather(*(
+        search_one(query_text, query_embedding)
+        for query_text, query_embedding in zip(request.queries, embeddings)
+    ))
+
+    return BatchSearchResponse(documents_count=doc_count, results=list(results))
 
 
+@router.get("/search/stats", summary="Search cache statistics")
+def get_search_stats() -> dict:
+    """
+    Report hit/miss counters for the search caches.
+
+    **Returns:**
+    - `answer_cache`: size, hit rate, evictions and expirations of the /search answer cache
+    - `semantic_answer_cache`: size, threshold and hit rate of the similarity-matched answer cache
+    - `query_embedding_cache`: hit rate, memory use and embedding latency saved by the
+      query embedding cache
+    - `coalescing`: in-flight /search computations and how many requests joined one
+    - `corpus`: cached document counts, in total and per repository, and their age
+    - `replica`: size and sync counters of the in-memory vector replica (memory
+      retrieval backend only)
+    """
+    return {
+        "answer_cache": answer_cache.stats(),
+        "semantic_answer_cache": semantic_answer_cache.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "coalescing": search_flight.stats(),
+        "corpus": corpus_stats.stats(),
+        "replica": vector_replica.stats() if settings.rag_retrieval_backend == "memory" else None,
+    }
@@ -29,6 +29,32 @@ class Settings(BaseSettings):
         description="PostgreSQL database URL with pgvector support"
     )
     
+    # Database Connection Pool Configuration
+    db_pool_size: int = Field(
+        default=5,
+        description="Number of connections kept open in each database connection pool"
+    )
+    db_max_overflow: int = Field(
+        default=10,
+        description="Extra connections allowed beyond db_pool_size under load"
+    )
+    db_pool_timeout: float = Field(
+        default=30,
+        description="Seconds to wait for a free pooled connection before failing"
+    )
+    db_pool_recycle: int = Field(
+        default=1800,
+        description="Seconds after which pooled connections are replaced"
+    )
+    db_pool_pre_ping: bool = Field(
+        default=True,
+        description="Check pooled connections are alive before using them"
+    )
+    db_hnsw_iterative_scan: str = Field(
+        default="relaxed_order",
+        description="pgvector hnsw.iterative_scan for every connection: off, relaxed_order or strict_order (needs pgvector 0.8+)"
+    )
+    
     # Heroku AI - Inference Configuration
     inference_url: str = Field(
         default="https://ai.heroku.com/inference",
@@ -66,14 +92,134 @@ class Settings(BaseSettings):
         default=10,
         description="Overlap between chunks for context"
     )
+    rag_index_chunker: str = Field(
+        default="bytes",
+        description="How the indexer chunks READMEs: bytes (1024-byte chunks) or tokens (rag_chunk_tokens per chunk)"
+    )
+    rag_chunk_tokens: int = Field(
+        default=400,
+        description="Maximum tokens per chunk with the tokens chunker; keep below the embedding model's input limit (512 for Cohere)"
+    )
+    rag_chunk_overlap_tokens: int = Field(
+        default=40,
+        description="Tokens repeated between consecutive chunks with the tokens chunker"
+    )
     rag_embed_batch_size: int = Field(
         default=96,
         description="Batch size for embedding operations"
     )
+    rag_embed_max_concurrency: int = Field(
+        default=4,
+        description="Maximum embeddings API requests in flight while indexing"
+    )
+    rag_embed_requests_per_minute: float = Field(
+        default=300,
+        description="Embeddings API requests allowed per minute while indexing, set to the Heroku AI quota (0 disables the limit)"
+    )
+    rag_embed_encoding_format: str = Field(
+        default="base64",
+        description="encoding_format requested from the embeddings API while indexing: base64 (float32 bytes) or empty to omit it and receive JSON numbers"
+    )
+    rag_embed_cache_path: str = Field(
+        default=".cache/embeddings.sqlite3",
+        description="SQLite file caching chunk embeddings between indexer runs (empty disables)"
+    )
+    rag_embed_cache_max_entries: int = Field(
+        default=50000,
+        description="Maximum number of cached chunk embeddings; least recently used are evicted"
+    )
     rag_embed_dim: int = Field(
         default=1024,
         description="Embedding dimension (1024 for Cohere)"
     )
+    rag_text_search_config: str = Field(
+        default="english",
+        description="Postgres text search configuration used for hybrid retrieval"
+    )
+    rag_retrieval_backend: str = Field(
+        default="postgres",
+        description="Where the vector search runs: postgres (pgvector HNSW) or memory (exact search over an in-process copy of the embeddings)"
+    )
+    rag_snapshot_dir: str = Field(
+        default="",
+        description="Directory of mmap-able embedding snapshots written by the indexer and mapped by the memory backend (empty disables)"
+    )
+    rag_hybrid_candidate_k: int = Field(
+        default=40,
+        description="Chunks fetched from each of the vector and full-text searches before fusion"
+    )
+    rag_ef_search_fast: int = Field(
+        default=20,
+        description="hnsw.ef_search for quality=fast"
+    )
+    rag_ef_search_balanced: int = Field(
+        default=40,
+        description="hnsw.ef_search for quality=balanced (the default)"
+    )
+    rag_ef_search_high: int = Field(
+        default=200,
+        description="hnsw.ef_search for quality=high"
+    )
+    rag_ef_search_max: int = Field(
+        default=400,
+        description="Upper bound on hnsw.ef_search for any query"
+    )
+    rag_rrf_k: int = Field(
+        default=60,
+        description="Reciprocal rank fusion constant; larger values flatten the gap between ranks"
+    )
+    rag_mmr_enabled: bool = Field(
+        default=True,
+        description="Collapse neighbouring chunks and diversify retrieved chunks with MMR"
+    )
+    rag_mmr_candidate_k: int = Field(
+        default=40,
+        description="Chunks fetched before collapsing and MMR selection of the final top_k"
+    )
+    rag_mmr_lambda: float = Field(
+        default=0.7,
+        description="MMR trade-off: 1.0 ranks by relevance only, 0.0 by diversity only"
+    )
+    rag_context_token_budget: int = Field(
+        default=3000,
+        description="Max tokens of retrieved text passed to synthesis, sized to fit one LLM call (0 disables packing)"
+    )
+    rag_batch_max_queries: int = Field(
+        default=100,
+        description="Maximum number of queries accepted by one batch search request"
+    )
+    rag_batch_max_concurrency: int = Field(
+        default=4,
+        description="Maximum number of concurrent LLM syntheses per batch search request"
+    )
+    rag_answer_cache_size: int = Field(
+        default=1024,
+        description="Maximum number of cached /search answers (0 disables the cache)"
+    )
+    rag_answer_cache_ttl_seconds: float = Field(
+        default=3600,
+        description="Seconds a cached /search answer stays valid"
+    )
+    rag_semantic_cache_size: int = Field(
+        default=1024,
+        description="Maximum number of /search answers matched by query similarity (0 disables)"
+    )
+    rag_semantic_cache_threshold: float = Field(
+        default=0.95,
+        description="Minimum cosine similarity for a query to reuse a cached answer"
+    )
+    rag_query_embedding_cache_size: int = Field(
+        default=4096,
+        description="Maximum number of cached query embeddings (0 disables the cache)"
+    )
+    rag_index_generation_poll_seconds: float = Field(
+        default=5,
+        description="Seconds between reads of the index generation from the database"
+    )
+    rag_corpus_stats_refresh_seconds: float = Field(
+        default=60,
+        description="Max age in seconds of the in-memory document counts before a background refresh"
+    )
     
     # Application Configuration
     app_env: str = Field(
@@ -0,0 +1,224 @@
+"""
+Versioned on-disk snapshots of the indexed chunks, opened with mmap.
+
+The indexer writes a snapshot of the documents table after each run; search
+processes using the memory retrieval backend map the current one instead of
+copying the table into their own heap, so every uvicorn worker on a dyno
+shares a single page-cache copy of the embeddings.
+
+Layout of settings.rag_snapshot_dir:
+
+    CURRENT                 name of the current version, replaced atomically
+    <version>/manifest.json generation, row count, dimension, column vocabularies,
+                            rows shared with other repositories
+    <version>/embeddings.npy     float32 (rows, dim), L2-normalized
+    <version>/row_ids.npy        int64 documents table id of each row
+    <version>/offsets.npy        int64 (rows + 1) byte offsets into records.bin
+    <version>/records.bin        UTF-8 JSON {"text", "metadata"} per row, back to back
+    <version>/node_ids.json      node id of each row
+    <version>/column_<key>.npy   int32 codes into the manifest vocabulary of key
+
+A version directory is complete before CURRENT names it and is never modified
+afterwards, so readers can keep using an old version while a new one is written.
+"""
+
+import json
+import logging
+import mmap
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .db import METADATA_FILTER_KEYS, get_document_rows, get_index_generation, shared_repo_rows
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+
+# Versions kept on disk; older ones are deleted after a new one is published.
+# Workers still mapping a deleted version keep reading it until they swap.
+SNAPSHOT_VERSIONS_KEPT = 2
+
+CURRENT_FILE = "CURRENT"
+
+
+class _Records:
+    """Sequence view of one field of the records, decoded from the mapped file on access"""
+
+    def __init__(self, snapshot, field: str):
+        self._snapshot = snapshot
+        self._field = field
+
+    def __len__(self):
+        return len(self._snapshot.node_ids)
+
+    def __getitem__(self, row):
+        return self._snapshot.record(row)[self._field]
+
+
+class MappedSnapshot:
+    """
+    One snapshot version opened read-only with mmap.
+
+    Exposes the attributes VectorReplica searches over (matrix, columns,
+    shared_rows, node_ids, texts, metadata, positions). The embedding matrix
+    is a read-only np.memmap and records are decoded straight from the mapped
+    records file, so opening a snapshot copies nothing but the node ids and
+    filter columns.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        manifest = json.loads((path / "manifest.json").read_text())
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format in {path}: {manifest.get('format')}")
+
+        self.version = path.name
+        self.generation = manifest["generation"]
+        self.matrix = np.load(path / "embeddings.npy", mmap_mode="r")
+        self.row_ids = np.load(path / "row_ids.npy", mmap_mode="r")
+        self._offsets = np.load(path / "offsets.npy", mmap_mode="r")
+        self.node_ids = json.loads((path / "node_ids.json").read_text())
+        self.positions = {node_id: row for row, node_id in enumerate(self.node_ids)}
+        self.columns = {
+            key: np.asarray(vocabulary + [None], dtype=object)[np.load(path / f"column_{key}.npy")]
+            for key, vocabulary in manifest["columns"].items()
+        }
+        # Absent from snapshots written before chunks were shared
+        self.shared_rows = {
+            repo_name: np.asarray(rows, dtype=np.int64)
+            for repo_name, rows in manifest.get("shared_rows", {}).items()
+        }
+
+        with open(path / "records.bin", "rb") as f:
+            # mmap cannot map an empty file
+            self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] else b""
+        self.texts = _Records(self, "text")
+        self.metadata = _Records(self, "metadata")
+
+    def record(self, row: int) -> dict:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        return json.loads(self._records[start:end])
+
+
+def read_current_version(directory) -> str | None:
+    """Return the name of the current snapshot version, or None if there is none"""
+    try:
+        return (Path(directory) / CURRENT_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_snapshot_generation(directory, version: str) -> int | None:
+    """Return the index generation a snapshot version was written at, or None if it cannot be read"""
+    try:
+        return json.loads((Path(directory) / version / "manifest.json").read_text())["generation"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def open_current_snapshot(directory) -> MappedSnapshot | None:
+    """Map the current snapshot version in directory, or return None if there is none"""
+    version = read_current_version(directory)
+    if version is None:
+        return None
+    return MappedSnapshot(Path(directory) / version)
+
+
+def _write_version(path: Path, generation: int, rows: list):
+    """Write the files of one snapshot version into the empty directory path"""
+    path.mkdir(parents=True)
+
+    if rows:
+        embeddings = np.asarray([row[4] for row in rows], dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    else:
+        embeddings = np.zeros((0, 0), dtype=np.float32)
+    np.save(path / "embeddings.npy", embeddings)
+    np.save(path / "row_ids.npy", np.asarray([row[0] for row in rows], dtype=np.int64))
+
+    offsets = [0]
+    with open(path / "records.bin", "wb") as f:
+        for row in rows:
+            record = json.dumps({"text": row[2], "metadata": row[3] or {}}).encode("utf-8")
+            f.write(record)
+            offsets.append(offsets[-1] + len(record))
+    np.save(path / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+    (path / "node_ids.json").write_text(json.dumps([row[1] for row in rows]))
+
+    # Filter columns as codes into a per-key vocabulary; -1 (None) if the key is unset
+    columns = {}
+    for key in METADATA_FILTER_KEYS:
+        values = [(row[3] or {}).get(key) for row in rows]
+        vocabulary = sorted({value for value in values if value is not None})
+        codes = {value: code for code, value in enumerate(vocabulary)}
+        np.save(path / f"column_{key}.npy", np.asarray([codes.get(v, -1) for v in values], dtype=np.int32))
+        columns[key] = vocabulary
+
+    (path / "manifest.json").write_text(json.dumps({
+        "format": SNAPSHOT_FORMAT,
+        "generation": generation,
+        "rows": len(rows),
+        "dim": int(embeddings.shape[1]) if len(rows) else 0,
+        "columns": columns,
+        "shared_rows": shared_repo_rows([row[3] for row in rows]),
+        "created_at": time.time(),
+    }))
+
+    for file in path.iterdir():
+        with open(file, "rb") as f:
+            os.fsync(f.fileno())
+
+
+def _publish(directory: Path, version: str):
+    """Point CURRENT at version atomically and delete old versions"""
+    pointer = directory / f".{CURRENT_FILE}.tmp"
+    pointer.write_text(version)
+    os.replace(pointer, directory / CURRENT_FILE)
+
+    versions = sorted(
+        (p for p in directory.iterdir() if p.is_dir() and not p.name.startswith(".")),
+        key=lambda p: p.name,
+    )
+    for old in versions[:-SNAPSHOT_VERSIONS_KEPT]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def write_snapshot(directory):
+    """
+    Write a new snapshot version of the documents table and make it current.
+
+    The version is written to a hidden directory and renamed into place before
+    CURRENT is replaced, so readers only ever see complete versions.
+
+    Args:
+        directory: Snapshot directory, usually settings.rag_snapshot_dir
+
+    Returns:
+        (version name, message), or (None, error message) on failure
+    """
+    try:
+        generation, message = get_index_generation()
+        if generation is None:
+            return None, message
+        result, message = get_document_rows()
+        if result is None:
+            return None, message
+        _, rows = result
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        # Zero-padded so versions sort by creation time
+        version = f"{time.time_ns():020d}-g{generation}"
+        staging = directory / f".{version}"
+        _write_version(staging, generation, rows)
+        os.rename(staging, directory / version)
+        _publish(directory, version)
+
+        return version, f"Wrote snapshot {version} ({len(rows)} chunks)"
+
+    except Exception as e:
+        return None, f"Error writing snapshot: {str(e)}"
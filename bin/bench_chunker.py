@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark chunk_text_simple() against the implementation it replaced.
+
+Chunks a synthetic corpus of README-like text (ASCII, accented Latin, CJK and
+emoji) with both and reports throughput in MB/s. Exits non-zero if the outputs
+differ (ignoring the empty chunks the old implementation emitted).
+
+    python bin/bench_chunker.py [--megabytes 8] [--max-bytes 1024] [--overlap-bytes 100]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.embeddings import chunk_text_simple, iter_chunks_simple
+
+
+def legacy_chunk_text_simple(text: str, max_bytes: int = 1024, overlap_bytes: int = 100) -> list[str]:
+    """The previous chunk_text_simple(), which backed up one byte per decode attempt"""
+    chunks = []
+    text_bytes = text.encode('utf-8')
+    start = 0
+    while start < len(text_bytes):
+        end = start + max_bytes
+        try:
+            chunk = text_bytes[start:end].decode('utf-8')
+        except UnicodeDecodeError:
+            while end > start:
+                end -= 1
+                try:
+                    chunk = text_bytes[start:end].decode('utf-8')
+                    break
+                except UnicodeDecodeError:
+                    continue
+            else:
+                start = end + 1
+                continue
+        chunks.append(chunk)
+        start = end - overlap_bytes
+    return chunks
+
+
+def make_corpus(megabytes: float, seed: int = 0) -> str:
+    """Random words drawn from several scripts, about megabytes of UTF-8"""
+    rng = random.Random(seed)
+    words = [
+        "heroku", "deploy", "salesforce", "postgres", "README", "install", "the", "a", "of",
+        "café", "naïve", "größe", "приложение", "развертывание",
+        "部署", "应用程序", "データベース", "🚀", "✅", "📦",
+    ]
+    parts, size = [], 0
+    while size < megabytes * 1024 * 1024:
+        line = " ".join(rng.choice(words) for _ in range(rng.randrange(4, 16))) + "\n"
+        parts.append(line)
+        size += len(line.encode("utf-8"))
+    return "".join(parts)
+
+
+def bench(name: str, chunker, text: str, repeat: int) -> tuple[float, list]:
+    megabytes = len(text.encode("utf-8")) / (1024 * 1024)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = chunker(text)
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:<28} {best * 1000:9.1f} ms  {megabytes / best:8.1f} MB/s  {len(chunks)} chunks")
+    return best, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the byte-based text chunker.")
+    parser.add_argument("--megabytes", type=float, default=8, help="Corpus size (default: 8)")
+    parser.add_argument("--max-bytes", type=int, default=1024, help="Maximum bytes per chunk (default: 1024)")
+    parser.add_argument("--overlap-bytes", type=int, default=100, help="Overlap between chunks (default: 100)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per chunker; the best is reported (default: 3)")
+    args = parser.parse_args()
+
+    text = make_corpus(args.megabytes)
+    options = {"max_bytes": args.max_bytes, "overlap_bytes": args.overlap_bytes}
+    print(f"Corpus: {len(text.encode('utf-8')) / (1024 * 1024):.1f} MB, {len(text)} characters")
+
+    legacy_time, legacy_chunks = bench(
+        "legacy chunk_text_simple", lambda t: legacy_chunk_text_simple(t, **options), text, args.repeat)
+    new_time, new_chunks = bench(
+        "chunk_text_simple", lambda t: chunk_text_simple(t, **options), text, args.repeat)
+    bench("iter_chunks_simple (drain)", lambda t: list(iter_chunks_simple(t, **options)), text, args.repeat)
+
+    print(f"Speedup: {legacy_time / new_time:.2f}x")
+    # The legacy chunker also emitted empty chunks, which are now skipped
+    if new_chunks != [chunk for chunk in legacy_chunks if chunk]:
+        print("Outputs differ", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,60 +5,100 @@ and index embeddings into a PostgreSQL vector database using Heroku MIA and Cohe
 """
 
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
+from typing import Optional
 
 # Add parent directory to path to import app modules
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from app.embeddings import create_text_nodes_with_embeddings
+from app.db import ensure_metadata_indexes, ensure_text_search_index, mark_index_changed
+from app.embedding_cache import get_disk_embedding_cache
+from app.embeddings import CHUNKERS, create_deduplicated_text_nodes, embedding_rate_limiter
 from app.github import get_repositories, download_readme
 from app.rag import create_vector_store
+from app.settings import settings
+from app.snapshot import write_snapshot
 
 
 GITHUB_ORG = "heroku-reference-apps"
 OUTPUT_DIR = "reference-app-readmes"
 
+# Nodes created and inserted per vector store call; the embeddings of the
+# rest stay in float32 arrays until their turn
+INSERT_BATCH_SIZE = 256
 
-def generate_embeddings(content: str, repo_name: str, file_path: str, vector_store) -> bool:
+
+def generate_embeddings(documents: list[tuple[str, dict]], vector_store) -> int:
     """
-    Generate embeddings for the README content and store in vector database.
+    Generate embeddings for the README contents and store in vector database.
+    
+    Chunks repeated across READMEs are embedded and stored once, listing every
+    repository they occur in (see create_deduplicated_text_nodes()).
     
     Args:
-        content: The README text content
-        repo_name: Name of the repository
-        file_path: Path to the README file
+        documents: (README text content, metadata) per repository
         vector_store: PGVectorStore instance
     
     Returns:
-        True if embeddings were generated successfully
+        Number of READMEs with chunks stored
     """
     try:
-        metadata = {
-            "source": "heroku-reference-apps",
-            "repo_name": repo_name,
-            "file_path": file_path,
-            "org": GITHUB_ORG,
-        }
-        
         # Create nodes with embeddings
-        nodes = create_text_nodes_with_embeddings(
-            content=content,
-            metadata=metadata,
+        nodes, stats = create_deduplicated_text_nodes(
+            documents,
             max_bytes=1024,
-            overlap_bytes=100
+            overlap_bytes=100,
+            chunker=settings.rag_index_chunker,
         )
         
         # Add nodes to vector store
-        vector_store.add(nodes)
+        stored = 0
+        while batch := list(islice(nodes, INSERT_BATCH_SIZE)):
+            vector_store.add(batch)
+            stored += len(batch)
         
-        print(f"  🔮 Generated embeddings for {repo_name} ({len(nodes)} chunks)")
-        return True
+        print(f"  🔮 Generated embeddings for {stored} distinct chunks of {stats['chunks']} "
+              f"({stats['shared_chunks']} shared by several READMEs)")
+        return stats["repositories"]
         
     except Exception as e:
-        print(f"  ❌ Error generating embeddings for {repo_name}: {e}")
+        print(f"  ❌ Error generating embeddings: {e}")
         import traceback
         traceback.print_exc()
-        return False
+        return 0
+
+
+def download_repository(repo_name: str, output_dir: Path) -> tuple[bool, Optional[tuple[str, dict]]]:
+    """
+    Download one repository's README.
+    
+    Args:
+        repo_name: Name of the repository
+        output_dir: Directory to save the README to
+    
+    Returns:
+        (README downloaded, (content, metadata) to index or None if it is empty)
+    """
+    success, content, file_path = download_readme(GITHUB_ORG, repo_name, output_dir)
+    
+    if not success:
+        print(f"  ⚠️  No README found for {repo_name}")
+        return False, None
+    
+    if file_path and Path(file_path).exists():
+        print(f"  ✅ README available for {repo_name} ({len(content)} bytes)")
+    
+    if not content:
+        return True, None
+    metadata = {
+        "source": "heroku-reference-apps",
+        "repo_name": repo_name,
+        "file_path": file_path,
+        "org": GITHUB_ORG,
+    }
+    return True, (content, metadata)
 
 
 def main():
@@ -66,6 +106,11 @@ def main():
     print(f"🚀 Downloading READMEs from {GITHUB_ORG}")
     print("=" * 60)
     
+    if settings.rag_index_chunker not in CHUNKERS:
+        print(f"❌ Unknown RAG_INDEX_CHUNKER {settings.rag_index_chunker!r}, expected one of {', '.join(CHUNKERS)}")
+        sys.exit(1)
+    print(f"✂️  Chunker: {settings.rag_index_chunker}")
+    
     # Create output directory
     output_dir = Path(OUTPUT_DIR)
     output_dir.mkdir(exist_ok=True)
@@ -75,6 +120,8 @@ def main():
     print("🔧 Initializing vector store...")
     try:
         vector_store = create_vector_store()
+        success, message = ensure_text_search_index()
+        print(f"{'✅' if success else '⚠️ '} {message}")
         print("✅ Vector store ready\n")
     except Exception as e:
         print(f"❌ Failed to initialize vector store: {e}")
@@ -91,32 +138,45 @@ def main():
     
     print(f"Found {len(repos)} repositories\n")
     
-    # Download README for each repository and generate embeddings
-    download_count = 0
+    # Download the READMEs concurrently, then embed them together so chunks
+    # shared by several READMEs are embedded once. The embeddings API requests
+    # run concurrently within the in-flight cap and rate limit in app/embeddings.py.
+    workers = max(1, settings.rag_embed_max_concurrency)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda repo: download_repository(repo["name"], output_dir), repos))
+    
+    download_count = sum(downloaded for downloaded, _ in results)
+    documents = [document for _, document in results if document is not None]
+    
+    # Generate embeddings if infrastructure is available and content exists
     embedding_count = 0
+    if vector_store is not None and documents:
+        print()
+        embedding_count = generate_embeddings(documents, vector_store)
     
-    for repo in repos:
-        repo_name = repo["name"]
-        print(f"📄 {repo_name}")
-        
-        success, content, file_path = download_readme(GITHUB_ORG, repo_name, output_dir)
-        
-        if success:
-            if file_path and Path(file_path).exists():
-                # Check if this was an existing file
-                print(f"  ✅ README available ({len(content)} bytes)")
-            download_count += 1
-            
-            # Generate embeddings if infrastructure is available and content exists
-            if vector_store is not None and content:
-                if generate_embeddings(content, repo_name, file_path, vector_store):
-                    embedding_count += 1
-        else:
-            print(f"  ⚠️  No README found for {repo_name}")
+    # Let running search processes know their cached answers are stale
+    if embedding_count > 0:
+        # The documents table may only have been created by this run
+        success, message = ensure_metadata_indexes()
+        print(f"\n{'✅' if success else '⚠️ '} {message}")
+        success, message = mark_index_changed()
+        print(f"\n{'🔄' if success else '⚠️ '} {message}")
+
+    # Publish the memory-mapped snapshot search processes load the corpus from
+    if settings.rag_snapshot_dir:
+        version, message = write_snapshot(settings.rag_snapshot_dir)
+        print(f"{'📸' if version else '⚠️ '} {message}")
     
     print("\n" + "=" * 60)
     print(f"🎉 Downloaded {download_count}/{len(repos)} READMEs")
     print(f"🔮 Generated embeddings for {embedding_count}/{download_count} READMEs")
+    limiter = embedding_rate_limiter.stats()
+    print(f"⏱️  {limiter['acquired']} embedding requests, {limiter['waited_seconds']}s waiting on the rate limit")
+    cache = get_disk_embedding_cache()
+    if cache is not None:
+        stats = cache.stats()
+        print(f"🗄️  Embedding cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['entries']} entries, {stats['evictions']} evicted")
     print(f"📂 Files saved to: {output_dir.absolute()}")
     print(f"💾 Embeddings stored in PostgreSQL vector database")
 
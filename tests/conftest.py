@@ -46,6 +46,12 @@ def client(monkeypatch):
     mock_context.addons.applink = AsyncMock()
 
     monkeypatch.setattr(sdk, "get_client_context", lambda: mock_context)
+
+    # Don't build real query engines (LLM, pgvector) or read the database during app startup
+    from app.rag import engine_registry
+    from app.corpus import corpus_stats
+    monkeypatch.setattr(engine_registry, "warm", lambda *args, **kwargs: None)
+    monkeypatch.setattr(corpus_stats, "refresh", lambda *args, **kwargs: False)
     
     from app.main import app
     
@@ -1,5 +1,36 @@
+import asyncio
+import json
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+
+
+QUERY_EMBEDDING = [0.1, 0.2, 0.3]
+
+
+@pytest.fixture(autouse=True)
+def mock_index_generation():
+    """
+    Pin the index generation and start every test with empty answer caches.
+    """
+    from app.cache import answer_cache, semantic_answer_cache
+
+    answer_cache.clear()
+    semantic_answer_cache.clear()
+    with patch("app.routers.search.current_index_generation") as mock_generation:
+        mock_generation.return_value = 1
+        yield mock_generation
+    answer_cache.clear()
+    semantic_answer_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def mock_embed_query():
+    """
+    Stub out query embedding so no request reaches the embeddings API.
+    """
+    with patch("app.routers.search.aembed_query", new_callable=AsyncMock) as mock_embed:
+        mock_embed.return_value = QUERY_EMBEDDING
+        yield mock_embed
 
 
 @pytest.mark.asyncio
@@ -7,16 +38,16 @@ async def test_search_documents_success(client):
     """
     Test the /search endpoint with valid query returns expected response.
     """
-    # Mock the database document count
-    with patch("app.routers.search.get_database_document_count") as mock_count, \
-         patch("app.routers.search.create_query_engine") as mock_engine, \
-         patch("app.routers.search.query") as mock_query:
+    # Mock the cached document count
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine") as mock_engine, \
+         patch("app.routers.search.aquery", new_callable=AsyncMock) as mock_query:
         
         # Setup mocks
-        mock_count.return_value = (42, 5)  # 42 documents, 5 unique sources
+        mock_count.return_value = 42  # 42 documents
         mock_query_engine = MagicMock()
         mock_engine.return_value = mock_query_engine
-        mock_query.return_value = "This is a test response from the RAG system."
+        mock_query.return_value = ("This is a test response from the RAG system.", [])
         
         # Make request
         response = client.get("/search?query=test+question&top_k=5&response_mode=tree_summarize")
@@ -30,8 +61,10 @@ async def test_search_documents_success(client):
         
         # Verify mocks were called correctly
         mock_count.assert_called_once()
-        mock_engine.assert_called_once_with(response_mode="tree_summarize", top_k=5)
-        mock_query.assert_called_once_with(mock_query_engine, "test question")
+        mock_engine.assert_called_once_with(response_mode="tree_summarize", top_k=5, retrieval_mode="vector", quality="balanced")
+        mock_query.assert_called_once_with(
+            mock_query_engine, "test question", embedding=QUERY_EMBEDDING, context_report={},
+            filters=None)
 
 
 @pytest.mark.asyncio
@@ -39,8 +72,8 @@ async def test_search_documents_no_documents(client):
     """
     Test the /search endpoint returns 404 when no documents are indexed.
     """
-    with patch("app.routers.search.get_database_document_count") as mock_count:
-        mock_count.return_value = (0, 0)
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count:
+        mock_count.return_value = 0
         
         response = client.get("/search?query=test")
         
@@ -53,8 +86,8 @@ async def test_search_documents_invalid_response_mode(client):
     """
     Test the /search endpoint rejects invalid response_mode.
     """
-    with patch("app.routers.search.get_database_document_count") as mock_count:
-        mock_count.return_value = (10, 2)
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count:
+        mock_count.return_value = 10
         
         response = client.get("/search?query=test&response_mode=invalid_mode")
         
@@ -62,6 +95,106 @@ async def test_search_documents_invalid_response_mode(client):
         assert "Invalid response_mode" in response.json()["detail"]
 
 
+@pytest.mark.asyncio
+async def test_search_documents_invalid_retrieval_mode(client):
+    """
+    Test the /search endpoint rejects invalid retrieval_mode.
+    """
+    response = client.get("/search?query=test&retrieval_mode=keyword")
+
+    assert response.status_code == 400
+    assert "Invalid retrieval_mode" in response.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_search_documents_invalid_quality(client):
+    """
+    Test the /search endpoint rejects unknown quality levels.
+    """
+    response = client.get("/search?query=test&quality=exhaustive")
+
+    assert response.status_code == 400
+    assert "Invalid quality" in response.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_search_documents_hybrid_retrieval(client):
+    """
+    Test the /search endpoint passes retrieval_mode=hybrid to the query engine.
+    """
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine") as mock_engine, \
+         patch("app.routers.search.aquery", new_callable=AsyncMock) as mock_query:
+        mock_count.return_value = 10
+        mock_query.return_value = ("Set HEROKU_API_KEY", [])
+
+        response = client.get("/search?query=HEROKU_API_KEY&top_k=5&retrieval_mode=hybrid")
+
+        assert response.status_code == 200
+        mock_engine.assert_called_once_with(response_mode="tree_summarize", top_k=5, retrieval_mode="hybrid", quality="balanced")
+
+
+@pytest.mark.asyncio
+async def test_search_documents_reports_context_packing(client):
+    """
+    Test the /search endpoint returns the context packing report filled in by aquery().
+    """
+    report = {
+        "retrieved_chunks": 20, "packed_chunks": 6, "retrieved_tokens": 5200, "packed_tokens": 2900,
+        "tokens_saved": 2300, "estimated_llm_calls": 1, "llm_calls_avoided": 2,
+    }
+
+    async def fake_aquery(engine, query_text, embedding=None, context_report=None, filters=None):
+        context_report.update(report)
+        return "Packed answer", []
+
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine"), \
+         patch("app.routers.search.aquery", side_effect=fake_aquery):
+        mock_count.return_value = 10
+
+        response = client.get("/search?query=test")
+
+        assert response.status_code == 200
+        assert response.json()["context"] == report
+
+
+@pytest.mark.asyncio
+async def test_search_documents_pushes_down_metadata_filters(client):
+    """
+    Test the /search endpoint turns repo_name/org into metadata filters and caches per scope.
+    """
+    from app.rag import metadata_filter_conditions
+
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine"), \
+         patch("app.routers.search.aquery", new_callable=AsyncMock) as mock_query:
+        mock_count.return_value = 10
+        mock_query.return_value = ("Scoped answer", [])
+
+        response = client.get("/search?query=test&repo_name=heroku-applink-java&org=heroku-reference-apps")
+        unscoped = client.get("/search?query=test")
+
+        assert response.status_code == 200
+        assert unscoped.status_code == 200
+        assert mock_query.call_count == 2
+        filters = mock_query.call_args_list[0].kwargs["filters"]
+        assert metadata_filter_conditions(filters) == {
+            "repo_name": "heroku-applink-java", "org": "heroku-reference-apps"}
+        assert mock_query.call_args_list[1].kwargs["filters"] is None
+
+
+@pytest.mark.asyncio
+async def test_search_documents_rejects_invalid_metadata_filter(client):
+    """
+    Test the /search endpoint rejects filter values that are not plain names.
+    """
+    response = client.get("/search?query=test&repo_name=x' OR '1'='1")
+
+    assert response.status_code == 400
+    assert "Invalid repo_name" in response.json()["detail"]
+
+
 @pytest.mark.asyncio
 async def test_search_documents_missing_query(client):
     """
@@ -77,20 +210,20 @@ async def test_search_documents_default_parameters(client):
     """
     Test the /search endpoint uses correct defaults when parameters not provided.
     """
-    with patch("app.routers.search.get_database_document_count") as mock_count, \
-         patch("app.routers.search.create_query_engine") as mock_engine, \
-         patch("app.routers.search.query") as mock_query:
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine") as mock_engine, \
+         patch("app.routers.search.aquery", new_callable=AsyncMock) as mock_query:
         
-        mock_count.return_value = (100, 10)
+        mock_count.return_value = 100
         mock_query_engine = MagicMock()
         mock_engine.return_value = mock_query_engine
-        mock_query.return_value = "Default response"
+        mock_query.return_value = ("Default response", [])
         
         response = client.get("/search?query=test")
         
         assert response.status_code == 200
-        # Verify defaults: top_k=10, response_mode="tree_summarize"
-        mock_engine.assert_called_once_with(response_mode="tree_summarize", top_k=10)
+        # Verify defaults: top_k=20, response_mode="tree_summarize"
+        mock_engine.assert_called_once_with(response_mode="tree_summarize", top_k=20, retrieval_mode="vector", quality="balanced")
 
 
 @pytest.mark.asyncio
@@ -98,28 +231,28 @@ async def test_search_documents_top_k_bounds(client):
     """
     Test the /search endpoint validates top_k parameter bounds.
     """
-    with patch("app.routers.search.get_database_document_count") as mock_count:
-        mock_count.return_value = (10, 2)
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count:
+        mock_count.return_value = 10
         
         # Test top_k too low
         response = client.get("/search?query=test&top_k=0")
         assert response.status_code == 422
         
         # Test top_k too high
-        response = client.get("/search?query=test&top_k=21")
+        response = client.get("/search?query=test&top_k=51")
         assert response.status_code == 422
         
         # Test top_k at boundaries (should succeed)
-        with patch("app.routers.search.create_query_engine") as mock_engine, \
-             patch("app.routers.search.query") as mock_query:
+        with patch("app.routers.search.get_query_engine") as mock_engine, \
+             patch("app.routers.search.aquery", new_callable=AsyncMock) as mock_query:
             mock_query_engine = MagicMock()
             mock_engine.return_value = mock_query_engine
-            mock_query.return_value = "Response"
+            mock_query.return_value = ("Response", [])
             
             response = client.get("/search?query=test&top_k=1")
             assert response.status_code == 200
             
-            response = client.get("/search?query=test&top_k=20")
+            response = client.get("/search?query=test&top_k=50")
             assert response.status_code == 200
 
 
@@ -128,10 +261,10 @@ async def test_search_documents_handles_query_error(client):
     """
     Test the /search endpoint handles errors gracefully.
     """
-    with patch("app.routers.search.get_database_document_count") as mock_count, \
-         patch("app.routers.search.create_query_engine") as mock_engine:
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine") as mock_engine:
         
-        mock_count.return_value = (10, 2)
+        mock_count.return_value = 10
         mock_engine.side_effect = Exception("Database connection failed")
         
         response = client.get("/search?query=test")
@@ -148,17 +281,248 @@ async def test_search_documents_all_response_modes(client):
     valid_modes = ["tree_summarize", "refine", "compact", "simple_summarize"]
     
     for mode in valid_modes:
-        with patch("app.routers.search.get_database_document_count") as mock_count, \
-             patch("app.routers.search.create_query_engine") as mock_engine, \
-             patch("app.routers.search.query") as mock_query:
+        with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+             patch("app.routers.search.get_query_engine") as mock_engine, \
+             patch("app.routers.search.aquery", new_callable=AsyncMock) as mock_query:
             
-            mock_count.return_value = (10, 2)
+            mock_count.return_value = 10
             mock_query_engine = MagicMock()
             mock_engine.return_value = mock_query_engine
-            mock_query.return_value = f"Response with {mode}"
+            mock_query.return_value = (f"Response with {mode}", [])
             
             response = client.get(f"/search?query=test&response_mode={mode}")
             
             assert response.status_code == 200, f"Failed for mode: {mode}"
-            mock_engine.assert_called_once_with(response_mode=mode, top_k=10)
+            mock_engine.assert_called_once_with(response_mode=mode, top_k=20, retrieval_mode="vector", quality="balanced")
+
+
+
+@pytest.mark.asyncio
+async def test_stream_search_documents_sends_sources_then_tokens(client):
+    """
+    Test the /search/stream endpoint emits sources first, then tokens, then done.
+    """
+    async def tokens():
+        for token in ["Deploy ", "with ", "git push."]:
+            yield token
+
+    sources = [{"text": "chunk", "score": 0.9, "metadata": {"repo_name": "demo"}}]
+
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine") as mock_engine, \
+         patch("app.routers.search.astream_query", new_callable=AsyncMock) as mock_stream:
+        mock_count.return_value = 42
+        mock_stream.return_value = (sources, tokens())
+
+        response = client.get("/search/stream?query=how+to+deploy&top_k=5")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [
+            (block.split("\n")[0].removeprefix("event: "), json.loads(block.split("\n")[1].removeprefix("data: ")))
+            for block in response.text.strip().split("\n\n")
+        ]
+        assert events[0] == ("sources", {"query": "how to deploy", "documents_count": 42, "sources": sources, "context": None})
+        assert [data["delta"] for name, data in events if name == "token"] == ["Deploy ", "with ", "git push."]
+        assert events[-1] == ("done", {"response": "Deploy with git push."})
+        mock_engine.assert_called_once_with(
+            response_mode="tree_summarize", top_k=5, streaming=True, retrieval_mode="vector", quality="balanced")
+
+
+@pytest.mark.asyncio
+async def test_stream_search_documents_reports_errors_before_streaming(client):
+    """
+    Test the /search/stream endpoint returns a JSON error when retrieval fails.
+    """
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine") as mock_engine:
+        mock_count.return_value = 10
+        mock_engine.side_effect = Exception("Database connection failed")
+
+        response = client.get("/search/stream?query=test")
+
+        assert response.status_code == 500
+        assert "Search failed" in response.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_documents_success(client):
+    """
+    Test the /search/retrieve endpoint returns full chunks without calling the LLM.
+    """
+    sources = [{"text": "x" * 500, "score": 0.8, "metadata": {"repo_name": "demo"}}]
+
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_retriever") as mock_retriever, \
+         patch("app.routers.search.aretrieve", new_callable=AsyncMock) as mock_retrieve, \
+         patch("app.routers.search.aquery", new_callable=AsyncMock) as mock_query:
+        mock_count.return_value = 42
+        mock_retrieve.return_value = sources
+
+        response = client.get("/search/retrieve?query=java+org+actions&top_k=5")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["query"] == "java org actions"
+        assert data["documents_count"] == 42
+        assert data["sources"] == sources
+        mock_retriever.assert_called_once_with(top_k=5, retrieval_mode="vector", quality="balanced")
+        mock_retrieve.assert_called_once_with(
+            mock_retriever.return_value, "java org actions", embedding=QUERY_EMBEDDING, filters=None
+        )
+        mock_query.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_retrieve_and_stream_poll_the_index_generation(client, mock_index_generation):
+    """
+    Test /search/retrieve and /search/stream check the index generation like /search,
+    so the corpus stats are invalidated after a corpus change before the empty check.
+    """
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count:
+        mock_count.return_value = 0
+
+        assert client.get("/search/retrieve?query=test").status_code == 404
+        assert client.get("/search/stream?query=test").status_code == 404
+
+    assert mock_index_generation.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_retrieve_documents_top_k_bounds(client):
+    """
+    Test the /search/retrieve endpoint applies the same top_k bounds as /search.
+    """
+    assert client.get("/search/retrieve?query=test&top_k=0").status_code == 422
+    assert client.get("/search/retrieve?query=test&top_k=51").status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_batch_search_documents_embeds_once_and_reports_per_query_errors(client):
+    """
+    Test the /search/batch endpoint embeds all queries in one call and isolates failures.
+    """
+    async def fake_aquery(engine, query_text, embedding=None, context_report=None, filters=None):
+        if query_text == "broken":
+            raise Exception("LLM timeout")
+        return f"Answer to {query_text}", [{"text": "chunk", "score": 0.5, "metadata": {}}]
+
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine") as mock_engine, \
+         patch("app.routers.search.aembed_queries", new_callable=AsyncMock) as mock_embed, \
+         patch("app.routers.search.aquery", side_effect=fake_aquery) as mock_query:
+        mock_count.return_value = 42
+        mock_embed.return_value = [[0.1], [0.2], [0.3]]
+
+        response = client.post("/search/batch", json={
+            "queries": ["first", "broken", "third"],
+            "top_k": 5,
+            "response_mode": "compact",
+        })
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["documents_count"] == 42
+        assert [r["query"] for r in data["results"]] == ["first", "broken", "third"]
+        assert data["results"][0]["response"] == "Answer to first"
+        assert data["results"][1]["response"] is None
+        assert "LLM timeout" in data["results"][1]["error"]
+        assert data["results"][2]["error"] is None
+        mock_embed.assert_called_once_with(["first", "broken", "third"])
+        mock_engine.assert_called_once_with(
+            response_mode="compact", top_k=5, retrieval_mode="vector", quality="high")
+        assert mock_query.call_args_list[2].kwargs["embedding"] == [0.3]
+
+
+@pytest.mark.asyncio
+async def test_batch_search_documents_validates_request(client):
+    """
+    Test the /search/batch endpoint rejects empty batches and invalid response modes.
+    """
+    assert client.post("/search/batch", json={"queries": []}).status_code == 422
+
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count:
+        mock_count.return_value = 10
+        response = client.post("/search/batch", json={"queries": ["q"], "response_mode": "invalid_mode"})
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_search_documents_serves_repeated_query_from_cache(client, mock_index_generation):
+    """
+    Test /search answers a repeated query from the cache until the index generation changes.
+    """
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine"), \
+         patch("app.routers.search.aquery", new_callable=AsyncMock) as mock_query:
+        mock_count.return_value = 42
+        mock_query.return_value = ("Cached answer", [])
+
+        first = client.get("/search?query=How+do+I+deploy%3F")
+        second = client.get("/search?query=how+do+i++deploy")
+
+        assert first.json()["response"] == second.json()["response"] == "Cached answer"
+        assert second.json()["query"] == "how do i  deploy"
+        assert mock_query.call_count == 1
+
+        stats = client.get("/search/stats").json()["answer_cache"]
+        assert stats["hits"] == 1
+        assert stats["size"] == 1
+
+        # Re-indexing bumps the generation, so the next request misses
+        mock_index_generation.return_value = 2
+        client.get("/search?query=how+do+i+deploy")
+        assert mock_query.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_search_documents_reuses_answer_for_similar_query(client, mock_embed_query):
+    """
+    Test /search reuses a cached answer when the query embedding is close enough.
+    """
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine"), \
+         patch("app.routers.search.aquery", new_callable=AsyncMock) as mock_query:
+        mock_count.return_value = 42
+        mock_query.return_value = ("Use the Heroku button", [])
+
+        mock_embed_query.return_value = [1.0, 0.0, 0.0]
+        client.get("/search?query=how+do+I+deploy+the+java+app")
+
+        mock_embed_query.return_value = [0.99, 0.05, 0.0]
+        paraphrase = client.get("/search?query=deploying+the+java+reference+app")
+
+        mock_embed_query.return_value = [0.0, 1.0, 0.0]
+        unrelated = client.get("/search?query=data+cloud+webhooks")
+
+        assert paraphrase.json()["response"] == "Use the Heroku button"
+        assert paraphrase.json()["query"] == "deploying the java reference app"
+        assert unrelated.status_code == 200
+        assert mock_query.call_count == 2
+        assert client.get("/search/stats").json()["semantic_answer_cache"]["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_search_documents_coalesces_identical_concurrent_requests(client):
+    """
+    Test concurrent identical /search requests share a single synthesis.
+    """
+    from httpx import ASGITransport, AsyncClient
+
+    async def slow_aquery(engine, query_text, embedding=None, context_report=None, filters=None):
+        await asyncio.sleep(0.05)
+        return "Shared answer", []
+
+    with patch("app.routers.search.corpus_stats.document_count", new_callable=AsyncMock) as mock_count, \
+         patch("app.routers.search.get_query_engine"), \
+         patch("app.routers.search.aquery", side_effect=slow_aquery) as mock_query:
+        mock_count.return_value = 42
+
+        transport = ASGITransport(app=client.app)
+        async with AsyncClient(transport=transport, base_url="http://test") as async_client:
+            responses = await asyncio.gather(*(
+                async_client.get("/search", params={"query": "Same question"}) for _ in range(3)
+            ))
 
+        assert [r.json()["response"] for r in responses] == ["Shared answer"] * 3
+        assert mock_query.call_count == 1
@@ -0,0 +1,80 @@
+from unittest.mock import patch
+
+import numpy as np
+
+from app.cache import EmbeddingCache, LRUCache, SemanticCache, normalize_query
+
+
+def test_normalize_query_ignores_case_whitespace_and_trailing_punctuation():
+    assert normalize_query("  How do I   deploy the Java app? ") == "how do i deploy the java app"
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_cache_expires_entries_after_ttl():
+    cache = LRUCache(max_size=2, ttl_seconds=10)
+    with patch("app.cache.time.monotonic", return_value=100.0):
+        cache.set("a", 1)
+    with patch("app.cache.time.monotonic", return_value=105.0):
+        assert cache.get("a") == 1
+    with patch("app.cache.time.monotonic", return_value=111.0):
+        assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["size"] == 0
+
+
+def test_lru_cache_disabled_when_max_size_is_zero():
+    cache = LRUCache(max_size=0, ttl_seconds=60)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_semantic_cache_matches_within_threshold_and_partition():
+    cache = SemanticCache(max_size=4, threshold=0.9, ttl_seconds=60)
+    cache.set(("compact", 1), [1.0, 0.0], "deploy answer")
+    cache.set(("compact", 1), [0.0, 1.0], "webhook answer")
+
+    assert cache.get(("compact", 1), [0.95, 0.1]) == "deploy answer"
+    assert cache.get(("compact", 1), [0.7, 0.7]) is None
+    assert cache.get(("compact", 2), [1.0, 0.0]) is None
+
+
+def test_semantic_cache_replaces_least_recently_used_when_full():
+    cache = SemanticCache(max_size=2, threshold=0.9, ttl_seconds=60)
+    cache.set("p", [1.0, 0.0, 0.0], "a")
+    cache.set("p", [0.0, 1.0, 0.0], "b")
+    cache.get("p", [1.0, 0.0, 0.0])
+    cache.set("p", [0.0, 0.0, 1.0], "c")
+
+    assert cache.get("p", [1.0, 0.0, 0.0]) == "a"
+    assert cache.get("p", [0.0, 1.0, 0.0]) is None
+    assert cache.get("p", [0.0, 0.0, 1.0]) == "c"
+    assert cache.stats()["size"] == 2
+
+
+def test_embedding_cache_stores_float32_and_reports_saved_latency():
+    cache = EmbeddingCache(max_size=2)
+    cache.set(("model", "q"), [0.1, 0.2, 0.3])
+    cache.record_embed(0.05)
+
+    vector = cache.get(("model", "q"))
+    assert vector.dtype == np.float32
+    stats = cache.stats()
+    assert stats["bytes"] == 12
+    assert stats["avg_embed_latency_ms"] == 50.0
+    assert stats["saved_latency_ms"] == 50.0
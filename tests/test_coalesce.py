@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.coalesce import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_computation():
+    flight = SingleFlight()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    results = await asyncio.gather(*(flight.do("key", compute) for _ in range(5)))
+
+    assert results == ["answer"] * 5
+    assert calls == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 4}
+
+    # The key is released once the computation finishes
+    await flight.do("key", compute)
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_errors_to_all_callers():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("LLM timeout")
+
+    results = await asyncio.gather(
+        flight.do("key", compute), flight.do("key", compute), return_exceptions=True
+    )
+
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_followers_get_result_when_leader_is_cancelled():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        return "answer"
+
+    leader = asyncio.ensure_future(flight.do("key", compute))
+    await asyncio.sleep(0)
+    followers = [asyncio.ensure_future(flight.do("key", compute)) for _ in range(2)]
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await asyncio.gather(*followers) == ["answer", "answer"]
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_shares_across_threads():
+    flight = SingleFlight()
+    calls = 0
+    started = threading.Event()
+
+    def compute():
+        nonlocal calls
+        calls += 1
+        started.set()
+        time.sleep(0.05)
+        return "answer"
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flight.do_sync, "key", compute)
+        started.wait()
+        followers = [pool.submit(flight.do_sync, "key", compute) for _ in range(3)]
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert results == ["answer"] * 4
+    assert calls == 1
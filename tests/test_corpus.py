@@ -0,0 +1,53 @@
+import asyncio
+from unittest.mock import patch
+
+from app.corpus import CorpusStats
+
+
+def test_document_count_reads_database_once():
+    corpus = CorpusStats()
+    with patch("app.corpus.get_corpus_stats", return_value=((42, {"demo": 42}), "Success")) as mock_stats:
+        assert asyncio.run(corpus.document_count()) == 42
+        assert asyncio.run(corpus.document_count()) == 42
+
+    mock_stats.assert_called_once()
+    assert corpus.stats()["documents_by_repo"] == {"demo": 42}
+
+
+def test_invalidate_refreshes_in_background():
+    corpus = CorpusStats()
+    with patch("app.corpus.get_corpus_stats", return_value=((42, {}), "Success")):
+        asyncio.run(corpus.document_count())
+
+    with patch("app.corpus.get_corpus_stats", return_value=((40, {}), "Success")), \
+         patch("app.corpus.threading.Thread") as mock_thread:
+        corpus.invalidate()
+
+        # The stale count is served while the refresh runs
+        assert asyncio.run(corpus.document_count()) == 42
+        mock_thread.assert_called_once()
+        mock_thread.call_args.kwargs["target"]()
+
+        assert asyncio.run(corpus.document_count()) == 40
+
+
+def test_failed_first_read_returns_none_and_retries():
+    corpus = CorpusStats()
+    with patch("app.corpus.get_corpus_stats", return_value=(None, "Error")) as mock_stats:
+        assert asyncio.run(corpus.document_count()) is None
+        assert asyncio.run(corpus.document_count()) is None
+
+    assert mock_stats.call_count == 2
+    assert corpus.stats()["errors"] == 2
+
+
+def test_empty_count_is_reread_before_it_is_returned():
+    corpus = CorpusStats()
+    with patch("app.corpus.get_corpus_stats", return_value=((0, {}), "Success")):
+        assert asyncio.run(corpus.document_count()) == 0
+
+    # Documents indexed since the last read are counted without waiting for a refresh
+    with patch("app.corpus.get_corpus_stats", return_value=((12, {"demo": 12}), "Success")):
+        assert asyncio.run(corpus.document_count()) == 12
+
+    assert corpus.stats()["refreshes"] == 2
@@ -0,0 +1,82 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app import db
+
+
+@pytest.fixture(autouse=True)
+def reset_engines():
+    db._engines["sync"] = db._engines["async"] = None
+    yield
+    db._engines["sync"] = db._engines["async"] = None
+
+
+def test_get_db_engine_creates_one_pooled_engine():
+    with patch("app.db.create_engine", return_value=MagicMock()) as create_engine, \
+         patch("app.db.event") as mock_event:
+        first = db.get_db_engine()
+        second = db.get_db_engine()
+
+    assert first is second
+    create_engine.assert_called_once()
+    kwargs = create_engine.call_args.kwargs
+    assert kwargs["pool_size"] == db.settings.db_pool_size
+    assert kwargs["max_overflow"] == db.settings.db_max_overflow
+    assert kwargs["pool_pre_ping"] == db.settings.db_pool_pre_ping
+    mock_event.listen.assert_called_once_with(first, "connect", db._configure_connection)
+
+
+def test_dispose_db_engines_closes_pools_and_resets():
+    engine = MagicMock()
+    with patch("app.db.create_engine", return_value=engine), patch("app.db.event"):
+        db.get_db_engine()
+        asyncio.run(db.dispose_db_engines())
+
+    engine.dispose.assert_called_once()
+    assert db._engines["sync"] is None
+
+
+def test_configure_connection_enables_iterative_scan():
+    connection = MagicMock()
+    with patch.object(db.settings, "db_hnsw_iterative_scan", "relaxed_order"):
+        db._configure_connection(connection, None)
+
+    connection.cursor.return_value.execute.assert_called_once_with("SET hnsw.iterative_scan = relaxed_order")
+    connection.commit.assert_called_once()
+
+
+def test_configure_connection_tolerates_old_pgvector():
+    connection = MagicMock()
+    connection.cursor.return_value.execute.side_effect = Exception("unrecognized configuration parameter")
+    with patch.object(db.settings, "db_hnsw_iterative_scan", "relaxed_order"):
+        db._configure_connection(connection, None)
+
+    connection.rollback.assert_called_once()
+
+
+def test_ensure_metadata_indexes_creates_one_expression_index_per_key_and_shared_repos():
+    engine = MagicMock()
+    connection = engine.connect.return_value.__enter__.return_value
+    connection.execute.return_value.scalar.return_value = True
+    with patch("app.db.get_db_engine", return_value=engine):
+        success, _ = db.ensure_metadata_indexes()
+
+    statements = [str(call.args[0]) for call in connection.execute.call_args_list[1:]]
+    assert success
+    assert len(statements) == len(db.METADATA_FILTER_KEYS) + 1
+    assert "((metadata_->>'repo_name'))" in statements[0]
+    assert "USING gin ((metadata_::jsonb->'repo_names'))" in statements[-1]
+    connection.commit.assert_called_once()
+
+
+def test_shared_repo_rows_lists_rows_shared_with_other_repositories():
+    metadata = [
+        {"repo_name": "a", "repo_names": ["a", "b", "c"]},
+        {"repo_name": "b"},
+        {"repo_name": "b", "repo_names": ["b", "c"]},
+        None,
+    ]
+
+    assert db.shared_repo_rows(metadata) == {"b": [0], "c": [0, 2]}
@@ -0,0 +1,43 @@
+import numpy as np
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from app.diversify import collapse_adjacent_chunks, mmr_select, strip_overlap
+
+
+def _chunk(text, chunk_index, score, repo_name="demo"):
+    node = TextNode(
+        text=text,
+        metadata={"repo_name": repo_name, "file_path": f"{repo_name}_README.md", "chunk_index": chunk_index},
+    )
+    return NodeWithScore(node=node, score=score)
+
+
+def test_strip_overlap_removes_repeated_prefix():
+    assert strip_overlap("deploy with git push heroku main", "heroku main then open") == " then open"
+    assert strip_overlap("abc", "xyz") == "xyz"
+
+
+def test_collapse_adjacent_chunks_merges_neighbours_of_same_document():
+    nodes = [
+        _chunk("second part. third", 1, 0.9),
+        _chunk("other repo", 0, 0.8, repo_name="other"),
+        _chunk("first part. second part.", 0, 0.7),
+        _chunk("far away", 5, 0.6),
+    ]
+
+    collapsed = collapse_adjacent_chunks(nodes)
+
+    assert [positions for _, positions in collapsed] == [[2, 0], [1], [3]]
+    merged = collapsed[0][0]
+    assert merged.node.get_content() == "first part. second part. third"
+    assert merged.score == 0.9
+    assert merged.node.metadata["merged_chunk_indexes"] == [0, 1]
+
+
+def test_mmr_select_skips_near_duplicates():
+    query = [1.0, 0.0]
+    embeddings = [[1.0, 0.0], [0.99, 0.01], [0.7, 0.7]]
+
+    assert mmr_select(query, embeddings, top_k=2, lambda_mult=1.0) == [0, 1]
+    assert mmr_select(query, embeddings, top_k=2, lambda_mult=0.3) == [0, 2]
+    assert mmr_select(query, np.empty((0, 2)), top_k=2) == []
@@ -0,0 +1,49 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from app.embedding_cache import DiskEmbeddingCache
+from app.embeddings import get_embeddings_cached
+
+
+def as_lists(embeddings):
+    return [None if embedding is None else embedding.tolist() for embedding in embeddings]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DiskEmbeddingCache(tmp_path / "embeddings.sqlite3", max_entries=2)
+    yield cache
+    cache.close()
+
+
+def test_cache_round_trips_by_model_and_content(cache):
+    cache.set_many("model-a", ["hello"], [[0.5, 0.25]])
+
+    assert as_lists(cache.get_many("model-a", ["hello", "other"])) == [[0.5, 0.25], None]
+    assert cache.get_many("model-b", ["hello"]) == [None]
+    assert cache.stats()["hits"] == 1
+
+
+def test_cache_evicts_least_recently_used(cache):
+    with patch("app.embedding_cache.time.time", side_effect=[1.0, 2.0, 3.0, 4.0]):
+        cache.set_many("m", ["a"], [[1.0]])
+        cache.set_many("m", ["b"], [[2.0]])
+        cache.get_many("m", ["a"])
+        cache.set_many("m", ["c"], [[3.0]])
+
+    assert as_lists(cache.get_many("m", ["a", "b", "c"])) == [[1.0], None, [3.0]]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_get_embeddings_cached_only_embeds_misses(cache):
+    cache.set_many("model", ["known"], [[1.0]])
+
+    with patch("app.embeddings.settings.embedding_model_id", "model"), \
+         patch("app.embeddings.get_embeddings_direct", return_value=[np.array([2.0], dtype=np.float32)]) as mock_direct:
+        first = get_embeddings_cached(["known", "new"], cache=cache)
+        second = get_embeddings_cached(["known", "new"], cache=cache)
+
+    assert as_lists(first) == as_lists(second) == [[1.0], [2.0]]
+    mock_direct.assert_called_once_with(["new"])
@@ -0,0 +1,250 @@
+import base64
+import random
+import time
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+import requests
+
+from app.embeddings import (
+    chunk_text_by_tokens,
+    chunk_text_simple,
+    create_deduplicated_text_nodes,
+    create_text_nodes_with_embeddings,
+    embedding_rate_limiter,
+    get_embeddings_direct,
+    iter_chunks,
+    iter_chunks_simple,
+)
+from app.settings import settings
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    monkeypatch.setattr(embedding_rate_limiter, "rate", 0)
+
+
+def as_lists(embeddings):
+    return [None if embedding is None else embedding.tolist() for embedding in embeddings]
+
+
+def api_response(texts, status=200):
+    response = MagicMock(status_code=status)
+    if status >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    response.json.return_value = {
+        "data": [{"index": i, "embedding": [float(len(text))]} for i, text in enumerate(texts)]
+    }
+    return response
+
+
+def test_get_embeddings_direct_sends_batches():
+    texts = [f"text {i}" for i in range(5)]
+    with patch("app.embeddings.requests.post") as mock_post:
+        mock_post.side_effect = lambda url, headers, json: api_response(json["input"])
+        embeddings = get_embeddings_direct(texts, batch_size=2)
+
+    # Batches run concurrently, so requests may be sent in any order
+    assert sorted(len(call.kwargs["json"]["input"]) for call in mock_post.call_args_list) == [1, 2, 2]
+    assert as_lists(embeddings) == [[float(len(text))] for text in texts]
+
+
+def test_get_embeddings_direct_bisects_around_a_bad_input():
+    texts = ["a", "b", "bad", "c"]
+
+    def post(url, headers, json):
+        return api_response(json["input"], status=400 if "bad" in json["input"] else 200)
+
+    with patch("app.embeddings.requests.post", side_effect=post) as mock_post:
+        embeddings = get_embeddings_direct(texts, batch_size=4)
+
+    assert as_lists(embeddings) == [[1.0], [1.0], None, [1.0]]
+    # [a b bad c] -> [a b] ok, [bad c] -> [bad] rejected, [c] ok
+    assert mock_post.call_count == 5
+
+
+def test_get_embeddings_direct_does_not_split_on_rate_limit():
+    with patch("app.embeddings.requests.post", return_value=api_response(["a", "b"], status=429)) as mock_post:
+        with pytest.raises(requests.HTTPError):
+            get_embeddings_direct(["a", "b"], batch_size=2)
+
+    mock_post.assert_called_once()
+
+
+def test_get_embeddings_direct_fails_fast_on_auth_errors():
+    with patch("app.embeddings.requests.post", return_value=api_response(["a", "b", "c", "d"], status=401)) as mock_post:
+        with pytest.raises(requests.HTTPError):
+            get_embeddings_direct(["a", "b", "c", "d"], batch_size=4)
+
+    mock_post.assert_called_once()
+
+
+def test_get_embeddings_direct_keeps_input_order_with_concurrent_batches():
+    texts = ["x" * (i + 1) for i in range(8)]
+
+    def post(url, headers, json):
+        # Later batches answer first
+        time.sleep(0.005 * (8 - len(json["input"][0])))
+        return api_response(json["input"])
+
+    with patch("app.embeddings.requests.post", side_effect=post):
+        embeddings = get_embeddings_direct(texts, batch_size=1)
+
+    assert as_lists(embeddings) == [[float(len(text))] for text in texts]
+
+
+def test_get_embeddings_direct_decodes_base64_float32():
+    vectors = np.array([[0.5, -1.25, 3.0], [1.0, 2.0, 4.5]], dtype="<f4")
+
+    def post(url, headers, json):
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"data": [
+            {"index": i, "embedding": base64.b64encode(vector.tobytes()).decode()}
+            for i, vector in enumerate(vectors)
+        ]}
+        return response
+
+    with patch("app.embeddings.requests.post", side_effect=post) as mock_post, \
+         patch("app.embeddings.settings.rag_embed_encoding_format", "base64"):
+        embeddings = get_embeddings_direct(["a", "b"], batch_size=2)
+
+    assert mock_post.call_args.kwargs["json"]["encoding_format"] == "base64"
+    assert all(embedding.dtype == np.float32 for embedding in embeddings)
+    np.testing.assert_array_equal(np.stack(embeddings), vectors)
+    # Rows of one batch share one buffer
+    assert embeddings[0].base is embeddings[1].base
+
+
+def reference_chunk_text(text, max_bytes=1024, overlap_bytes=100):
+    """The original chunk_text_simple(), which retried decoding byte by byte"""
+    chunks = []
+    text_bytes = text.encode('utf-8')
+    start = 0
+    while start < len(text_bytes):
+        end = start + max_bytes
+        try:
+            chunk = text_bytes[start:end].decode('utf-8')
+        except UnicodeDecodeError:
+            while end > start:
+                end -= 1
+                try:
+                    chunk = text_bytes[start:end].decode('utf-8')
+                    break
+                except UnicodeDecodeError:
+                    continue
+            else:
+                start = end + 1
+                continue
+        chunks.append(chunk)
+        start = end - overlap_bytes
+    return chunks
+
+
+@pytest.mark.parametrize("max_bytes,overlap_bytes", [(1024, 100), (256, 32), (64, 10), (5, 0)])
+def test_chunk_text_simple_matches_reference(max_bytes, overlap_bytes):
+    rng = random.Random(max_bytes)
+    # 1, 2, 3 and 4 byte characters
+    alphabet = "abc \n" + "éßж" + "中文字" + "😀🚀"
+    texts = ["", "a", "中", "x" * 3000] + [
+        "".join(rng.choice(alphabet) for _ in range(rng.randrange(1, 2000))) for _ in range(30)
+    ]
+    for text in texts:
+        expected = [chunk for chunk in reference_chunk_text(text, max_bytes, overlap_bytes) if chunk]
+        assert chunk_text_simple(text, max_bytes, overlap_bytes) == expected
+
+
+@pytest.mark.parametrize("max_bytes,overlap_bytes", [(20, 10), (16, 5), (7, 3), (4, 3)])
+def test_chunk_text_simple_terminates_when_the_overlap_revisits_a_start(max_bytes, overlap_bytes):
+    # reference_chunk_text() loops forever on these
+    text = "abc中" * 300
+    chunks = chunk_text_simple(text, max_bytes, overlap_bytes)
+    assert chunks and all(chunks)
+    assert all(len(chunk.encode("utf-8")) <= max_bytes for chunk in chunks)
+    assert all(chunk in text for chunk in chunks)
+    assert any(text.endswith(chunk) for chunk in chunks)
+
+
+def test_iter_chunks_simple_is_lazy():
+    chunks = iter_chunks_simple("a" * 10_000, max_bytes=100, overlap_bytes=10)
+    assert next(chunks) == "a" * 100
+    assert next(chunks) == "a" * 100
+
+
+def test_iter_chunks_simple_rejects_overlap_not_below_max_bytes():
+    with pytest.raises(ValueError):
+        next(iter_chunks_simple("abc", max_bytes=10, overlap_bytes=10))
+
+
+def test_create_text_nodes_embeds_chunks_in_windows(monkeypatch):
+    monkeypatch.setattr(settings, "rag_embed_batch_size", 2)
+    monkeypatch.setattr(settings, "rag_embed_max_concurrency", 1)
+    windows = []
+
+    def embed(texts):
+        windows.append(len(texts))
+        return [None if text.startswith("c") else np.ones(1, dtype=np.float32) for text in texts]
+
+    with patch("app.embeddings.get_embeddings_cached", side_effect=embed):
+        nodes = create_text_nodes_with_embeddings("aaaabbbbccccdddde", {"repo_name": "demo"}, max_bytes=4, overlap_bytes=0)
+
+    assert windows == [2, 2, 1]
+    assert [node.text for node in nodes] == ["aaaa", "bbbb", "dddd", "e"]
+    assert [node.metadata["chunk_index"] for node in nodes] == [0, 1, 3, 4]
+    assert all(node.metadata["total_chunks"] == 5 for node in nodes)
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_chunk_text_by_tokens_packs_chunks_with_overlap():
+    words = [f"w{i}" for i in range(25)]
+    chunks = chunk_text_by_tokens(" ".join(words), max_tokens=10, overlap_tokens=3, count_tokens=count_words)
+
+    assert [count_words(chunk) for chunk in chunks] == [10, 10, 10, 4]
+    assert chunks[0] == " ".join(words[:10])
+    # Each chunk repeats the last 3 words of the previous one
+    assert chunks[1] == " " + " ".join(words[7:17])
+    assert chunks[-1].split() == words[21:]
+
+
+def test_chunk_text_by_tokens_splits_overlong_words():
+    def count_characters(text):
+        return len(text)
+
+    chunks = chunk_text_by_tokens("x" * 25, max_tokens=10, overlap_tokens=0, count_tokens=count_characters)
+
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert "".join(chunks) == "x" * 25
+
+
+def test_iter_chunks_rejects_unknown_chunker():
+    with pytest.raises(ValueError):
+        iter_chunks("text", chunker="sentences")
+
+
+def test_create_deduplicated_text_nodes_embeds_shared_chunks_once():
+    documents = [
+        ("Java app: Deploy  it", {"repo_name": "java"}),
+        ("Node app: Deploy\nit ", {"repo_name": "node"}),
+        ("Python app", {"repo_name": "python"}),
+    ]
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return [np.array([len(text)], dtype=np.float32) for text in texts]
+
+    with patch("app.embeddings.get_embeddings_cached", side_effect=embed):
+        nodes, stats = create_deduplicated_text_nodes(documents, max_bytes=10, overlap_bytes=0)
+        nodes = list(nodes)
+
+    # The second chunks differ only in whitespace
+    assert embedded == ["Java app: ", "Deploy  it", "Node app: ", "Python app"]
+    assert stats == {"chunks": 5, "distinct_chunks": 4, "shared_chunks": 1, "repositories": 3}
+    shared = nodes[1]
+    assert shared.metadata["repo_name"] == "java"
+    assert shared.metadata["repo_names"] == ["java", "node"]
+    assert nodes[2].metadata["repo_names"] == ["node"]
+    assert shared.embedding == [10.0]
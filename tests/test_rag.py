@@ -0,0 +1,282 @@
+import pytest
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from llama_index.core.llms import LLMMetadata
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.cache import EmbeddingCache
+from app.rag import (
+    CachedEmbedding,
+    QueryEngineRegistry,
+    aquery,
+    aretrieve,
+    build_metadata_filters,
+    estimate_llm_calls,
+    metadata_filter_conditions,
+    pack_context,
+    reciprocal_rank_fusion,
+    resolve_ef_search,
+    synthesis_call_tokens,
+)
+
+
+def test_registry_reuses_engine_for_same_parameters():
+    """
+    Test the registry builds each (response_mode, top_k) engine once and shares the index.
+    """
+    with patch("app.rag.create_llm") as mock_llm, \
+         patch("app.rag.create_embedding_model"), \
+         patch("app.rag.create_index") as mock_index, \
+         patch("app.rag.create_query_engine") as mock_create:
+        mock_create.side_effect = lambda **kwargs: MagicMock()
+        registry = QueryEngineRegistry()
+
+        first = registry.get(response_mode="compact", top_k=5)
+        second = registry.get(response_mode="compact", top_k=5)
+        other = registry.get(response_mode="compact", top_k=6)
+
+        assert first is second
+        assert other is not first
+        assert mock_create.call_count == 2
+        mock_llm.assert_called_once()
+        mock_index.assert_called_once()
+
+
+def test_registry_refresh_rebuilds_components():
+    """
+    Test refresh() drops cached engines so the next lookup rebuilds them.
+    """
+    with patch("app.rag.create_llm"), \
+         patch("app.rag.create_embedding_model"), \
+         patch("app.rag.create_index") as mock_index, \
+         patch("app.rag.create_query_engine") as mock_create:
+        mock_create.side_effect = lambda **kwargs: MagicMock()
+        registry = QueryEngineRegistry()
+
+        first = registry.get()
+        registry.refresh()
+        second = registry.get()
+
+        assert first is not second
+        assert mock_index.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_aquery_passes_precomputed_embedding():
+    """
+    Test aquery() hands the precomputed embedding to the engine and formats sources.
+    """
+    node = MagicMock(text="x" * 250, score=0.5, metadata={"repo_name": "demo"})
+    response = MagicMock(source_nodes=[node])
+    response.__str__.return_value = "answer"
+    engine = MagicMock()
+    engine.aquery = AsyncMock(return_value=response)
+
+    answer, sources = await aquery(engine, "question", embedding=[0.1, 0.2])
+
+    query_bundle = engine.aquery.call_args.args[0]
+    assert query_bundle.query_str == "question"
+    assert query_bundle.embedding == [0.1, 0.2]
+    assert answer == "answer"
+    assert sources == [{"text": "x" * 200 + "...", "score": 0.5, "metadata": {"repo_name": "demo"}}]
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_serves_repeated_queries_from_cache():
+    """
+    Test CachedEmbedding only calls the wrapped model for texts it has not seen.
+    """
+    inner = MagicMock(model_name="cohere-embed-multilingual", embed_batch_size=96)
+    inner.aget_query_embedding = AsyncMock(return_value=[0.5, 0.25])
+    inner.aget_text_embedding_batch = AsyncMock(return_value=[[1.0, 0.0]])
+    cache = EmbeddingCache(max_size=10)
+    embed_model = CachedEmbedding(inner, cache)
+
+    first = await embed_model.aget_query_embedding("How do I deploy?")
+    second = await embed_model.aget_query_embedding("how do i deploy")
+    batch = await embed_model.aget_text_embedding_batch(["HOW DO I DEPLOY", "webhooks"])
+
+    assert first == second == [0.5, 0.25]
+    assert batch == [[0.5, 0.25], [1.0, 0.0]]
+    inner.aget_query_embedding.assert_called_once_with("How do I deploy?")
+    inner.aget_text_embedding_batch.assert_called_once_with(["webhooks"])
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["size"] == 2
+    assert stats["bytes"] == 2 * 2 * 4
+
+
+def test_reciprocal_rank_fusion_favours_nodes_found_by_both_retrievers():
+    """
+    Test RRF ranks a node found by both retrievers above nodes found by only one.
+    """
+    a, b, c = (TextNode(id_=node_id, text=node_id) for node_id in "abc")
+    vector_results = [NodeWithScore(node=a, score=0.9), NodeWithScore(node=b, score=0.8)]
+    text_results = [NodeWithScore(node=c, score=0.5), NodeWithScore(node=b, score=0.4)]
+
+    fused = reciprocal_rank_fusion([vector_results, text_results], top_k=2, k=60)
+
+    assert [n.node.node_id for n in fused] == ["b", "a"]
+    assert fused[0].score == pytest.approx(2 / 62)
+
+
+@pytest.mark.asyncio
+async def test_diversifying_retriever_collapses_neighbours_and_applies_mmr():
+    """
+    Test DiversifyingRetriever merges neighbouring chunks and drops near-duplicates.
+    """
+    from app.rag import DiversifyingRetriever
+
+    def chunk(node_id, chunk_index, repo_name, score):
+        node = TextNode(id_=node_id, text=node_id, metadata={"repo_name": repo_name, "chunk_index": chunk_index})
+        return NodeWithScore(node=node, score=score)
+
+    candidates = [
+        chunk("a0", 0, "a", 0.9), chunk("a1", 1, "a", 0.85),
+        chunk("b0", 0, "b", 0.8), chunk("c0", 0, "c", 0.7),
+    ]
+    inner = MagicMock()
+    inner.aretrieve = AsyncMock(return_value=candidates)
+    embeddings = {"a0": [1.0, 0.0], "a1": [1.0, 0.0], "b0": [0.99, 0.01], "c0": [0.6, 0.8]}
+    vector_store = MagicMock()
+    vector_store.aget_nodes = AsyncMock(return_value=[
+        TextNode(id_=node_id, text=node_id, embedding=embedding) for node_id, embedding in embeddings.items()
+    ])
+
+    retriever = DiversifyingRetriever(inner, vector_store, top_k=2, lambda_mult=0.3)
+    results = await retriever.aretrieve(QueryBundle("question", embedding=[1.0, 0.0]))
+
+    assert [n.node.node_id for n in results] == ["a0", "c0"]
+    assert results[0].node.metadata["merged_chunk_indexes"] == [0, 1]
+
+
+def test_pack_context_keeps_best_chunks_within_budget_and_merges_neighbours():
+    """
+    Test pack_context() picks chunks by score up to the budget and merges neighbours.
+    """
+    def chunk(text, chunk_index, score):
+        node = TextNode(text=text, metadata={"repo_name": "demo", "chunk_index": chunk_index})
+        return NodeWithScore(node=node, score=score)
+
+    nodes = [
+        chunk("aaaa bbbb", 0, 0.9),
+        chunk("cccc dddd eeee ffff", 3, 0.8),
+        chunk("bbbb gggg", 1, 0.7),
+    ]
+
+    packed, report = pack_context(
+        nodes, token_budget=5, count_tokens=lambda text: len(text.split()), call_tokens=5)
+
+    assert [n.node.get_content() for n in packed] == ["aaaa bbbb gggg"]
+    assert report["retrieved_tokens"] == 8
+    assert report["packed_tokens"] == 3
+    assert report["tokens_saved"] == 5
+    assert report["llm_calls_avoided"] == 2
+
+
+def test_pack_context_estimates_calls_from_the_llm_window_not_the_budget():
+    """
+    Test a budget larger than one LLM call still counts the calls its context needs.
+    """
+    nodes = [
+        NodeWithScore(node=TextNode(text="word " * 600, metadata={"repo_name": "demo", "chunk_index": i * 10}),
+                      score=1.0 - i / 10)
+        for i in range(3)
+    ]
+
+    _, report = pack_context(
+        nodes, token_budget=5000, count_tokens=lambda text: len(text.split()), call_tokens=1000)
+
+    # Nothing is dropped, so nothing is saved, but 1800 tokens span two calls plus the summary
+    assert report["packed_tokens"] == 1800
+    assert report["estimated_llm_calls"] == 3
+    assert report["llm_calls_avoided"] == 0
+
+
+def test_synthesis_call_tokens_leaves_room_for_prompt_and_output():
+    llm = MagicMock()
+    llm.metadata = LLMMetadata(context_window=4096, num_output=256)
+
+    call_tokens = synthesis_call_tokens(llm, "tree_summarize")
+
+    assert 0 < call_tokens < 4096 - 256
+
+
+def test_estimate_llm_calls_by_response_mode():
+    assert estimate_llm_calls([600, 600, 600], 1000, "compact") == 2
+    assert estimate_llm_calls([600, 600, 600], 1000, "tree_summarize") == 3
+    assert estimate_llm_calls([600, 600, 600], 1000, "refine") == 3
+    assert estimate_llm_calls([600, 600, 600], 1000, "simple_summarize") == 1
+
+
+def test_resolve_ef_search_applies_quality_and_bounds():
+    with patch("app.rag.settings") as mock_settings:
+        mock_settings.rag_ef_search_fast = 20
+        mock_settings.rag_ef_search_balanced = 40
+        mock_settings.rag_ef_search_high = 200
+        mock_settings.rag_ef_search_max = 100
+
+        assert resolve_ef_search("fast", limit=10) == 20
+        assert resolve_ef_search("fast", limit=40) == 40
+        assert resolve_ef_search("high", limit=10) == 100
+        with pytest.raises(ValueError):
+            resolve_ef_search("exhaustive", limit=10)
+
+
+def test_build_metadata_filters_validates_keys_and_values():
+    filters = build_metadata_filters({"repo_name": "heroku-applink-java", "source": None})
+
+    assert metadata_filter_conditions(filters) == {"repo_name": "heroku-applink-java"}
+    # repo_name also matches chunks shared with the repository
+    (group,) = filters.filters
+    assert group.condition == "or"
+    assert [(f.key, f.operator, f.value) for f in group.filters] == [
+        ("repo_name", "==", "heroku-applink-java"), ("repo_names", "contains", "heroku-applink-java")]
+    assert build_metadata_filters({"repo_name": None}) is None
+    for bad in ({"repo_name": "x' OR '1'='1"}, {"repo_name": "1e5"}, {"file_path": "README.md"}):
+        with pytest.raises(ValueError):
+            build_metadata_filters(bad)
+
+
+@pytest.mark.asyncio
+async def test_metadata_filtered_retriever_applies_filters_of_current_query():
+    """
+    Test filters passed to aretrieve() reach the index retriever of that query only.
+    """
+    from app.rag import MetadataFilteredRetriever
+
+    index = MagicMock()
+    index.as_retriever.side_effect = lambda **kwargs: MagicMock(aretrieve=AsyncMock(return_value=[]))
+    retriever = MetadataFilteredRetriever(index, similarity_top_k=5)
+    filters = build_metadata_filters({"repo_name": "demo"})
+
+    await aretrieve(retriever, "question", embedding=[0.1], filters=filters)
+    await aretrieve(retriever, "question", embedding=[0.1])
+
+    assert index.as_retriever.call_args_list[0].kwargs == {"similarity_top_k": 5}
+    assert index.as_retriever.call_args_list[1].kwargs == {"similarity_top_k": 5, "filters": filters}
+    assert index.as_retriever.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_local_vector_retriever_uses_replica_with_filters_and_falls_back():
+    """
+    Test LocalVectorRetriever answers from the replica and uses pgvector until it is loaded.
+    """
+    from app.rag import LocalVectorRetriever
+
+    hit = NodeWithScore(node=TextNode(id_="a", text="a"), score=0.9)
+    replica = MagicMock()
+    replica.search.return_value = [hit]
+    fallback = MagicMock()
+    fallback.aretrieve = AsyncMock(return_value=[])
+    retriever = LocalVectorRetriever(5, fallback=fallback, replica=replica)
+
+    results = await aretrieve(
+        retriever, "question", embedding=[0.1], filters=build_metadata_filters({"repo_name": "demo"}))
+    replica.search.return_value = None
+    await aretrieve(retriever, "question", embedding=[0.1])
+
+    assert [r["text"] for r in results] == ["a"]
+    replica.search.assert_any_call([0.1], 5, filters={"repo_name": "demo"})
+    fallback.aretrieve.assert_called_once()
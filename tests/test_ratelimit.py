@@ -0,0 +1,24 @@
+from unittest.mock import patch
+
+from app.ratelimit import TokenBucket
+
+
+def test_token_bucket_allows_burst_then_spaces_requests():
+    bucket = TokenBucket(rate=10, capacity=2)
+    with patch("app.ratelimit.time.monotonic", return_value=100.0), \
+         patch("app.ratelimit.time.sleep") as mock_sleep:
+        bucket._updated_at = 100.0
+        for _ in range(4):
+            bucket.acquire()
+
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [0.1, 0.2]
+    assert bucket.stats()["acquired"] == 4
+
+
+def test_token_bucket_with_zero_rate_never_waits():
+    bucket = TokenBucket(rate=0)
+    with patch("app.ratelimit.time.sleep") as mock_sleep:
+        for _ in range(10):
+            bucket.acquire()
+
+    mock_sleep.assert_not_called()
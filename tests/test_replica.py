@@ -0,0 +1,72 @@
+from unittest.mock import patch
+
+import pytest
+
+from app.replica import VectorReplica
+
+
+def row(row_id, node_id, repo_name, embedding):
+    return (row_id, node_id, f"text {node_id}", {"repo_name": repo_name}, embedding)
+
+
+def sync(replica, generation, current_ids, rows):
+    with patch("app.replica.get_index_generation", return_value=(generation, "Success")), \
+         patch("app.replica.get_document_rows", return_value=((current_ids, rows), "Success")) as mock_rows:
+        assert replica.refresh()
+    return mock_rows
+
+
+def test_search_returns_exact_top_k_by_cosine_similarity():
+    replica = VectorReplica()
+    sync(replica, 1, [1, 2, 3], [
+        row(1, "a", "java", [1.0, 0.0]),
+        row(2, "b", "java", [0.6, 0.8]),
+        row(3, "c", "node", [0.0, 2.0]),
+    ])
+
+    with patch.object(replica, "_maybe_start_refresh"):
+        results = replica.search([0.0, 1.0], top_k=2)
+        filtered = replica.search([0.0, 1.0], top_k=5, filters={"repo_name": "java"})
+
+    assert [n.node.node_id for n in results] == ["c", "b"]
+    assert results[0].score == pytest.approx(1.0)
+    assert [n.node.node_id for n in filtered] == ["b", "a"]
+
+
+def test_repo_name_filter_matches_chunks_shared_with_the_repository():
+    replica = VectorReplica()
+    shared = (3, "c", "license", {"repo_name": "java", "repo_names": ["java", "node"]}, [0.0, 1.0])
+    sync(replica, 1, [1, 2, 3], [row(1, "a", "java", [1.0, 0.0]), row(2, "b", "node", [1.0, 1.0]), shared])
+
+    with patch.object(replica, "_maybe_start_refresh"):
+        node = replica.search([0.0, 1.0], top_k=5, filters={"repo_name": "node"})
+        java = replica.search([0.0, 1.0], top_k=5, filters={"repo_name": "java"})
+
+    assert [n.node.node_id for n in node] == ["c", "b"]
+    assert [n.node.node_id for n in java] == ["c", "a"]
+
+
+def test_refresh_fetches_only_changed_rows():
+    replica = VectorReplica()
+    sync(replica, 1, [1, 2], [row(1, "a", "java", [1.0, 0.0]), row(2, "b", "java", [0.0, 1.0])])
+
+    # Row 1 deleted and row 3 added in generation 2
+    mock_rows = sync(replica, 2, [2, 3], [row(3, "c", "node", [1.0, 1.0])])
+
+    mock_rows.assert_called_once_with([1, 2])
+    assert [n.node_id for n in replica.get_nodes(["a", "b", "c"])] == ["b", "c"]
+    stats = replica.stats()
+    assert stats["chunks"] == 2
+    assert (stats["rows_added"], stats["rows_removed"]) == (3, 1)
+
+    # An unchanged generation does not read the documents table
+    with patch("app.replica.get_index_generation", return_value=(2, "Success")), \
+         patch("app.replica.get_document_rows") as mock_unchanged:
+        assert replica.refresh()
+    mock_unchanged.assert_not_called()
+
+
+def test_search_before_load_returns_none():
+    replica = VectorReplica()
+    with patch.object(replica, "_maybe_start_refresh"):
+        assert replica.search([1.0, 0.0], top_k=3) is None
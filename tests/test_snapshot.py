@@ -0,0 +1,94 @@
+from unittest.mock import patch
+
+import numpy as np
+
+from app.replica import VectorReplica
+from app.snapshot import MappedSnapshot, SNAPSHOT_VERSIONS_KEPT, read_current_version, write_snapshot
+
+ROWS = [
+    (1, "a", "héllo", {"repo_name": "java", "org": "heroku-reference-apps"}, [3.0, 4.0]),
+    (2, "b", "world", {"repo_name": "node"}, [0.0, 1.0]),
+]
+
+
+def write(directory, generation=1, rows=ROWS):
+    with patch("app.snapshot.get_index_generation", return_value=(generation, "Success")), \
+         patch("app.snapshot.get_document_rows", return_value=(([r[0] for r in rows], rows), "Success")):
+        version, message = write_snapshot(directory)
+    assert version, message
+    return version
+
+
+def test_write_snapshot_round_trips_through_mmap(tmp_path):
+    version = write(tmp_path)
+
+    snapshot = MappedSnapshot(tmp_path / read_current_version(tmp_path))
+
+    assert snapshot.version == version
+    assert isinstance(snapshot.matrix, np.memmap)
+    np.testing.assert_allclose(snapshot.matrix[0], [0.6, 0.8], rtol=1e-6)
+    assert snapshot.texts[0] == "héllo"
+    assert snapshot.metadata[1] == {"repo_name": "node"}
+    assert list(snapshot.columns["repo_name"]) == ["java", "node"]
+    assert list(snapshot.columns["org"]) == ["heroku-reference-apps", None]
+    assert snapshot.shared_rows == {}
+
+
+def test_snapshot_keeps_rows_shared_with_other_repositories(tmp_path):
+    rows = ROWS + [(3, "c", "license", {"repo_name": "java", "repo_names": ["java", "node"]}, [1.0, 0.0])]
+    write(tmp_path, rows=rows)
+
+    snapshot = MappedSnapshot(tmp_path / read_current_version(tmp_path))
+
+    assert {repo: list(r) for repo, r in snapshot.shared_rows.items()} == {"node": [2]}
+
+
+def test_write_snapshot_publishes_new_version_and_prunes_old_ones(tmp_path):
+    versions = [write(tmp_path, generation=g) for g in range(1, SNAPSHOT_VERSIONS_KEPT + 2)]
+
+    assert read_current_version(tmp_path) == versions[-1]
+    kept = sorted(p.name for p in tmp_path.iterdir() if p.is_dir())
+    assert kept == versions[-SNAPSHOT_VERSIONS_KEPT:]
+
+
+def test_replica_maps_snapshot_and_swaps_to_new_version(tmp_path):
+    write(tmp_path, generation=1)
+    replica = VectorReplica()
+
+    with patch("app.replica.settings.rag_snapshot_dir", str(tmp_path)), \
+         patch("app.replica.get_index_generation", return_value=(1, "Success")) as mock_generation, \
+         patch("app.replica.get_document_rows") as mock_rows:
+        assert replica.refresh()
+        with patch.object(replica, "_maybe_start_refresh"):
+            first = replica.search([0.0, 1.0], top_k=1, filters={"repo_name": "java"})
+
+        write(tmp_path, generation=2, rows=ROWS[1:])
+        mock_generation.return_value = (2, "Success")
+        assert replica.refresh()
+
+    mock_rows.assert_not_called()
+    assert first[0].node.get_content() == "héllo"
+    assert replica.stats()["generation"] == 2
+    assert replica.stats()["chunks"] == 1
+
+
+def test_replica_syncs_table_when_snapshot_is_older_than_index(tmp_path):
+    write(tmp_path, generation=1)
+    replica = VectorReplica()
+
+    with patch("app.replica.settings.rag_snapshot_dir", str(tmp_path)), \
+         patch("app.replica.get_index_generation", return_value=(1, "Success")):
+        assert replica.refresh()
+
+    # Row 1 deleted by the web process after the snapshot was written
+    with patch("app.replica.settings.rag_snapshot_dir", str(tmp_path)), \
+         patch("app.replica.get_index_generation", return_value=(2, "Success")), \
+         patch("app.replica.get_document_rows", return_value=(([2], []), "Success")) as mock_rows:
+        assert replica.refresh()
+        with patch.object(replica, "_maybe_start_refresh"):
+            results = replica.search([1.0, 0.0], top_k=5)
+
+    mock_rows.assert_called_once_with([1, 2])
+    assert [n.node.get_content() for n in results] == ["world"]
+    assert replica.stats()["generation"] == 2
+    assert replica.stats()["snapshot_version"] is None